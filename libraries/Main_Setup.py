@@ -86,6 +86,15 @@ class TableWidget(QWidget):
 
     def close_Window(self):
         ''' called by closing event'''
+        # stop running calculations, finished frame pairs are kept in checkpoint and resumed on next calculation
+        thread_batch = getattr(self.tab_batch, "thread_batch", None)
+        if thread_batch != None and thread_batch.isRunning():
+            thread_batch.stopThread()
+            thread_batch.wait()
+        thread_motion = getattr(self.current_ohw, "thread_calculate_motion", None)
+        if thread_motion != None and thread_motion.isRunning():
+            self.current_ohw.stop_motion()
+            thread_motion.wait()
         self.current_ohw.save_ohw() #save on exit (MVs should be automatically saved, peaks might have changed)
         
     def init_ohw(self):
@@ -205,11 +214,9 @@ class TableWidget(QWidget):
         wsize = int((float(img.shape[0]) * float(hpercent)))
         image_scaled = cv2.resize(img, (wsize, widget_height))
         
-        #convert to uint8 if needed
+        #convert to uint8 if needed (e.g. uint16 tifs)
         if img.dtype != 'uint8':
-            image_norm = image_scaled
-            image_norm = cv2.normalize(image_scaled, image_norm, 0, 1, cv2.NORM_MINMAX)*255
-            image_scaled = image_norm.astype(np.uint8)
+            image_scaled = cv2.normalize(image_scaled, None, 0, 255, cv2.NORM_MINMAX, dtype = cv2.CV_8U)
                
         #open the ROI selection
         r = cv2.selectROI('Press Enter to save the currently selected ROI:', image_scaled, fromCenter=False)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import cv2
+
+class MotionAccumulator():
+    """
+        running summary of MV fields, fed frame pair by frame pair (e.g. during OFlowCalc.BM_stack)
+        provides the kinetics (mean absolute motion per frame) and time averaged motions as calculated by
+        OHW.get_mean_absMotion + OHW.calc_TimeAveragedMotion, without another pass over the whole MV array
+        sums are kept in raw units (px/frame), the unit conversion is linear and applied in get_results
+    """
+    def __init__(self):
+        self.frames = 0
+        self.frame_sums = []        # sum of absolute motion of all blocks for each frame
+        self.sum_absMotion = None   # sums over frames for each block
+        self.sum_absMotionX = None
+        self.sum_absMotionY = None
+
+        # same mask as Filters.filter_singlemov, grows with each frame (any movement over time)
+        self.filter_mask = None
+        self.kernel = np.ones((2,2), np.uint8)
+        # motion of moving blocks outside of current filter_mask, {blockindex: [(frame, abs, absX, absY),...]}
+        # dropped as soon as block enters filter_mask, remaining motion is removed if filtered results are requested
+        self.isolated_motion = {}
+
+    def add(self, MotionVectorsX, MotionVectorsY):
+        """
+            adds MV field of next frame pair
+        """
+        # float64: integer MVs (e.g. int8 from a checkpoint) would overflow / lose precision
+        MotionVectorsX, MotionVectorsY = np.asarray(MotionVectorsX, dtype = np.float64), np.asarray(MotionVectorsY, dtype = np.float64)
+        absMotionX, absMotionY = np.abs(MotionVectorsX), np.abs(MotionVectorsY)
+        absMotion = np.sqrt(MotionVectorsX*MotionVectorsX + MotionVectorsY*MotionVectorsY)
+
+        if self.sum_absMotion is None:
+            self.sum_absMotion = np.zeros(absMotion.shape)
+            self.sum_absMotionX = np.zeros(absMotion.shape)
+            self.sum_absMotionY = np.zeros(absMotion.shape)
+            self.filter_mask = np.zeros(absMotion.shape, dtype=bool)
+
+        self.frame_sums.append(absMotion.sum())
+        self.sum_absMotion += absMotion
+        self.sum_absMotionX += absMotionX
+        self.sum_absMotionY += absMotionY
+
+        move = absMotion > 0
+        kept = cv2.dilate(cv2.erode(move.astype(np.uint8), self.kernel), self.kernel).astype(bool)
+        self.filter_mask |= kept
+        for blockindex in [blockindex for blockindex in self.isolated_motion if self.filter_mask.flat[blockindex]]:
+            del self.isolated_motion[blockindex]
+        for blockindex in np.flatnonzero(move & ~self.filter_mask):
+            self.isolated_motion.setdefault(blockindex, []).append((self.frames, absMotion.flat[blockindex],
+                absMotionX.flat[blockindex], absMotionY.flat[blockindex]))
+
+        self.frames += 1
+
+    def get_results(self, filter = False, unitfactor = 1.0):
+        """
+            returns mean_absMotions, avg_absMotion, avg_MotionX, avg_MotionY, max_avgMotion
+            filter: remove single moving spots as Filters.filter_singlemov
+            unitfactor: conversion of raw MVs to units, e.g. microns_per_px * fps / (delay * scalingfactor)
+        """
+        frame_sums = np.array(self.frame_sums)
+        sum_absMotion, sum_absMotionX, sum_absMotionY = np.copy(self.sum_absMotion), np.copy(self.sum_absMotionX), np.copy(self.sum_absMotionY)
+
+        if filter:
+            for blockindex, motions in self.isolated_motion.items():
+                for frame, absMotion, absMotionX, absMotionY in motions:
+                    frame_sums[frame] -= absMotion
+                sum_absMotion.flat[blockindex], sum_absMotionX.flat[blockindex], sum_absMotionY.flat[blockindex] = 0, 0, 0
+
+        # mean over blocks which move at any time, see OHW.get_mean_absMotion
+        moving_blocks = np.count_nonzero(sum_absMotion)
+        if moving_blocks > 0:
+            mean_absMotions = frame_sums / moving_blocks * unitfactor
+        else:
+            mean_absMotions = np.full(self.frames, np.nan)
+
+        avg_absMotion = sum_absMotion / self.frames * unitfactor
+        avg_MotionX = sum_absMotionX / self.frames * unitfactor
+        avg_MotionY = sum_absMotionY / self.frames * unitfactor
+        max_avgMotion = np.max([avg_absMotion, avg_MotionX, avg_MotionY])
+
+        return mean_absMotions, avg_absMotion, avg_MotionX, avg_MotionY, max_avgMotion
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import pathlib, hashlib, pickle, os
+import numpy as np
+from libraries import videoreader
+
+# parameters passed to calculate_motion which don't influence the calculated motion
+# (e.g. performance settings or batch options) -> not part of cache key
+ignored_parameters = ["processes", "threads", "scaling", "heatmaps", "quivers", "filter", "autoPeak", "global_resultsfolder"]
+
+class MotionCache():
+    """
+        persistent on-disk cache of calculated motion (MVs or absolute motion)
+        key: hash of analysisImageStack content + method + motion parameters + roi + px_longest
+        each entry is one pickle file in folder, total size is limited to max_bytes
+        least recently used entries are removed first (modification time is updated on each hit)
+    """
+    def __init__(self, folder = "motion_cache", max_bytes = 2*1024**3, enabled = True):
+        self.folder = pathlib.Path(folder)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config):
+        """
+            creates cache with settings of section MOTION CACHE in config, falls back to defaults if not found
+        """
+        folder = config.get('MOTION CACHE', 'folder', fallback = "motion_cache")
+        max_bytes = int(config.getfloat('MOTION CACHE', 'max_size_mb', fallback = 2048) * 1024**2)
+        enabled = config.getboolean('MOTION CACHE', 'enabled', fallback = True)
+        return cls(folder, max_bytes, enabled)
+
+    def get_key(self, imageStack, method, parameters, analysis_meta):
+        """
+            hash of imagestack content (framewise, no copy of whole stack) and all settings influencing the motion
+        """
+        stack_hash = hashlib.sha1()
+        stack_hash.update(str((imageStack.shape, imageStack.dtype.str)).encode())
+        if isinstance(imageStack, videoreader.FrameStack):
+            # frames are read from disk on demand, identified by files instead of reading whole video again
+            stack_hash.update(imageStack.fingerprint().encode())
+        else:
+            for frame in imageStack:
+                stack_hash.update(np.ascontiguousarray(frame).data)
+
+        settings = [("method", method), ("roi", analysis_meta.get("roi")), ("px_longest", analysis_meta.get("px_longest"))]
+        for name in sorted(parameters):
+            if name in ignored_parameters:
+                continue
+            value = parameters[name]
+            if isinstance(value, np.ndarray):
+                value = hashlib.sha1(np.ascontiguousarray(value).data).hexdigest()
+            settings.append((name, value))
+
+        key_hash = hashlib.sha1(stack_hash.digest())
+        key_hash.update(repr(settings).encode())
+        return key_hash.hexdigest()
+
+    def get_file(self, key):
+        return self.folder / (key + ".pickle")
+
+    def load(self, key):
+        """
+            returns cached data of key or None if not in cache
+        """
+        if not self.enabled:
+            return None
+        cachefile = self.get_file(key)
+        try:
+            with open(str(cachefile), 'rb') as loadfile:
+                data = pickle.load(loadfile)
+            os.utime(str(cachefile))  # mark as recently used
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return data
+
+    def save(self, key, data):
+        """
+            stores data under key, evicts least recently used entries if size limit is exceeded
+            entry is written to temporary file first -> no corrupt entries if interrupted
+        """
+        if not self.enabled:
+            return
+        self.folder.mkdir(parents = True, exist_ok = True)
+        cachefile = self.get_file(key)
+        tempfile = cachefile.with_suffix(".tmp")
+        with open(str(tempfile), 'wb') as writefile:
+            pickle.dump(data, writefile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tempfile), str(cachefile))
+        self.evict()
+
+    def evict(self):
+        """
+            removes least recently used entries until total size <= max_bytes
+        """
+        entries = []
+        for cachefile in self.folder.glob("*.pickle"):
+            stat = cachefile.stat()
+            entries.append((stat.st_mtime, stat.st_size, cachefile))
+        entries.sort(key = lambda entry: entry[0])
+
+        total_bytes = sum(entry[1] for entry in entries)
+        for mtime, size, cachefile in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                cachefile.unlink()
+            except OSError:  # e.g. removed by other process meanwhile
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for cachefile in self.folder.glob("*.pickle"):
+            cachefile.unlink()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import pathlib, pickle, os, time
+import numpy as np
+
+class MotionCheckpoint():
+    """
+        checkpoint of a running blockmatching in the results folder, allows to resume after crash or stop
+        MVs of finished frame pairs are written into a memmap (motion_checkpoint.npy),
+        number of finished frame pairs + key of calculation (see MotionCache.get_key) into motion_checkpoint.pickle
+        the number of finished pairs is updated at most every interval seconds, after flushing the memmap
+        -> counter never covers frame pairs which are not on disk yet
+    """
+    def __init__(self, folder, key, interval = 10):
+        self.folder = pathlib.Path(folder)
+        self.key = key
+        self.interval = interval
+        self.datafile = self.folder / "motion_checkpoint.npy"
+        self.metafile = self.folder / "motion_checkpoint.pickle"
+        self.MotionVectorsAll = None
+        self.finished = 0
+        self.last_save = time.time()
+
+    @classmethod
+    def from_config(cls, config, folder, key):
+        """
+            creates checkpoint with settings of section MOTION CHECKPOINT in config,
+            returns None if checkpoints are disabled or no folder is set
+        """
+        if folder == "" or not config.getboolean('MOTION CHECKPOINT', 'enabled', fallback = True):
+            return None
+        interval = config.getfloat('MOTION CHECKPOINT', 'interval', fallback = 10)
+        return cls(folder, key, interval)
+
+    def load_meta(self):
+        try:
+            with open(str(self.metafile), 'rb') as loadfile:
+                return pickle.load(loadfile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def open(self, shape, dtype):
+        """
+            returns array to store all MVs in (memmap) and number of already finished frame pairs
+            continues checkpoint of same calculation (key, shape, dtype) if found, starts new one otherwise
+        """
+        meta = self.load_meta()
+        if meta != None and (meta["key"], tuple(meta["shape"]), meta["dtype"]) == (self.key, tuple(shape), np.dtype(dtype).str):
+            try:
+                self.MotionVectorsAll = np.lib.format.open_memmap(str(self.datafile), mode = 'r+')
+                self.finished = meta["finished"]
+                print("resuming motion calculation from checkpoint after", self.finished, "frame pairs")
+            except (OSError, ValueError):
+                self.MotionVectorsAll = None
+
+        if self.MotionVectorsAll is None:
+            self.folder.mkdir(parents = True, exist_ok = True)
+            self.finished = 0
+            self.save_meta(shape, dtype) # invalidate old checkpoint before its data is overwritten
+            self.MotionVectorsAll = np.lib.format.open_memmap(str(self.datafile), mode = 'w+', dtype = dtype, shape = tuple(shape))
+
+        self.last_save = time.time()
+        return self.MotionVectorsAll, self.finished
+
+    def save_meta(self, shape, dtype):
+        tempfile = self.metafile.with_suffix(".tmp")
+        with open(str(tempfile), 'wb') as writefile:
+            pickle.dump({"key": self.key, "shape": tuple(shape), "dtype": np.dtype(dtype).str, "finished": self.finished},
+                writefile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tempfile), str(self.metafile))
+
+    def update(self, finished, force = False):
+        """
+            marks first finished frame pairs as done, written to disk if interval has passed (or force)
+        """
+        if not force and time.time() - self.last_save < self.interval:
+            return
+        self.MotionVectorsAll.flush()
+        self.finished = finished
+        self.save_meta(self.MotionVectorsAll.shape, self.MotionVectorsAll.dtype)
+        self.last_save = time.time()
+
+    def remove(self):
+        """
+            deletes checkpoint files, e.g. when calculation is finished
+        """
+        self.MotionVectorsAll = None # release memmap before file can be deleted
+        for checkpointfile in [self.metafile, self.datafile]:
+            try:
+                checkpointfile.unlink()
+            except OSError:
+                pass
@@ -4,11 +4,19 @@ import cv2
 import math
 import numpy as np
 import time
+import tempfile, pathlib, shutil
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from skimage import feature, morphology
-from skimage.measure import block_reduce
-from scipy.ndimage import binary_fill_holes
+from scipy.ndimage import binary_fill_holes, median_filter
+from libraries import videoreader
+
+try:
+    import numba    # optional, compiled blockmatching kernel (engine 'numba')
+except ImportError:
+    numba = None
 
 """
     currently offered methods for OFlow calculation (for 2 images)
@@ -17,26 +25,89 @@ from scipy.ndimage import binary_fill_holes
     - GunnarFarnebäck (GF_single)
     
     for stack:
-    - Blockmatch (BM_stack)
+    - Blockmatch (BM_stack), optionally distributed over several processes (BM_stack_parallel)
+      or as generator yielding each frame pair when finished (BM_stack_iter)
+    - GunnarFarnebäck (GF_stack)
+    - LucasKanade (LK_stack)
+    - normalized FFT correlation of blocks (PC_stack)
+    - Blockmatch relative to a fixed reference frame (BM_reference_stack), gives displacement of each frame
+    
+    intensity based motion (no MVs) for stack:
+    - MuscleMotion (MM_stack)
+    
+    engines for Blockmatch of 2 images (select via engine in BM_stack):
+    - 'template': matchTemplate for each single block (BM_single)
+    - 'pyramid': coarse-to-fine search on image pyramid (BM_single_pyramid)
+    - 'numba': compiled SSD kernel over all blocks in parallel, only if numba is installed (BM_single_numba)
+    - 'boxfilter': SSD of all blocks per shift from integral image, for dense grids of overlapping blocks (BM_single_boxfilter)
+    default (engine None): 'numba' for exhaustive search if available, 'template' otherwise,
+    'boxfilter' for grids with stride != blockwidth (see get_block_grid)
+    all exact engines select the shift of each block by the same tie rule on float64 SSD (see select_MV_shifts), 
+    i.e. give the same MVs as BM_getMV for integer valued images (see check_BM_parity)
+    capabilities of each engine: see BM_engines, fastest exact engine for a stack: see benchmark_BM_engines
+    
+    all methods for stack are registered in motion_backends (selected by method in OHW.calculate_motion)
 
 """
 
-def LK_single(img_prev, img_curr):
-    # insert cv2 code
-    pass
+def LK_single(img_prev, img_curr, blockwidth, searchblocks=None):
+    """
+        gets optical flow by pyramidal Lucas-Kanade between 2 images (uint8)
+        only the centers of the blocks selected in searchblocks are tracked
+        returns MVs in the same grid as BM_single, blocks which are not tracked have zero motion
+    """
+    
+    size_ver, size_hor = img_prev.shape[:2]
+    MVs_ver = math.floor(size_ver/blockwidth)
+    MVs_hor = math.floor(size_hor/blockwidth)
+    
+    if type(searchblocks) != np.ndarray:
+        searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+    
+    MotionVectorsX = np.zeros(shape = (MVs_ver,MVs_hor))
+    MotionVectorsY = np.zeros(shape = (MVs_ver,MVs_hor))
+    
+    rows, cols = np.nonzero(searchblocks)
+    if rows.size == 0:
+        return MotionVectorsX, MotionVectorsY
+    
+    points_prev = np.stack((cols*blockwidth + blockwidth/2, rows*blockwidth + blockwidth/2), axis=-1)
+    points_prev = points_prev.astype(np.float32).reshape(-1,1,2)
+    
+    points_curr, status, err = cv2.calcOpticalFlowPyrLK(img_prev, img_curr, points_prev, None, 
+        winSize = (blockwidth, blockwidth), maxLevel = 3, 
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    
+    flow = (points_curr - points_prev).reshape(-1,2)
+    found = status.ravel() == 1     # points which could not be tracked keep zero motion
+    MotionVectorsX[rows[found], cols[found]] = flow[found,0]
+    MotionVectorsY[rows[found], cols[found]] = flow[found,1]
+    
+    return MotionVectorsX, MotionVectorsY
 
-def BM_single(img_prev, img_curr, max_shift, blockwidth, searchblocks=None):
+def BM_single(img_prev, img_curr, max_shift, blockwidth, searchblocks=None, threads=1, search='exhaustive', stats=None, 
+    predicted=None, radius=2, threshold=0.1, active_blocks=None):
     """
         gets optical flow by block matching between 2 images with parameters of max_shift and blockwidth
         searchblocks = bool array with dimensions of resulting motion vector array, specifies if motion will be calculated in this block
+        active_blocks = compact index of searchblocks (see get_active_blocks), pass to avoid rebuilding it for each frame pair
+        threads > 1 distributes the rows of blocks over a thread pool (cv2 releases the GIL during matching)
+        search selects exhaustive search or a fast search pattern (see BM_searches, BM_fastsearch)
+        search 'predictive' refines predicted MVs (tuple of X, Y arrays, e.g. from previous frame pair) 
+        by a search of +- radius, see BM_predictive, without predicted MVs an exhaustive search is done
+        number of evaluated candidate shifts is added to stats["candidates"] if stats dict is provided,
+        number of predictive searches which fell back to exhaustive search to stats["fallbacks"]
     """
 
     size_ver, size_hor = img_prev.shape[:2]
     MVs_ver = math.floor(size_ver/blockwidth)   # number of MVs in horizontal direction
     MVs_hor = math.floor(size_hor/blockwidth)
+    img_prev, img_curr = get_match_image(img_prev), get_match_image(img_curr)
     
-    if type(searchblocks) != np.ndarray:
-        searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool) # is done for each calculation, optimize...
+    if active_blocks is None:
+        if type(searchblocks) != np.ndarray:
+            searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+        active_blocks = get_active_blocks(searchblocks, blockwidth)
     
     # pad image to enable searching at edge
     # e.g. for max_shift = 7 -> 2x7 + 1 possible shifts
@@ -70,35 +141,139 @@ def BM_single(img_prev, img_curr, max_shift, blockwidth, searchblocks=None):
     MotionVectorsX = np.zeros(shape = (MVs_ver,MVs_hor))
     MotionVectorsY = np.zeros(shape = (MVs_ver,MVs_hor))
     
-    # iterate over blocks
-    for rowidx in range(MVs_ver):   # np.arange or range? use numpy/ parallelize better!
-        for colidx in range(MVs_hor):
-        
-            #if np.any(cleaned[rowidx*blockwidth:rowidx*blockwidth+blockwidth,colidx*blockwidth:colidx*blockwidth+blockwidth]):
-            if searchblocks[rowidx,colidx] == True:
-                patternToFind = img_prev[rowidx*blockwidth:rowidx*blockwidth+blockwidth,colidx*blockwidth:colidx*blockwidth+blockwidth]
-                searchRegion = img_curr[rowidx*blockwidth:rowidx*blockwidth+blockwidth+2*max_shift,colidx*blockwidth:colidx*blockwidth+blockwidth+2*max_shift]
-                        
+    candidates = np.zeros(MVs_ver, dtype=np.int64)  # evaluated candidate shifts per row
+    fallbacks = np.zeros(MVs_ver, dtype=np.int64)   # predictive searches falling back to exhaustive search per row
+    if search == 'predictive' and predicted is None:
+        search = 'exhaustive'
+    
+    def match_row(active_row):
+        # each row writes only into its own row of MotionVectorsX/Y, MVs of inactive blocks stay 0
+        rowidx, colidxs, top, lefts = active_row
+        for colidx, left in zip(colidxs, lefts):
+            patternToFind = img_prev[top:top+blockwidth, left:left+blockwidth]
+            searchRegion = img_curr[top:top+blockwidth+2*max_shift, left:left+blockwidth+2*max_shift]
+            
+            if search == 'exhaustive':
                 MotionVectorsX[rowidx, colidx], MotionVectorsY[rowidx, colidx] = BM_getMV(patternToFind, searchRegion, max_shift)
-        
+                candidates[rowidx] += (2*max_shift+1)**2
             else:
-                MotionVectorsX[rowidx, colidx], MotionVectorsY[rowidx, colidx] = 0,0
+                prediction = (int(predicted[0][rowidx, colidx]), int(predicted[1][rowidx, colidx]))
+                xMotion, yMotion, block_candidates, fallback = BM_predictive(patternToFind, searchRegion, max_shift, prediction, radius, threshold)
+                MotionVectorsX[rowidx, colidx], MotionVectorsY[rowidx, colidx] = xMotion, yMotion
+                candidates[rowidx] += block_candidates
+                fallbacks[rowidx] += fallback
+    
+    def match_rows(rows):
+        # fast search patterns: all blocks of a group of rows at once
+        tops = np.array([row[2] for row in rows for left in row[3]], dtype=int)
+        lefts = np.array([left for row in rows for left in row[3]], dtype=int)
+        rowidxs = np.array([row[0] for row in rows for left in row[3]], dtype=int)
+        colidxs = np.array([colidx for row in rows for colidx in row[1]], dtype=int)
+        xMotion, yMotion, group_candidates = BM_fastsearch(img_prev, img_curr, tops, lefts, blockwidth, max_shift, search)
+        MotionVectorsX[rowidxs, colidxs], MotionVectorsY[rowidxs, colidxs] = xMotion, yMotion
+        candidates[rows[0][0]] += group_candidates
+    
+    if search in ['exhaustive', 'predictive']:
+        # iterate over rows of active blocks only
+        map_rows(match_row, active_blocks, threads)
+    else:
+        groups = max(1, min(threads, len(active_blocks)))
+        map_rows(match_rows, [active_blocks[group::groups] for group in range(groups) if len(active_blocks[group::groups]) > 0], threads)
+    
+    if stats != None:
+        stats["candidates"] = stats.get("candidates", 0) + int(candidates.sum())
+        if search == 'predictive':
+            stats["fallbacks"] = stats.get("fallbacks", 0) + int(fallbacks.sum())
                 
     return MotionVectorsX, MotionVectorsY
 
+def get_match_image(image):
+    """
+        returns image in a dtype supported by cv2 matchTemplate (uint8 or float32)
+        other dtypes (e.g. uint16 tifs) are converted to float32, only single frames are converted, not the whole stack
+    """
+    if image.dtype == np.uint8 or image.dtype == np.float32:
+        return image
+    return image.astype(np.float32)
+
+def map_rows(row_function, rows, threads = 1):
+    """
+        calls row_function for each row (e.g. row index or entry of active blocks), distributed over a thread pool if threads > 1
+    """
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers = threads) as executor:
+            list(executor.map(row_function, rows)) # list() raises exceptions of rows
+    else:
+        for row in rows:
+            row_function(row)
+
+def get_active_blocks(searchblocks, blockwidth):
+    """
+        compact index of the blocks selected in searchblocks, grouped by rows of blocks
+        returns list of (rowidx, colidxs, top, lefts) for each row containing active blocks,
+        top and lefts are the pixel coordinates of the blocks
+        -> matchers only visit active blocks instead of checking every block
+    """
+    active_blocks = []
+    for rowidx in np.flatnonzero(np.any(searchblocks, axis=1)):
+        colidxs = np.flatnonzero(searchblocks[rowidx])
+        active_blocks.append((int(rowidx), colidxs.tolist(), int(rowidx)*blockwidth, (colidxs*blockwidth).tolist()))
+    return active_blocks
+
+def get_block_grid(shape, blockwidth, stride = None):
+    """
+        number of blocks (MVs_ver, MVs_hor) in image of shape (rows, cols)
+        block (i, j) covers blockwidth x blockwidth pixels from pixel (i*stride, j*stride) on
+        stride None = blockwidth (non-overlapping blocks), stride < blockwidth gives a denser grid of overlapping blocks
+    """
+    stride = stride or blockwidth
+    return max(0, (shape[0] - blockwidth)//stride + 1), max(0, (shape[1] - blockwidth)//stride + 1)
+
+def get_block_centers(grid, blockwidth, stride = None):
+    """
+        pixel coordinates (centers_y, centers_x) of the block centers of grid (MVs_ver, MVs_hor), see get_block_grid
+    """
+    stride = stride or blockwidth
+    return np.arange(grid[0])*stride + blockwidth/2, np.arange(grid[1])*stride + blockwidth/2
+
+def get_block_sums(image, blockwidth, stride, grid):
+    """
+        sum of image over each block of grid (see get_block_grid), read from the integral image
+        -> cost does not depend on the number of blocks, e.g. for dense grids of overlapping blocks
+        sums are calculated in float64
+    """
+    integral = cv2.integral(image, sdepth = cv2.CV_64F)
+    tops, lefts = slice(0, grid[0]*stride, stride), slice(0, grid[1]*stride, stride)
+    bottoms, rights = slice(blockwidth, blockwidth + grid[0]*stride, stride), slice(blockwidth, blockwidth + grid[1]*stride, stride)
+    return integral[bottoms, rights] - integral[tops, rights] - integral[bottoms, lefts] + integral[tops, lefts]
+
+# methods of cv2 matchTemplate, selected by methodnr in BM_getMV
+match_methods = [cv2.TM_CCOEFF, cv2.TM_CCOEFF_NORMED, cv2.TM_CCORR,
+                cv2.TM_CCORR_NORMED, cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]
+
 def BM_getMV(patternToFind, searchRegion, max_shift, methodnr = 4):
     """
         gets single MV at specified region, works with cv2 matchTemplate, specify method with methodnr
     """
-    methods = ['cv2.TM_CCOEFF', 'cv2.TM_CCOEFF_NORMED', 'cv2.TM_CCORR',
-                'cv2.TM_CCORR_NORMED', 'cv2.TM_SQDIFF', 'cv2.TM_SQDIFF_NORMED']    
-    method = eval(methods[methodnr])
+    method = match_methods[methodnr]
     
     matchResult = cv2.matchTemplate(searchRegion, patternToFind, method)
     min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matchResult)
     
-    # If the method is TM_SQDIFF or TM_SQDIFF_NORMED, take minimum
-    if method in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
+    if method == cv2.TM_SQDIFF:
+        # matchTemplate calculates in float32 (relative error < 1e-6): shifts close to the minimum are compared by exact SSD
+        tol = 1e-5 * (cv2.norm(patternToFind, cv2.NORM_L2SQR) + min_val)
+        candidates = np.flatnonzero(matchResult <= min_val + tol)
+        if len(candidates) > 1:
+            nshifts_hor = matchResult.shape[1]
+            exact = get_exact_SSD(patternToFind[None], searchRegion, candidates // nshifts_hor, candidates % nshifts_hor)
+            best = select_MV_shifts(exact[None], -1)[0] # tie rule of all exact engines, -1: ambiguous
+            best = candidates[best] if best >= 0 else max_shift*nshifts_hor + max_shift
+            min_loc = (best % nshifts_hor, best // nshifts_hor)
+        return min_loc[0] - max_shift, min_loc[1] - max_shift
+    
+    # If the method is TM_SQDIFF_NORMED, take minimum
+    if method == cv2.TM_SQDIFF_NORMED:
         top_left = min_loc
         
         # for matlab comparison
@@ -114,8 +289,619 @@ def BM_getMV(patternToFind, searchRegion, max_shift, methodnr = 4):
     yMotion = top_left[1] - max_shift
     
     return xMotion, yMotion
+
+def select_MV_shifts(costs, center, exact_costs = None, tol = 0):
+    """
+        tie rule of all exact blockmatching engines: index of the shift with minimum SSD for each block (row of costs, 
+        shifts in row-major order), ambiguous minimum (several shifts with equal SSD) -> center (no motion)
+        costs with rounding errors (e.g. float32 of matchTemplate, FFT) are compared by exact SSD: shifts within tol 
+        of the minimum are recomputed by exact_costs(blocks, shifts) in float64 first (see get_exact_SSD)
+        BM_numba_kernel applies the same rule to the float64 SSD accumulated in the kernel
+    """
+    costs = np.asarray(costs, dtype = np.float64)
+    if exact_costs != None:
+        near = costs <= costs.min(axis=1)[:, None] + tol
+        if np.any(np.count_nonzero(near, axis=1) > 1):
+            blocks, shifts = np.nonzero(near)
+            costs = np.where(near, costs, np.inf)  # other shifts are worse in any case
+            costs[blocks, shifts] = exact_costs(blocks, shifts)
+    best = costs.argmin(axis=1)
+    min_cost = costs[np.arange(len(costs)), best]
+    best[np.count_nonzero(costs == min_cost[:, None], axis=1) != 1] = center
+    return best
+
+def get_exact_SSD(blocks, image, tops, lefts):
+    """
+        SSD in float64 of blocks (n x height x width) and the windows of image with upper left corners (tops, lefts)
+    """
+    windows = get_blocks(image, tops, lefts, blocks.shape[1], blocks.shape[2]).astype(np.float64) - blocks
+    return np.einsum('ijk,ijk->i', windows, windows)
+    
+# patterns of fast searches (offsets to current center)
+large_diamond = [(0,-2), (-1,-1), (1,-1), (-2,0), (2,0), (-1,1), (1,1), (0,2)]
+small_diamond = [(0,-1), (-1,0), (1,0), (0,1)]
+
+def BM_fastsearch(img_prev, img_curr, tops, lefts, blockwidth, max_shift, search):
+    """
+        gets MVs of blocks (upper left corners tops, lefts in img_prev) by a fast search pattern from video coding,
+        approximate: the pattern can get stuck in a local minimum of the SSD, i.e. differ from exhaustive search
+        img_curr is padded by max_shift (as in BM_single)
+        each step evaluates one candidate shift of all blocks at once (SSD, same cost as TM_SQDIFF), each shift at most once per block
+        - 'threestep': three-step search with halving step size
+        - 'diamond': large diamond until center is best, then small diamond
+        - 'arps': adaptive rood pattern, arm length from MV of left neighbouring block (blocks are processed column by column)
+        on equal cost the current center is kept, i.e. zero motion is preferred
+        returns MVs X, Y of the blocks, number of evaluated candidates
+    """
+    blocks = get_blocks(img_prev, tops, lefts, blockwidth).astype(np.float32)
+    # view of all blocks of padded img_curr, indexed by upper left corner
+    windows = np.lib.stride_tricks.as_strided(img_curr, 
+        shape = (img_curr.shape[0] - blockwidth + 1, img_curr.shape[1] - blockwidth + 1, blockwidth, blockwidth), 
+        strides = img_curr.strides[:2] + img_curr.strides[:2], writeable = False)
+    width = 2*max_shift + 1
+    costs = np.full((len(tops), width, width), np.nan)   # evaluated costs of each block, indexed by shift + max_shift
+    
+    def cost(idx, xMotion, yMotion):
+        valid = (np.abs(xMotion) <= max_shift) & (np.abs(yMotion) <= max_shift)
+        xIdx, yIdx = np.where(valid, xMotion, 0) + max_shift, np.where(valid, yMotion, 0) + max_shift
+        block_costs = costs[idx, yIdx, xIdx]
+        new = valid & np.isnan(block_costs)
+        if np.any(new):
+            new_idx, new_x, new_y = idx[new], xIdx[new], yIdx[new]
+            diff = windows[tops[new_idx] + new_y, lefts[new_idx] + new_x].astype(np.float32) - blocks[new_idx]
+            block_costs[new] = np.einsum('ijk,ijk->i', diff, diff, dtype = np.float64)
+            costs[new_idx, new_y, new_x] = block_costs[new]
+        block_costs[~valid] = np.inf
+        return block_costs
+    
+    def best_of(idx, centerX, centerY, offsets):
+        bestX, bestY, best_cost = centerX.copy(), centerY.copy(), cost(idx, centerX, centerY)
+        for x_offset, y_offset in offsets:
+            candidate_cost = cost(idx, centerX + x_offset, centerY + y_offset)
+            better = candidate_cost < best_cost
+            bestX[better], bestY[better], best_cost[better] = (centerX + x_offset)[better], (centerY + y_offset)[better], candidate_cost[better]
+        return bestX, bestY
+    
+    def descend(idx, centerX, centerY, offsets, iterations):
+        # moves center to best candidate of offsets until center is best (or iterations are reached)
+        moving = np.arange(len(idx))
+        for iteration in range(iterations):
+            newX, newY = best_of(idx[moving], centerX[moving], centerY[moving], offsets)
+            moved = (newX != centerX[moving]) | (newY != centerY[moving])
+            centerX[moving], centerY[moving] = newX, newY
+            moving = moving[moved]
+            if len(moving) == 0:
+                break
+        return centerX, centerY
+    
+    allidx = np.arange(len(tops))
+    MotionVectorsX, MotionVectorsY = np.zeros(len(tops), dtype=int), np.zeros(len(tops), dtype=int)
+    if search == 'threestep':
+        step = 2**max(0, math.ceil(math.log2(max_shift + 1)) - 1)
+        while step >= 1:
+            MotionVectorsX, MotionVectorsY = best_of(allidx, MotionVectorsX, MotionVectorsY, 
+                [(x*step, y*step) for y in (-1,0,1) for x in (-1,0,1)])
+            step = step // 2
+    
+    elif search == 'diamond':
+        # limit iterations, center reaches border at latest
+        MotionVectorsX, MotionVectorsY = descend(allidx, MotionVectorsX, MotionVectorsY, large_diamond, 2*max_shift)
+        MotionVectorsX, MotionVectorsY = best_of(allidx, MotionVectorsX, MotionVectorsY, small_diamond)
+    
+    elif search == 'arps':
+        # index of each block in grid of blocks, -1 for inactive blocks
+        lookup = np.full((tops.max()//blockwidth + 1, lefts.max()//blockwidth + 1), -1, dtype=int)
+        lookup[tops//blockwidth, lefts//blockwidth] = allidx
+        for left in np.unique(lefts):
+            idx = np.flatnonzero(lefts == left)
+            # MV of left neighbour as prediction, 0 if it is not an active block
+            neighbour = lookup[tops[idx]//blockwidth, left//blockwidth - 1] if left > 0 else np.full(len(idx), -1)
+            predX = np.where(neighbour >= 0, MotionVectorsX[neighbour], 0)
+            predY = np.where(neighbour >= 0, MotionVectorsY[neighbour], 0)
+            
+            arm = np.maximum(np.abs(predX), np.abs(predY))
+            arm[arm == 0] = 2
+            zero = np.zeros(len(idx), dtype=int)
+            centerX, centerY = best_of(idx, zero, zero, [(arm,zero), (-arm,zero), (zero,arm), (zero,-arm), (predX,predY)])
+            # unit rood refinement
+            MotionVectorsX[idx], MotionVectorsY[idx] = descend(idx, centerX, centerY, small_diamond, 4*max_shift)
+    
+    return MotionVectorsX, MotionVectorsY, int(np.count_nonzero(~np.isnan(costs)))
+
+def BM_predictive(patternToFind, searchRegion, max_shift, predicted, radius = 2, threshold = 0.1):
+    """
+        gets single MV by refining the predicted MV (e.g. of same block in previous frame pair) within +- radius
+        falls back to exhaustive search (BM_getMV) if the refined match is not reliable:
+        - best match on edge of refinement window (motion might continue beyond window)
+        - ambiguous minimum
+        - SSD of best match > threshold * sum of squared deviations of pattern from its mean (scale independent)
+        returns xMotion, yMotion, number of evaluated candidates, True if fallback was needed
+    """
+    limit = max_shift - radius  # window has to stay within +- max_shift
+    if limit < 0:
+        xMotion, yMotion = BM_getMV(patternToFind, searchRegion, max_shift)
+        return xMotion, yMotion, (2*max_shift+1)**2, False
+    
+    blockwidth_ver, blockwidth_hor = patternToFind.shape[:2]
+    predX, predY = min(max(predicted[0], -limit), limit), min(max(predicted[1], -limit), limit)
+    top, left = max_shift + predY - radius, max_shift + predX - radius
+    window = searchRegion[top:top+blockwidth_ver+2*radius, left:left+blockwidth_hor+2*radius]
+    
+    matchResult = cv2.matchTemplate(window, patternToFind, cv2.TM_SQDIFF)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matchResult)
+    xMotion, yMotion = predX + min_loc[0] - radius, predY + min_loc[1] - radius
+    
+    on_edge = ((abs(min_loc[0] - radius) == radius and abs(xMotion) < max_shift) 
+        or (abs(min_loc[1] - radius) == radius and abs(yMotion) < max_shift))
+    ambiguous = np.count_nonzero(matchResult == min_val) != 1
+    pattern_energy = cv2.meanStdDev(patternToFind)[1][0,0]**2 * patternToFind.size
+    
+    if on_edge or ambiguous or min_val > threshold * pattern_energy:
+        xMotion, yMotion = BM_getMV(patternToFind, searchRegion, max_shift)
+        return xMotion, yMotion, (2*radius+1)**2 + (2*max_shift+1)**2, True
+    
+    return xMotion, yMotion, (2*radius+1)**2, False
+
+def get_prediction(MotionVectorsX, MotionVectorsY):
+    """
+        predicted MVs for next frame pair: median of each block and its 4 direct neighbours
+        (suppresses single outliers of the previous frame pair)
+    """
+    cross = np.array([[0,1,0],[1,1,1],[0,1,0]], dtype=bool)
+    return (median_filter(MotionVectorsX, footprint = cross, mode = 'nearest'), 
+        median_filter(MotionVectorsY, footprint = cross, mode = 'nearest'))
+
+BM_searches = ['exhaustive', 'threestep', 'diamond', 'arps', 'predictive']
+
+def BM_single_pyramid(img_prev, img_curr, max_shift, blockwidth, searchblocks=None, threads=1, refine=1, active_blocks=None, 
+    chunksize=1024):
+    """
+        gets optical flow by coarse-to-fine block matching between 2 images
+        full search is only done on the coarsest level of an image pyramid (2x or 4x downsampled, see get_pyramid_levels),
+        for all blocks at once: one shifted difference image per candidate shift
+        each finer level refines the doubled MV of the coarser level by a search of +- refine pixels, 
+        vectorized over chunks of blocks (chunks distributed over threads)
+        -> e.g. 3280 instead of 57600 compared pixels per block for blockwidth 16, max_shift 7
+        MVs are limited to max_shift as in BM_single, on ties the first candidate is kept (center on coarsest level, 
+        prediction on finer levels)
+        active_blocks = compact index of searchblocks (see get_active_blocks)
+    """
+    
+    size_ver, size_hor = img_prev.shape[:2]
+    MVs_ver = math.floor(size_ver/blockwidth)
+    MVs_hor = math.floor(size_hor/blockwidth)
+    
+    if active_blocks is None:
+        if type(searchblocks) != np.ndarray:
+            searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+        active_blocks = get_active_blocks(searchblocks, blockwidth)
+    rows = np.array([row[0] for row in active_blocks for col in row[1]], dtype=int)
+    cols = np.array([col for row in active_blocks for col in row[1]], dtype=int)
+    
+    img_prev, img_curr = img_prev.astype(np.float32), img_curr.astype(np.float32)
+    levels = get_pyramid_levels(max_shift, blockwidth)
+    pyramid_prev, pyramid_curr = [img_prev], [img_curr]
+    for level in range(levels):
+        pyramid_prev.append(cv2.pyrDown(pyramid_prev[-1]))
+        pyramid_curr.append(cv2.pyrDown(pyramid_curr[-1]))
+    
+    # full search on coarsest level
+    bw_level = blockwidth >> levels
+    shift_level = -(-max_shift >> levels)    # max_shift on this level, rounded up
+    height, width = MVs_ver*bw_level, MVs_hor*bw_level
+    level_prev = pyramid_prev[levels][:height, :width]
+    level_curr = cv2.copyMakeBorder(pyramid_curr[levels],shift_level,shift_level,shift_level,shift_level,cv2.BORDER_REPLICATE)
+    shifts = [(0,0)] + [(x,y) for y in range(-shift_level, shift_level+1) for x in range(-shift_level, shift_level+1) if (x,y) != (0,0)]
+    
+    best = np.full((MVs_ver, MVs_hor), np.inf, dtype=np.float32)
+    MotionVectorsX = np.zeros(shape = (MVs_ver,MVs_hor))
+    MotionVectorsY = np.zeros(shape = (MVs_ver,MVs_hor))
+    for xMotion, yMotion in shifts:
+        diff = level_curr[shift_level+yMotion:shift_level+yMotion+height, shift_level+xMotion:shift_level+xMotion+width] - level_prev
+        costs = (diff*diff).reshape(MVs_ver, bw_level, MVs_hor, bw_level).sum(axis=(1,3))
+        better = costs < best
+        best[better] = costs[better]
+        MotionVectorsX[better], MotionVectorsY[better] = xMotion, yMotion
+    
+    # refinement of the active blocks on finer levels
+    offsets = [(0,0)] + [(x,y) for y in range(-refine, refine+1) for x in range(-refine, refine+1) if (x,y) != (0,0)]
+    for level in range(levels-1, -1, -1):
+        bw_level = blockwidth >> level
+        shift_level = -(-max_shift >> level)
+        pad = shift_level + refine
+        level_prev = pyramid_prev[level]
+        level_curr = cv2.copyMakeBorder(pyramid_curr[level],pad,pad,pad,pad,cv2.BORDER_REPLICATE)
+        
+        # MVs of coarser level as prediction on this level
+        MotionVectorsX = np.clip(MotionVectorsX * 2, -shift_level, shift_level)
+        MotionVectorsY = np.clip(MotionVectorsY * 2, -shift_level, shift_level)
+        
+        def match_chunk(chunk):
+            chunk_rows, chunk_cols = rows[chunk], cols[chunk]
+            predX = MotionVectorsX[chunk_rows, chunk_cols].astype(int)
+            predY = MotionVectorsY[chunk_rows, chunk_cols].astype(int)
+            blocks = get_blocks(level_prev, chunk_rows*bw_level, chunk_cols*bw_level, bw_level)
+            # search regions centered on predicted positions
+            regions = get_blocks(level_curr, chunk_rows*bw_level + pad + predY - refine, 
+                chunk_cols*bw_level + pad + predX - refine, bw_level + 2*refine)
+            best = np.full(len(blocks), np.inf, dtype=np.float32)
+            bestX, bestY = np.zeros(len(blocks), dtype=int), np.zeros(len(blocks), dtype=int)
+            for xMotion, yMotion in offsets:
+                diff = regions[:, refine+yMotion:refine+yMotion+bw_level, refine+xMotion:refine+xMotion+bw_level] - blocks
+                costs = (diff*diff).sum(axis=(1,2))
+                better = costs < best
+                best[better], bestX[better], bestY[better] = costs[better], xMotion, yMotion
+            MotionVectorsX[chunk_rows, chunk_cols] = np.clip(predX + bestX, -shift_level, shift_level)
+            MotionVectorsY[chunk_rows, chunk_cols] = np.clip(predY + bestY, -shift_level, shift_level)
+        
+        map_rows(match_chunk, [slice(start, start + chunksize) for start in range(0, len(rows), chunksize)], threads)
+    
+    # blocks outside of searchblocks: no motion
+    inactive = np.ones((MVs_ver, MVs_hor), dtype=bool)
+    inactive[rows, cols] = False
+    MotionVectorsX[inactive], MotionVectorsY[inactive] = 0, 0
+    
+    return MotionVectorsX, MotionVectorsY
+
+def get_pyramid_levels(max_shift, blockwidth, max_levels = 2, min_blockwidth = 4):
+    """
+        number of pyramid levels (each 2x downsampled) for BM_single_pyramid
+        levels are only added while blocks keep >= min_blockwidth px and a search of >= 2 px remains on the coarsest level
+        -> 2 levels for blockwidth 16, max_shift 7 (4 px blocks, search +- 2 px on coarsest level)
+    """
+    levels = 0
+    while (levels < max_levels and blockwidth % (2 << levels) == 0 
+        and (blockwidth >> (levels+1)) >= min_blockwidth and -(-max_shift >> (levels+1)) >= 2):
+        levels += 1
+    return levels
+
+def BM_single_numba(img_prev, img_curr, max_shift, blockwidth, searchblocks=None, threads=1, stride=None):
+    """
+        gets optical flow by block matching between 2 images by exact SSD, 
+        same tie rule as all exact engines (see select_MV_shifts): ambiguous minimum -> no motion
+        SSD of each block is calculated for all shifts in compiled code (BM_numba_kernel), blocks are distributed
+        over threads by numba, images are used in their dtype (e.g. uint8, uint16, float32) without conversion
+        blocks are placed on grid with stride (see get_block_grid)
+    """
+    stride = stride or blockwidth
+    MVs_ver, MVs_hor = get_block_grid(img_prev.shape[:2], blockwidth, stride)
+    
+    if type(searchblocks) != np.ndarray:
+        searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+    rows, cols = np.nonzero(searchblocks[:MVs_ver, :MVs_hor])
+    
+    img_prev = np.ascontiguousarray(img_prev)
+    img_curr = cv2.copyMakeBorder(np.ascontiguousarray(img_curr),max_shift,max_shift,max_shift,max_shift,cv2.BORDER_REPLICATE)
+    
+    MotionVectorsX = np.zeros(shape = (MVs_ver,MVs_hor))
+    MotionVectorsY = np.zeros(shape = (MVs_ver,MVs_hor))
+    
+    # shifts (row-major index as in matchResult) ordered by distance to zero shift: small motion is found first,
+    # gives a low cost bound early -> most other shifts are terminated after a few lines
+    nshifts = 2*max_shift + 1
+    shiftY, shiftX = np.divmod(np.arange(nshifts*nshifts), nshifts)
+    shifts = np.argsort(np.abs(shiftY - max_shift) + np.abs(shiftX - max_shift), kind = 'stable')
+    
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+    numba_state["threads_started"] = True
+    BM_numba_kernel(img_prev, img_curr, max_shift, blockwidth, stride, rows, cols, shifts, MotionVectorsX, MotionVectorsY)
     
-def BM_stack(imageStack, blockwidth, delay, max_shift, canny = True, progressSignal = None, *args, **kwargs):
+    return MotionVectorsX, MotionVectorsY
+
+# threads of numba are started by first call of BM_numba_kernel (e.g. in benchmark_BM_engines), see BM_stack_parallel
+numba_state = {"threads_started": False}
+
+if numba != None:
+    @numba.njit(parallel = True, cache = True)
+    def BM_numba_kernel(img_prev, img_curr, max_shift, blockwidth, stride, rows, cols, shifts, MotionVectorsX, MotionVectorsY):
+        """
+            exhaustive SSD search for blocks (rows, cols) over all shifts in given order, img_curr padded by max_shift
+            cost is accumulated in float64 -> exact for integer valued images
+            a shift is dropped as soon as its partial cost exceeds the best cost (early termination)
+            tie rule of select_MV_shifts: ambiguous minimum -> no motion
+        """
+        nshifts = 2*max_shift + 1
+        center = max_shift*nshifts + max_shift
+        for block in numba.prange(rows.shape[0]):
+            top, left = rows[block]*stride, cols[block]*stride
+            best_cost, best_shift, min_occ = np.inf, center, 0
+            for shift in shifts:
+                y, x = shift // nshifts, shift % nshifts
+                cost = 0.0
+                for i in range(blockwidth):
+                    for j in range(blockwidth):
+                        diff = np.float64(img_prev[top+i, left+j]) - np.float64(img_curr[top+y+i, left+x+j])
+                        cost += diff*diff
+                    if cost > best_cost:
+                        break
+                if cost < best_cost:
+                    best_cost, best_shift, min_occ = cost, shift, 1
+                elif cost == best_cost:
+                    min_occ += 1
+            if min_occ != 1:
+                best_shift = center
+            MotionVectorsX[rows[block], cols[block]] = best_shift % nshifts - max_shift
+            MotionVectorsY[rows[block], cols[block]] = best_shift // nshifts - max_shift
+
+def BM_single_boxfilter(img_prev, img_curr, max_shift, blockwidth, searchblocks=None, threads=1, stride=None, band_height=64):
+    """
+        gets optical flow by block matching between 2 images, same result as BM_single_numba for stride = blockwidth
+        blocks are placed on grid with stride (see get_block_grid), e.g. stride = blockwidth/2 for overlapping blocks
+        for each shift, the SSD of all blocks is read from the integral image of the squared difference image 
+        (see get_block_sums) -> cost per image pair hardly grows with the density of the grid
+        shift of each block by tie rule of select_MV_shifts (ambiguous minimum -> no motion), SSD from the integral image 
+        is exact for integer valued images, otherwise shifts close to the minimum are recomputed exactly
+        image is processed in bands of block rows (about band_height pixels high), threads > 1 distributes the bands over a thread pool
+    """
+    stride = stride or blockwidth
+    MVs_ver, MVs_hor = get_block_grid(img_prev.shape[:2], blockwidth, stride)
+    
+    if type(searchblocks) != np.ndarray:
+        searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+    
+    nshifts = 2*max_shift + 1
+    center = max_shift*nshifts + max_shift
+    width = (MVs_hor - 1)*stride + blockwidth
+    integer = np.issubdtype(img_prev.dtype, np.integer) and np.issubdtype(img_curr.dtype, np.integer)
+    img_prev = img_prev.astype(np.float64)
+    img_curr = cv2.copyMakeBorder(img_curr,max_shift,max_shift,max_shift,max_shift,cv2.BORDER_REPLICATE).astype(np.float64)
+    
+    best_shift = np.full((MVs_ver, MVs_hor), center)
+    
+    def match_band(band):
+        rowidxs = band[np.any(searchblocks[band], axis=1)]
+        if len(rowidxs) == 0:
+            return
+        first, last = rowidxs[0], rowidxs[-1] + 1
+        grid = (last - first, MVs_hor)
+        top, height = first*stride, (last - first - 1)*stride + blockwidth
+        band_prev = img_prev[top:top+height, :width]
+        band_cost = np.empty(grid + (nshifts*nshifts,))
+        max_sum = 0.0
+        for shift in range(nshifts*nshifts):
+            y, x = divmod(shift, nshifts)
+            diff = cv2.subtract(band_prev, img_curr[top+y:top+y+height, x:x+width])
+            squared = cv2.multiply(diff, diff)
+            band_cost[:, :, shift] = get_block_sums(squared, blockwidth, stride, grid)
+            if not integer:
+                max_sum = max(max_sum, cv2.sumElems(squared)[0])
+        
+        exact_costs = None
+        if not integer:
+            # rounding errors of integral image grow with the sum over the band
+            tops, lefts = np.divmod(np.arange(grid[0]*grid[1]), MVs_hor)
+            tops, lefts = (tops + first)*stride, lefts*stride
+            exact_costs = lambda blocks, shifts: get_exact_SSD(get_blocks(img_prev, tops[blocks], lefts[blocks], blockwidth), 
+                img_curr, tops[blocks] + shifts // nshifts, lefts[blocks] + shifts % nshifts)
+        best_shift[first:last] = select_MV_shifts(band_cost.reshape(-1, nshifts*nshifts), center, exact_costs, 
+            1e-10*max_sum).reshape(grid)
+    
+    band_rows = max(1, band_height // stride)
+    map_rows(match_band, [np.arange(first, min(first + band_rows, MVs_ver)) for first in range(0, MVs_ver, band_rows)], threads)
+    
+    yMotion, xMotion = np.divmod(best_shift, nshifts)
+    MotionVectorsX = np.where(searchblocks, xMotion - max_shift, 0).astype(np.float64)
+    MotionVectorsY = np.where(searchblocks, yMotion - max_shift, 0).astype(np.float64)
+    
+    return MotionVectorsX, MotionVectorsY
+
+# registry of blockmatching engines for single image pairs, extend by register_BM_engine
+# function: called as function(img_prev, img_curr, max_shift, blockwidth, searchblocks = ..., threads = ...)
+# exact: all shifts are evaluated (MVs of exhaustive search), approximate engines are not selected automatically
+# dtypes: image dtypes matched without conversion, other dtypes are converted by the engine
+# parallel: distribution of the blocks of one image pair ('threads': thread pool, see map_rows; 'numba': compiled parallel loop)
+# searches: supported search patterns (see BM_searches)
+# stride: blocks can be placed on grid with stride != blockwidth, function accepts stride = ... (see get_block_grid)
+BM_engines = {}
+
+def register_BM_engine(name, function, exact, dtypes, parallel = 'threads', searches = ['exhaustive'], stride = False):
+    BM_engines[name] = {"function": function, "exact": exact, "dtypes": dtypes, "parallel": parallel, "searches": searches, 
+        "stride": stride}
+
+register_BM_engine('template', BM_single, exact = True, dtypes = ['uint8', 'float32'], searches = BM_searches)
+register_BM_engine('pyramid', BM_single_pyramid, exact = False, dtypes = ['uint8', 'float32'])
+register_BM_engine('boxfilter', BM_single_boxfilter, exact = True, dtypes = ['float64'], stride = True)
+if numba != None:
+    register_BM_engine('numba', BM_single_numba, exact = True, dtypes = ['uint8', 'uint16', 'float32', 'float64'], parallel = 'numba', 
+        stride = True)
+
+# results of benchmark_BM_engines, reused for stacks of same shape + dtype + settings
+engine_benchmarks = {}
+
+def benchmark_BM_engines(imageStack, blockwidth, delay, max_shift, threads = 1, pairs = 2, stride = None, searchblocks = None):
+    """
+        calibration: times all exact engines on a few frame pairs of imageStack (spread over the stack)
+        each engine is run on a small crop first, e.g. compilation of the numba kernel is not timed
+        for a grid with stride != blockwidth, only engines supporting stride are timed
+        engines which don't give the MVs of BM_getMV are not timed (see check_BM_parity)
+        searchblocks: blocks selected for the calculation (see get_searchblocks), engines are timed on the same blocks
+        (cost of some engines scales with the number of selected blocks, of others with the rows of blocks)
+        returns fastest engine and dict of seconds per frame pair of each engine
+    """
+    mask = searchblocks.tobytes() if type(searchblocks) == np.ndarray else None
+    key = (imageStack.shape, str(imageStack.dtype), blockwidth, delay, max_shift, threads, pairs, stride, mask)
+    if key in engine_benchmarks:
+        return engine_benchmarks[key]
+    
+    total_frames = imageStack.shape[0] - delay
+    frames = np.unique(np.linspace(0, total_frames - 1, min(pairs, total_frames)).astype(int))
+    crop = (slice(0, 4*blockwidth), slice(0, 4*blockwidth))
+    
+    strided = stride not in [None, blockwidth]
+    timings = {}
+    for engine in sorted(BM_engines):
+        if not BM_engines[engine]["exact"] or (strided and not BM_engines[engine]["stride"]):
+            continue
+        if check_BM_parity(engine) != None:
+            continue
+        BM_single_engine = BM_engines[engine]["function"]
+        engine_options = {"threads": threads, "stride": stride} if BM_engines[engine]["stride"] else {"threads": threads}
+        BM_single_engine(imageStack[0][crop], imageStack[delay][crop], max_shift, blockwidth, **engine_options)
+        
+        starttime = time.time()
+        for frame in frames:
+            BM_single_engine(imageStack[frame], imageStack[frame + delay], max_shift, blockwidth, searchblocks = searchblocks, 
+                **engine_options)
+        timings[engine] = (time.time() - starttime) / len(frames)
+    
+    engine = min(timings, key = timings.get)
+    engine_benchmarks[key] = (engine, timings)
+    return engine, timings
+
+def get_BM_engine(engine, search = 'exhaustive', strided = False):
+    """
+        name of blockmatching engine to use, engine None selects the default:
+        compiled kernel ('numba') for exhaustive search if numba is installed, 'template' otherwise,
+        'boxfilter' for grids with stride != blockwidth (strided)
+        all exact engines give the same MVs (see select_MV_shifts, check_BM_parity)
+    """
+    if engine is None:
+        if strided:
+            engine = 'boxfilter'
+        else:
+            engine = 'numba' if 'numba' in BM_engines and search == 'exhaustive' else 'template'
+    reason = check_BM_engine(engine, search, strided)
+    if reason != None:
+        raise ValueError(reason)
+    return engine
+
+def check_BM_engine(engine, search = 'exhaustive', strided = False):
+    """
+        reason why engine can't be used for search pattern (and grid with stride != blockwidth if strided), None if it can
+    """
+    if engine not in BM_engines:
+        return "blockmatching engine not available: " + str(engine) + (" (numba not installed)" if engine == 'numba' else "")
+    if search not in BM_engines[engine]["searches"]:
+        return "search pattern " + str(search) + " is not available for engine " + str(engine)
+    if strided and not BM_engines[engine]["stride"]:
+        return "stride != blockwidth is not available for engine " + str(engine)
+    return None
+
+# results of check_BM_parity for each engine
+engine_parity = {}
+
+def check_BM_parity(engine, blockwidth = 8, max_shift = 3):
+    """
+        reason why exact engine gives other MVs than BM_getMV (BM_single) on a small test pair, None if it gives the same
+        test pair: weak noise on a bright uint16 background (float32 SSD of matchTemplate can't separate the shifts) 
+        with flat and periodic regions (ambiguous minima, see select_MV_shifts), shifted by (2, -1)
+        result is kept for each engine
+    """
+    if engine not in engine_parity:
+        rng = np.random.RandomState(0)
+        img_prev = (60000 + rng.randint(0, 4, (8*blockwidth, 8*blockwidth))).astype(np.uint16)
+        img_prev[:2*blockwidth] = 60000 # flat: all shifts are ambiguous
+        img_prev[2*blockwidth:4*blockwidth] = 60000 + np.arange(8*blockwidth) % 2 * 3    # stripes: x-shifts ambiguous
+        img_curr = np.roll(np.roll(img_prev, 2, axis=1), -1, axis=0)
+        expected = BM_single(img_prev, img_curr, max_shift, blockwidth)
+        MVs = BM_engines[engine]["function"](img_prev, img_curr, max_shift, blockwidth)
+        same = np.array_equal(MVs[0], expected[0]) and np.array_equal(MVs[1], expected[1])
+        engine_parity[engine] = None if same else "blockmatching engine " + str(engine) + " differs from BM_getMV on test pair"
+    return engine_parity[engine]
+
+def get_tuning_pairs(imageStack, delay = 1, reference_frame = None, pairs = 3, size = 128):
+    """
+        frame pairs around the motion maximum for tune_BM_parameters: pairs (frame, frame + delay) or (reference_frame, frame)
+        motion of each pair = mean absolute difference of frames downscaled to size px (as in get_reference_frame)
+        returns list of pairs consecutive to the pair of largest motion
+    """
+    if reference_frame is None:
+        candidates = [(frame, frame + delay) for frame in range(imageStack.shape[0] - delay)]
+    else:
+        candidates = [(reference_frame, frame) for frame in range(imageStack.shape[0])]
+    
+    scale = min(1.0, size / max(imageStack.shape[1:3]))
+    small_images, motion = {}, []
+    for first, second in candidates: # framewise, imagestack might be read from disk on demand (videoreader.FrameStack)
+        for frame in (first, second):
+            if frame not in small_images:
+                small_images[frame] = cv2.resize(np.asarray(imageStack[frame], dtype = np.float32), None, fx = scale, fy = scale, 
+                    interpolation = cv2.INTER_AREA)
+        motion.append(cv2.absdiff(small_images[first], small_images[second]).mean())
+        if reference_frame is None:
+            del small_images[first]
+        elif second != reference_frame:
+            del small_images[second]
+    
+    start = min(max(int(np.argmax(motion)) - pairs//2, 0), max(len(candidates) - pairs, 0))
+    return candidates[start:start + pairs]
+
+def tune_BM_parameters(imageStack, blockwidth = 16, delay = 1, reference_frame = None, blockwidths = [8, 12, 16, 24, 32], 
+    max_probe = 32, pairs = 3, edge_tolerance = 0.01, outlier_tolerance = 0.05, canny = True, engine = None, threads = 1, 
+    progressSignal = None):
+    """
+        proposes max_shift + blockwidth for blockmatching from a quick blockmatching of a few frame pairs 
+        around the motion maximum (see get_tuning_pairs, BMR: pairs of reference_frame and frames with largest displacement)
+        max_shift: pairs are matched with blockwidth and a search window of +- probe px, probe is doubled (up to max_probe)
+        while more than edge_tolerance of the moving blocks hit the edge of the window (real motion might be larger)
+        -> smallest max_shift at which at most edge_tolerance of the moving blocks would hit the edge, + 1 px margin
+        blockwidth: pairs are matched with each of blockwidths at the proposed max_shift -> smallest blockwidth with at most
+        outlier_tolerance of moving blocks deviating > 1 px from the median MV of their 3x3 neighbourhood (too small blocks match noise)
+        returns dict of proposed max_shift + blockwidth and statistics: pairs, probe, edge_hits (fraction at probe),
+        percentiles (50, 90, 99) of displacement max(|X|, |Y|) of moving blocks, outliers of each blockwidth
+    """
+    print("tuning blockmatching parameters")
+    starttime = time.time()
+    tuning_pairs = get_tuning_pairs(imageStack, delay, reference_frame, pairs)
+    engine = get_BM_engine(engine)
+    BM_single_engine = BM_engines[engine]["function"]
+    blockwidths = [width for width in blockwidths if 4*width <= min(imageStack.shape[1:3])] or [blockwidth]
+    
+    def match_pairs(width, max_shift):
+        searchblocks = get_searchblocks(imageStack[tuning_pairs[0][0]], width, canny)
+        MVs = []
+        for first, second in tuning_pairs:
+            MotionVectorsX, MotionVectorsY = BM_single_engine(imageStack[first], imageStack[second], max_shift, width, 
+                searchblocks = searchblocks, threads = threads)
+            MVs.append((MotionVectorsX, MotionVectorsY))
+        return MVs
+    
+    def get_amplitudes(MVs):
+        return np.concatenate([np.maximum(np.abs(MotionVectorsX), np.abs(MotionVectorsY)).ravel() for MotionVectorsX, MotionVectorsY in MVs])
+    
+    # max_shift: probe with larger search windows until the edge is rarely hit
+    probe = min(8, max_probe)
+    while True:
+        amplitudes = get_amplitudes(match_pairs(blockwidth, probe))
+        amplitudes = amplitudes[amplitudes > 0]
+        edge_hits = np.mean(amplitudes >= probe) if amplitudes.size > 0 else 0.0
+        if edge_hits <= edge_tolerance or probe >= max_probe:
+            break
+        probe = min(2*probe, max_probe)
+    if edge_hits > edge_tolerance:
+        print("motion exceeds search window of max_probe =", max_probe, "px in", edge_hits, "of moving blocks")
+    
+    max_shift = 1
+    while max_shift < probe and amplitudes.size > 0 and np.mean(amplitudes >= max_shift) > edge_tolerance:
+        max_shift += 1
+    max_shift = min(max_shift + 1, probe)
+    
+    # blockwidth: smallest block with consistent MVs
+    outliers = {}
+    for index, width in enumerate(blockwidths):
+        deviating, moving = 0, 0
+        for MotionVectorsX, MotionVectorsY in match_pairs(width, max_shift):
+            medianX, medianY = median_filter(MotionVectorsX, size = 3), median_filter(MotionVectorsY, size = 3)
+            move = (MotionVectorsX != 0) | (MotionVectorsY != 0) | (medianX != 0) | (medianY != 0)
+            deviation = (np.abs(MotionVectorsX - medianX) > 1) | (np.abs(MotionVectorsY - medianY) > 1)
+            deviating, moving = deviating + np.count_nonzero(deviation & move), moving + np.count_nonzero(move)
+        outliers[width] = float(deviating / moving) if moving > 0 else 0.0
+        if progressSignal != None:
+            progressSignal.emit((index+1)/len(blockwidths))
+    
+    consistent = [width for width in blockwidths if outliers[width] <= outlier_tolerance]
+    proposed_blockwidth = min(consistent) if len(consistent) > 0 else min(outliers, key = outliers.get)
+    
+    percentiles = np.percentile(amplitudes, [50, 90, 99]).tolist() if amplitudes.size > 0 else [0.0, 0.0, 0.0]
+    tuning = {"max_shift": int(max_shift), "blockwidth": int(proposed_blockwidth), "pairs": tuning_pairs, "probe": probe, 
+        "edge_hits": float(edge_hits), "percentiles": percentiles, "outliers": outliers}
+    print("proposed max_shift:", tuning["max_shift"], "blockwidth:", tuning["blockwidth"], 
+        "(displacement percentiles 50/90/99:", percentiles, ", outliers per blockwidth:", outliers, ")")
+    print('Execution time in seconds:', (time.time() - starttime))
+    return tuning
+
+def BM_stack(imageStack, blockwidth, delay, max_shift, canny = True, progressSignal = None, engine = None, processes = 1, threads = 1, search = 'exhaustive', stats = None, 
+    radius = 2, threshold = 0.1, accumulator = None, blockmask = None, checkpoint = None, stop = None, stride = None, drift = None, *args, **kwargs):
     """
         gets optical flow of a complete imagestack, based on blockmatching
         unit is px/frame as no scale is given here yet
@@ -123,28 +909,148 @@ def BM_stack(imageStack, blockwidth, delay, max_shift, canny = True, progressSig
         max_shift is maximum allowed movement
         delay in frames between images to analyze
         when the qt signal progressSignal is provided, it is used to track the progress
+        engine selects blockmatching of single image pair, see BM_engines, None = default engine (see get_BM_engine)
+        processes > 1 distributes the frame pairs over a pool of processes
+        threads > 1 distributes the blocks of each frame pair over a pool of threads
+        search selects exhaustive or a fast search pattern, only available for engine 'template'
+        search 'predictive' centers the search of each block on the MVs of the previous frame pair, 
+        uses a window of +- radius and falls back to exhaustive search above the cost threshold (see BM_predictive)
+        -> frame pairs depend on each other and are processed in order, processes are ignored
+        if a dict stats is provided, the number of evaluated candidate shifts is stored in it
+        if an accumulator is provided (e.g. MotionAccumulator), each MV field is added to it as soon as it is calculated
+        blockmask restricts the calculation to selected blocks (e.g. union of ROIs), see get_searchblocks
+        stride: distance of blocks in pixels, None = blockwidth, e.g. blockwidth/2 for a denser grid of overlapping blocks 
+        (see get_block_grid), only engines with stride support (see BM_engines), default is engine 'boxfilter' then
+        drift: integer global translation (X, Y) of each frame pair (see get_global_drift), searches are centered on it
+        -> max_shift only has to cover the residual motion, MVs don't contain the drift
+        if a checkpoint is provided (e.g. MotionCheckpoint), MVs are written into its memmap and finished frame pairs 
+        are marked regularly, calculation continues after the frame pairs already finished in the checkpoint
+        the finished MVs are returned in memory (2 values per block and frame pair, small compared to the imagestack)
+        stop is an optional function, when it returns True the calculation is stopped after the current frame pair 
+        (checkpoint is saved) and None is returned
+        returns array of all MVs with shape (frame pairs, 2, MVs_ver, MVs_hor), 
+        MVs are integer shifts <= max_shift -> stored as int8 (see get_MV_dtype)
     """
     print("Calculating Optical Flow of imagestack by means of Blockmatching")
     starttime = time.time() #for benchmarking...
 
-    MotionVectorsAll = []
     total_frames = imageStack.shape[0] - delay
-    
-    if canny:
-        print("performing Canny edge detection on first frame to select region")
-        searchblocks = find_searchblocks(imageStack[0],blockwidth)
+    shape = (total_frames, 2) + get_block_grid(imageStack.shape[1:3], blockwidth, stride)
+    if checkpoint != None:
+        MotionVectorsAll, start_frame = checkpoint.open(shape, get_MV_dtype(max_shift))
     else:
-        searchblocks = None # replace with np.ones here from function BM_single...
+        MotionVectorsAll, start_frame = np.zeros(shape, dtype = get_MV_dtype(max_shift)), 0
+    
+    # frame pairs restored from checkpoint
+    predicted = None
+    if start_frame > 0:
+        if accumulator != None:
+            for frame in range(start_frame):
+                accumulator.add(MotionVectorsAll[frame, 0], MotionVectorsAll[frame, 1])
+        if search == 'predictive':
+            predicted = get_prediction(MotionVectorsAll[start_frame-1, 0], MotionVectorsAll[start_frame-1, 1])
+    
+    finished = start_frame
+    try:
+        for frame, MotionVectorsX, MotionVectorsY in BM_stack_iter(imageStack, blockwidth, delay, max_shift, canny = canny, 
+            engine = engine, processes = processes, threads = threads, search = search, stats = stats, radius = radius, threshold = threshold, 
+            blockmask = blockmask, start_frame = start_frame, predicted = predicted, stride = stride, drift = drift):
+            
+            MotionVectorsAll[frame, 0], MotionVectorsAll[frame, 1] = MotionVectorsX, MotionVectorsY
+            finished = frame + 1
+            if accumulator != None:
+                accumulator.add(MotionVectorsX, MotionVectorsY)
+            if checkpoint != None:
+                checkpoint.update(finished)
+            
+            if progressSignal != None:
+                progressSignal.emit((frame+1)/total_frames)
+            
+            if stop != None and finished < total_frames and stop():
+                print("motion calculation stopped after", finished, "of", total_frames, "frame pairs")
+                return None
+    finally:
+        # keep finished frame pairs also if calculation is stopped or interrupted by an error
+        if checkpoint != None:
+            checkpoint.update(finished, force = True)
+    
+    if checkpoint != None:
+        MotionVectorsAll = np.array(MotionVectorsAll) # copy into memory, checkpoint can be removed
+            
+    endtime = time.time()
+    print('Execution time in seconds:', (endtime - starttime))
+    if stats != None and "candidates" in stats:
+        print('evaluated candidate shifts:', stats["candidates"])
+    if stats != None and "fallbacks" in stats:
+        print('predictive searches with fallback to exhaustive search:', stats["fallbacks"])
+
+    return MotionVectorsAll
+
+def get_MV_dtype(max_shift):
+    """
+        smallest integer dtype which holds all MVs of blockmatching with max_shift
+    """
+    return np.int8 if max_shift <= np.iinfo(np.int8).max else np.int16
+
+def BM_stack_iter(imageStack, blockwidth, delay, max_shift, canny = True, engine = None, processes = 1, threads = 1, search = 'exhaustive', stats = None, 
+    radius = 2, threshold = 0.1, blockmask = None, start_frame = 0, predicted = None, stride = None, drift = None, *args, **kwargs):
+    """
+        generator version of BM_stack, same parameters
+        yields (frame, MotionVectorsX, MotionVectorsY) for each frame pair in order of frames as soon as it is calculated
+        -> results can be processed while blockmatching of the following frame pairs is still running
+        start_frame: first frame pair to calculate, e.g. to resume an interrupted calculation
+        predicted: initial (X, Y) prediction of search 'predictive' for start_frame, see get_prediction
+    """
+    if search not in BM_searches:
+        raise ValueError("unknown search pattern: " + str(search))
+    engine = get_BM_engine(engine, search, strided = stride not in [None, blockwidth])
+    BM_single_engine = BM_engines[engine]["function"]
+    engine_options = {"threads": threads}
+    if BM_engines[engine]["stride"]:
+        engine_options["stride"] = stride
+    if engine == 'template':
+        engine_options.update({"search": search, "stats": stats})
+        if search == 'predictive':
+            engine_options.update({"radius": radius, "threshold": threshold})
+            if predicted != None:
+                engine_options["predicted"] = predicted
+            if processes > 1:
+                print("predictive search needs MVs of previous frame pair, frame pairs are processed in order")
+                processes = 1
+    
+    searchblocks = get_searchblocks(imageStack[0], blockwidth, canny, blockmask, stride)
+    if searchblocks is None:
+        searchblocks = np.ones(get_block_grid(imageStack.shape[1:3], blockwidth, stride), dtype=bool)
+    
+    # index of active blocks is built once for the whole stack
+    if engine in ['template', 'pyramid']:
+        engine_options["active_blocks"] = get_active_blocks(searchblocks, blockwidth)
+    print("matching", np.count_nonzero(searchblocks), "of", searchblocks.size, "blocks")
     
-    for frame, (prev_img, curr_img) in enumerate(zip(imageStack, imageStack[delay:])):
+    if processes > 1:
+        for result in BM_stack_parallel(imageStack, blockwidth, delay, max_shift, searchblocks, 
+            engine = engine, processes = processes, engine_options = engine_options, start_frame = start_frame, drift = drift):
+            yield result
+        return
+    
+    match_images = {} # frames converted for matching (see get_match_image), holds at most delay + 1 frames
+    def get_frame(frame):
+        if frame not in match_images:
+            match_images[frame] = get_match_image(imageStack[frame])
+        return match_images[frame]
+    
+    for frame in range(start_frame, imageStack.shape[0] - delay):
         # iterate pairwise over frames, total pairs: number_frames - delay
+        prev_img, curr_img = get_frame(frame), get_frame(frame + delay)
+        del match_images[frame]
+        if drift is not None:
+            curr_img = shift_image(curr_img, drift[frame])
         
-        MotionVectorsX, MotionVectorsY = BM_single(prev_img, curr_img, max_shift, blockwidth, searchblocks = searchblocks)
+        MotionVectorsX, MotionVectorsY = BM_single_engine(prev_img, curr_img, max_shift, blockwidth, searchblocks = searchblocks, **engine_options)
+        if search == 'predictive':
+            engine_options["predicted"] = get_prediction(MotionVectorsX, MotionVectorsY)
 
-        MotionVectorsAll.append((MotionVectorsX, MotionVectorsY))   # this can be definitely be done nicer with numpy
-        
-        if progressSignal != None:
-            progressSignal.emit((frame+1)/total_frames)
+        yield frame, MotionVectorsX, MotionVectorsY
             
         # for comparison with matlab...
         #prev_img = prev_img[:,:,0] / 4095 * 255
@@ -161,25 +1067,607 @@ def BM_stack(imageStack, blockwidth, delay, max_shift, canny = True, progressSig
         #    end
         #end
         # ... simplify in python -> define all blocks in which edge lies
-            
-    endtime = time.time()
-    print('Execution time in seconds:', (endtime - starttime))
 
-    return np.array(MotionVectorsAll)
+# state of each worker process in BM_stack_parallel, set once by BM_init_worker
+worker_state = {}
+
+def BM_init_worker(stackfile, shape, dtype, blockwidth, delay, max_shift, searchblocks, engine, engine_options, drift = None):
+    """
+        opens imagestack in worker process (see open_shared_imagestack), no copy of the stack is pickled
+    """
+    worker_state["imageStack"] = open_shared_imagestack(stackfile, shape, dtype)
+    worker_state.update({"blockwidth": blockwidth, "delay": delay, "max_shift": max_shift, 
+        "searchblocks": searchblocks, "engine": BM_engines[engine]["function"], "engine_options": engine_options, "drift": drift})
+
+def BM_pair_worker(frame):
+    """
+        calculates MVs of single pair (frame, frame + delay) in worker process
+        returns MVs and stats of this pair
+    """
+    imageStack, delay = worker_state["imageStack"], worker_state["delay"]
+    engine_options = dict(worker_state["engine_options"])
+    if "stats" in engine_options:
+        engine_options["stats"] = {}
+    curr_img = np.asarray(imageStack[frame + delay])
+    if worker_state["drift"] is not None:
+        curr_img = shift_image(curr_img, worker_state["drift"][frame])
+    MotionVectorsX, MotionVectorsY = worker_state["engine"](np.asarray(imageStack[frame]), curr_img, 
+        worker_state["max_shift"], worker_state["blockwidth"], searchblocks = worker_state["searchblocks"], **engine_options)
+    return MotionVectorsX, MotionVectorsY, engine_options.get("stats")
+
+def BM_stack_parallel(imageStack, blockwidth, delay, max_shift, searchblocks, engine = 'template', processes = None, engine_options = {}, 
+    start_frame = 0, drift = None):
+    """
+        blockmatching of imagestack with frame pairs distributed over a pool of processes
+        imagestack is shared with workers as memmap (temporary file if stack is not a memmap yet),
+        videoreader.FrameStack is passed to the workers, which read their frames on demand themselves
+        yields (frame, MotionVectorsX, MotionVectorsY) in order of frames as soon as each pair is finished
+        engine_options are passed to the engine, a dict in engine_options["stats"] collects stats of all pairs
+        frame pairs before start_frame are skipped, drift as in BM_stack
+    """
+    total_frames = imageStack.shape[0] - delay
+    stackfile, tempfolder = share_imagestack(imageStack)
+    
+    stats = engine_options.get("stats")
+    worker_options = dict(engine_options)
+    if stats != None:
+        worker_options["stats"] = True # each worker collects stats per pair
+    initargs = (stackfile, imageStack.shape, imageStack.dtype, blockwidth, delay, max_shift, searchblocks, engine, worker_options, drift)
+    chunksize = max(1, (total_frames - start_frame) // (4 * (processes or multiprocessing.cpu_count())))
+    
+    pool = get_pool_context(engine).Pool(processes, initializer = BM_init_worker, initargs = initargs)
+    try:
+        for frame, (MotionVectorsX, MotionVectorsY, pair_stats) in enumerate(pool.imap(BM_pair_worker, range(start_frame, total_frames), chunksize), start_frame):
+            if stats != None:
+                stats["candidates"] = stats.get("candidates", 0) + pair_stats.get("candidates", 0)
+            yield frame, MotionVectorsX, MotionVectorsY
+    finally:
+        pool.terminate()
+        pool.join()
+        if tempfolder != None:
+            shutil.rmtree(tempfolder, ignore_errors = True)
+    
+    
+def share_imagestack(imageStack):
+    """
+        file of imagestack for read-only memmaps in worker processes: file of imageStack if it is a memmap already,
+        otherwise the stack is copied framewise into a temporary file
+        videoreader.FrameStack (frames read on demand) is shared as it is, without copy of the frames (see open_shared_imagestack)
+        returns stackfile and temporary folder (None if no copy was made), remove folder when workers are done
+    """
+    if isinstance(imageStack, videoreader.FrameStack):
+        return imageStack, None
+    if isinstance(imageStack, np.memmap) and imageStack.filename != None and imageStack.offset == 0:
+        return imageStack.filename, None
+    
+    tempfolder = tempfile.mkdtemp(prefix = "ohw_")
+    stackfile = str(pathlib.Path(tempfolder) / "imageStack.dat")
+    sharedStack = np.memmap(stackfile, dtype = imageStack.dtype, mode = 'w+', shape = imageStack.shape)
+    for frame in range(imageStack.shape[0]): # framewise, imagestack might be read from disk on demand (videoreader.FrameStack)
+        sharedStack[frame] = imageStack[frame]
+    sharedStack.flush()
+    del sharedStack
+    return stackfile, tempfolder
+
+def open_shared_imagestack(stackfile, shape, dtype):
+    """
+        imagestack in worker process from share_imagestack: read-only memmap of stackfile or 
+        videoreader.FrameStack, which decodes the frames of this worker only
+    """
+    if isinstance(stackfile, videoreader.FrameStack):
+        return stackfile.get_copy()
+    return np.memmap(stackfile, dtype = dtype, mode = 'r', shape = shape)
+
+def get_pool_context(engine = None):
+    """
+        multiprocessing context for worker pools
+        threads of numba are not fork-safe -> workers of engine 'numba' or after numba was used in this process 
+        are started as new processes (as always on Windows)
+    """
+    if engine == 'numba' or numba_state["threads_started"]:
+        return multiprocessing.get_context('spawn')
+    return multiprocessing
+
+def get_global_drift(imageStack, delay = 1, reference_frame = None, size = 256, progressSignal = None):
+    """
+        global translation (e.g. drift of stage, wobble of dish) of each frame pair (frame, frame + delay) 
+        or of each frame relative to reference_frame if given, by phase correlation of whole frames downscaled to size px
+        returns integer shifts with shape (frame pairs or frames, 2) as (X, Y) in px of imageStack, same sign as MVs
+        -> blockmatching with drift (see BM_stack, BM_reference_stack) only searches the residual motion around it
+    """
+    scale = min(1.0, size / max(imageStack.shape[1:3]))
+    def get_small(frame):
+        return cv2.resize(np.asarray(imageStack[frame], dtype = np.float32), None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+    
+    if reference_frame is None:
+        pairs = [(frame, frame + delay) for frame in range(imageStack.shape[0] - delay)]
+    else:
+        pairs = [(reference_frame, frame) for frame in range(imageStack.shape[0])]
+    
+    small_images = {} # downscaled frames, holds at most delay + 1 frames (+ reference)
+    drift, window = np.zeros((len(pairs), 2)), None
+    for pair, (first, second) in enumerate(pairs):
+        for frame in (first, second):
+            if frame not in small_images:
+                small_images[frame] = get_small(frame)
+        if window is None:
+            window = cv2.createHanningWindow(small_images[first].shape[::-1], cv2.CV_32F)
+        drift[pair] = cv2.phaseCorrelate(small_images[first], small_images[second], window)[0]
+        if reference_frame is None:
+            del small_images[first]
+        elif second != reference_frame:
+            del small_images[second]
+        if progressSignal != None:
+            progressSignal.emit((pair+1)/len(pairs))
+    
+    return np.rint(drift / scale).astype(np.int32)
+
+def shift_image(image, offset):
+    """
+        image shifted by integer offset (X, Y): shifted[y, x] = image[y + Y, x + X], edges are replicated 
+        as the padding of the blockmatching engines -> search of shift s in shifted image = search of s + offset in image
+    """
+    x, y = int(offset[0]), int(offset[1])
+    if x == 0 and y == 0:
+        return image
+    padded = cv2.copyMakeBorder(image, max(-y, 0), max(y, 0), max(-x, 0), max(x, 0), cv2.BORDER_REPLICATE)
+    return padded[max(y, 0):max(y, 0) + image.shape[0], max(x, 0):max(x, 0) + image.shape[1]]
+
+def get_reference_frame(imageStack, window = 5, size = 128):
+    """
+        frame in relaxed state as reference for BM_reference_stack: center of the window of frames with lowest motion
+        motion between consecutive frames = mean absolute difference of frames downscaled to size px (longest side)
+        summed over window -> long phases of rest are preferred to the short rest at the turning point of a contraction
+    """
+    total_frames = imageStack.shape[0]
+    window = min(window, total_frames)
+    if window < 2:
+        return 0
+    
+    scale = min(1.0, size / max(imageStack.shape[1:3]))
+    diffs, prev_img = [], None
+    for frame in range(total_frames): # framewise, imagestack might be read from disk on demand (videoreader.FrameStack)
+        curr_img = cv2.resize(np.asarray(imageStack[frame], dtype = np.float32), None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        if prev_img is not None:
+            diffs.append(cv2.absdiff(curr_img, prev_img).mean())
+        prev_img = curr_img
+    
+    window_motion = np.convolve(diffs, np.ones(window - 1), mode = 'valid') # motion of window starting at each frame
+    return int(np.argmin(window_motion)) + (window - 1)//2
+
+def get_blocks(image, tops, lefts, size, width = None):
+    """
+        array of square blocks (size x size, size x width if given) of image with upper left corners (tops, lefts)
+    """
+    rows = (tops[:, None] + np.arange(size))[:, :, None]
+    cols = (lefts[:, None] + np.arange(width or size))[:, None, :]
+    return image[rows, cols]
+
+def BM_reference_templates(reference, max_shift, blockwidth, searchblocks = None, stride = None):
+    """
+        prepares the blocks of the reference frame once for BM_reference_single:
+        spectra (conjugated rfft2, zero padded to size of search region) and squared norms of all selected blocks,
+        blocks themselves only for non-integer images (exact SSD close to the minimum, see BM_reference_single)
+        blocks are placed on grid with stride (see get_block_grid)
+    """
+    stride = stride or blockwidth
+    grid = get_block_grid(reference.shape[:2], blockwidth, stride)
+    if type(searchblocks) != np.ndarray:
+        searchblocks = np.ones(grid, dtype=bool)
+    rows, cols = np.nonzero(searchblocks)
+    
+    size = blockwidth + 2*max_shift # search region of each block
+    blocks = get_blocks(reference.astype(np.float64), rows*stride, cols*stride, blockwidth)
+    return {"grid": grid, "rows": rows, "cols": cols, "tops": rows*stride, "lefts": cols*stride, 
+        "blockwidth": blockwidth, "max_shift": max_shift, "integer": np.issubdtype(reference.dtype, np.integer),
+        "spectra": np.conj(np.fft.rfft2(blocks, s = (size, size))), "norms": np.sum(blocks*blocks, axis = (1,2)), 
+        "blocks": None if np.issubdtype(reference.dtype, np.integer) else blocks}
+
+def BM_reference_single(image, templates, threads = 1, chunksize = 1024):
+    """
+        gets displacement of the blocks of the reference frame (see BM_reference_templates) in image 
+        by exhaustive search of minimum SSD, same result as BM_single_numba for integer valued images
+        SSD = |block|^2 - 2 correlation + |window|^2: correlation of each block with its search region by FFT
+        (block spectra of reference are reused), |window|^2 of all shifts from integral image
+        tie rule of select_MV_shifts: ambiguous minimum -> no motion
+        blocks are processed in chunks of chunksize, threads > 1 distributes the chunks over a thread pool
+    """
+    max_shift, blockwidth = templates["max_shift"], templates["blockwidth"]
+    nshifts, size = 2*max_shift + 1, blockwidth + 2*max_shift
+    image = cv2.copyMakeBorder(image,max_shift,max_shift,max_shift,max_shift,cv2.BORDER_REPLICATE).astype(np.float64)
+    integral = cv2.integral(cv2.multiply(image, image), sdepth = cv2.CV_64F)
+    shifts = np.arange(nshifts)
+    best_shift = np.empty(len(templates["rows"]), dtype = int)
+    
+    def match_chunk(chunk):
+        tops, lefts = templates["tops"][chunk], templates["lefts"][chunk]
+        regions = get_blocks(image, tops, lefts, size)
+        correlation = np.fft.irfft2(np.fft.rfft2(regions) * templates["spectra"][chunk], s = (size, size))[:, :nshifts, :nshifts]
+        ys, xs = (tops[:, None] + shifts)[:, :, None], (lefts[:, None] + shifts)[:, None, :]
+        window_norms = (integral[ys + blockwidth, xs + blockwidth] - integral[ys, xs + blockwidth] 
+            - integral[ys + blockwidth, xs] + integral[ys, xs])
+        cost = (window_norms - 2*correlation + templates["norms"][chunk, None, None]).reshape(len(tops), -1)
+        exact_costs, tol = None, 0
+        if templates["integer"]:
+            cost = np.rint(cost)    # SSD of integer images is integer, removes rounding errors of FFT
+        else:
+            # shifts close to the minimum are compared by exact SSD
+            blocks = templates["blocks"][chunk]
+            exact_costs = lambda block, shift: get_exact_SSD(blocks[block], image, tops[block] + shift // nshifts, 
+                lefts[block] + shift % nshifts)
+            tol = 1e-9 * (templates["norms"][chunk, None] + window_norms.reshape(len(tops), -1).max(axis=1)[:, None])
+        best_shift[chunk] = select_MV_shifts(cost, max_shift*nshifts + max_shift, exact_costs, tol)
+    
+    map_rows(match_chunk, [slice(start, start + chunksize) for start in range(0, len(best_shift), chunksize)], threads)
+    
+    yMotion, xMotion = np.divmod(best_shift, nshifts)
+    MotionVectorsX = np.zeros(templates["grid"])
+    MotionVectorsY = np.zeros(templates["grid"])
+    MotionVectorsX[templates["rows"], templates["cols"]] = xMotion - max_shift
+    MotionVectorsY[templates["rows"], templates["cols"]] = yMotion - max_shift
+    
+    return MotionVectorsX, MotionVectorsY
+
+def BM_reference_stack(imageStack, blockwidth, max_shift, reference_frame = 'auto', canny = True, progressSignal = None, 
+    processes = 1, threads = 1, blockmask = None, stride = None, drift = None, *args, **kwargs):
+    """
+        gets displacement of each frame relative to a fixed reference frame by blockmatching
+        reference_frame: index of frame or 'auto' = frame in relaxed state (see get_reference_frame)
+        blocks of the reference frame are prepared once (see BM_reference_templates) and matched in each frame
+        -> each frame is an independent job, processes > 1 distributes the frames over a pool of processes,
+        threads > 1 distributes the blocks of each frame over a pool of threads
+        canny, blockmask + stride as in BM_stack, search blocks are selected in the reference frame
+        drift: integer global translation (X, Y) of each frame relative to reference frame (see get_global_drift), 
+        searches are centered on it, displacements don't contain the drift
+        returns array of all displacements with shape (frames, 2, MVs_ver, MVs_hor) in px,
+        MVs of frame pairs are the differences of displacements (see get_displacement_MVs)
+    """
+    print("Calculating displacement of imagestack relative to reference frame by means of Blockmatching")
+    starttime = time.time()
+    
+    if reference_frame in [None, 'auto']:
+        reference_frame = get_reference_frame(imageStack)
+    print("reference frame:", reference_frame)
+    reference = np.asarray(imageStack[reference_frame])
+    searchblocks = get_searchblocks(reference, blockwidth, canny, blockmask, stride)
+    templates = BM_reference_templates(reference, max_shift, blockwidth, searchblocks, stride)
+    print("matching", len(templates["rows"]), "of", templates["grid"][0]*templates["grid"][1], "blocks")
+    
+    total_frames = imageStack.shape[0]
+    displacements = np.zeros((total_frames, 2) + templates["grid"], dtype = get_MV_dtype(max_shift))
+    if processes > 1:
+        results = BM_reference_parallel(imageStack, templates, processes, threads, drift)
+    else:
+        results = ((frame,) + BM_reference_single(get_drift_image(imageStack, frame, drift), templates, threads) 
+            for frame in range(total_frames))
+    
+    for frame, MotionVectorsX, MotionVectorsY in results:
+        displacements[frame, 0], displacements[frame, 1] = MotionVectorsX, MotionVectorsY
+        if progressSignal != None:
+            progressSignal.emit((frame+1)/total_frames)
+    
+    print('Execution time in seconds:', (time.time() - starttime))
+    return displacements
+
+def get_drift_image(imageStack, frame, drift = None):
+    """
+        frame of imageStack, shifted by its drift if given (see shift_image)
+    """
+    image = np.asarray(imageStack[frame])
+    return image if drift is None else shift_image(image, drift[frame])
+
+def BM_reference_init_worker(stackfile, shape, dtype, templates, threads, drift = None):
+    """
+        opens imagestack in worker process (see open_shared_imagestack), blocks of reference frame are passed once to each worker
+    """
+    worker_state["imageStack"] = open_shared_imagestack(stackfile, shape, dtype)
+    worker_state.update({"templates": templates, "threads": threads, "drift": drift})
+
+def BM_reference_worker(frame):
+    return BM_reference_single(get_drift_image(worker_state["imageStack"], frame, worker_state["drift"]), 
+        worker_state["templates"], worker_state["threads"])
+
+def BM_reference_parallel(imageStack, templates, processes = None, threads = 1, drift = None):
+    """
+        blockmatching of all frames to reference frame (see BM_reference_stack) distributed over a pool of processes
+        yields (frame, MotionVectorsX, MotionVectorsY) in order of frames as soon as each frame is finished
+    """
+    total_frames = imageStack.shape[0]
+    stackfile, tempfolder = share_imagestack(imageStack)
+    initargs = (stackfile, imageStack.shape, imageStack.dtype, templates, threads, drift)
+    chunksize = max(1, total_frames // (4 * (processes or multiprocessing.cpu_count())))
+    
+    pool = get_pool_context().Pool(processes, initializer = BM_reference_init_worker, initargs = initargs)
+    try:
+        for frame, (MotionVectorsX, MotionVectorsY) in enumerate(pool.imap(BM_reference_worker, range(total_frames), chunksize)):
+            yield frame, MotionVectorsX, MotionVectorsY
+    finally:
+        pool.terminate()
+        pool.join()
+        if tempfolder != None:
+            shutil.rmtree(tempfolder, ignore_errors = True)
+
+def get_displacement_MVs(displacements, delay, max_shift):
+    """
+        MVs of frame pairs (frame, frame + delay) from displacements relative to reference frame (see BM_reference_stack)
+        -> same shape + meaning as MVs of BM_stack
+    """
+    dtype = get_MV_dtype(2*max_shift)
+    return displacements[delay:].astype(dtype) - displacements[:-delay].astype(dtype)
+
+def GF_single(img_prev, img_curr, blockwidth, searchblocks=None):
+    """
+        gets optical flow by dense Gunnar-Farnebäck flow between 2 images (uint8)
+        flow of each pixel is averaged over the blocks of blockwidth to get the same MV grid as BM_single
+    """
+    
+    size_ver, size_hor = img_prev.shape[:2]
+    MVs_ver = math.floor(size_ver/blockwidth)
+    MVs_hor = math.floor(size_hor/blockwidth)
+    
+    # pyr_scale, levels, winsize, iterations, poly_n, poly_sigma, flags
+    flow = cv2.calcOpticalFlowFarneback(img_prev, img_curr, None, 0.5, 3, blockwidth, 3, 5, 1.2, 0)
+    flow = flow[:MVs_ver*blockwidth, :MVs_hor*blockwidth]
+    blockflow = flow.reshape(MVs_ver, blockwidth, MVs_hor, blockwidth, 2).mean(axis=(1,3), dtype=np.float64)
+    
+    MotionVectorsX, MotionVectorsY = blockflow[...,0], blockflow[...,1]
+    if type(searchblocks) == np.ndarray:
+        MotionVectorsX[~searchblocks], MotionVectorsY[~searchblocks] = 0, 0
+    
+    return MotionVectorsX, MotionVectorsY
+
+def GF_stack(imageStack, blockwidth, delay, canny = True, progressSignal = None, blockmask = None, *args, **kwargs):
+    """
+        gets optical flow of a complete imagestack, based on dense Gunnar-Farnebäck flow
+        returns MVs in the same shape and unit (px/ delay) as BM_stack
+        images are scaled to uint8 with the intensity range of the whole stack as needed by cv2
+    """
+    print("Calculating Optical Flow of imagestack by means of Gunnar-Farnebäck")
+    starttime = time.time()
+    
+    total_frames = imageStack.shape[0] - delay
+    size_ver, size_hor = imageStack.shape[1:3]
+    MotionVectorsAll = np.zeros((total_frames, 2, math.floor(size_ver/blockwidth), math.floor(size_hor/blockwidth)))
+    
+    searchblocks = get_searchblocks(imageStack[0], blockwidth, canny, blockmask)
+    
+    to_uint8 = get_uint8_converter(imageStack)
+    
+    for frame in range(total_frames):
+        MotionVectorsAll[frame,0], MotionVectorsAll[frame,1] = GF_single(to_uint8(imageStack[frame]), 
+            to_uint8(imageStack[frame+delay]), blockwidth, searchblocks = searchblocks)
+        
+        if progressSignal != None:
+            progressSignal.emit((frame+1)/total_frames)
+    
+    print('Execution time in seconds:', (time.time() - starttime))
+    return MotionVectorsAll
+    
+def LK_stack(imageStack, blockwidth, delay, canny = True, progressSignal = None, blockmask = None, *args, **kwargs):
+    """
+        gets optical flow of a complete imagestack, based on pyramidal Lucas-Kanade
+        tracks the centers of blocks (selected by find_searchblocks if canny)
+        returns MVs in the same shape and unit (px/ delay) as BM_stack
+    """
+    print("Calculating Optical Flow of imagestack by means of Lucas-Kanade")
+    starttime = time.time()
+    
+    total_frames = imageStack.shape[0] - delay
+    size_ver, size_hor = imageStack.shape[1:3]
+    MotionVectorsAll = np.zeros((total_frames, 2, math.floor(size_ver/blockwidth), math.floor(size_hor/blockwidth)))
     
+    searchblocks = get_searchblocks(imageStack[0], blockwidth, canny, blockmask)
     
+    to_uint8 = get_uint8_converter(imageStack)
     
-def find_searchblocks(inputimage, blockwidth):
+    for frame in range(total_frames):
+        MotionVectorsAll[frame,0], MotionVectorsAll[frame,1] = LK_single(to_uint8(imageStack[frame]), 
+            to_uint8(imageStack[frame+delay]), blockwidth, searchblocks = searchblocks)
+        
+        if progressSignal != None:
+            progressSignal.emit((frame+1)/total_frames)
+    
+    print('Execution time in seconds:', (time.time() - starttime))
+    return MotionVectorsAll
+
+def PC_frame_spectra(image, blockwidth, searchblocks):
+    """
+        prepares one frame for PC_single, calculated once and used for both pairs the frame is part of:
+        as first frame: conjugated spectra (rfft2) + norms of its mean-free blocks, 
+        as second frame: spectra of the search regions (2*blockwidth, centered on each block, edges replicated as in BM_single)
+        + integral images for mean and norm of each window of the search regions
+        FFT size is fixed to 2*blockwidth -> cost does not depend on max_shift, motion up to blockwidth/2 is found
+        only blocks selected in searchblocks are transformed, spectra are stored as complex64
+    """
+    size, pad = 2*blockwidth, blockwidth//2
+    padded = cv2.copyMakeBorder(np.asarray(image, dtype = np.float64), pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+    rows, cols = np.nonzero(searchblocks)
+    # regions of all blocks as view of padded image, only selected ones are copied
+    grid_regions = np.lib.stride_tricks.as_strided(padded, shape = searchblocks.shape + (size, size), 
+        strides = (blockwidth*padded.strides[0], blockwidth*padded.strides[1]) + padded.strides)
+    regions = grid_regions[rows, cols]
+    blocks = regions[:, pad:pad+blockwidth, pad:pad+blockwidth]
+    blocks = blocks - blocks.mean(axis=(1,2), keepdims=True)
+    
+    # rfft2 of zero padded blocks: rows of zeros are skipped in first transform
+    block_spectra = np.fft.fft(np.fft.rfft(blocks, n = size, axis = 2), n = size, axis = 1)
+    return {"grid": searchblocks.shape, "rows": rows, "cols": cols, "blockwidth": blockwidth,
+        "block_spectra": np.conj(block_spectra).astype(np.complex64), 
+        "block_norms": np.sqrt(np.sum(blocks*blocks, axis = (1,2))),
+        "region_spectra": np.fft.rfft2(regions).astype(np.complex64),
+        "window_sums": get_window_sums(padded, blockwidth), "window_sqsums": get_window_sums(cv2.multiply(padded, padded), blockwidth)}
+
+def get_window_sums(image, blockwidth):
+    """
+        sum of image over the window (blockwidth x blockwidth) with upper left corner at each pixel, read from the integral image
+    """
+    integral = cv2.integral(image, sdepth = cv2.CV_64F)
+    return (integral[blockwidth:, blockwidth:] - integral[:-blockwidth, blockwidth:] 
+        - integral[blockwidth:, :-blockwidth] + integral[:-blockwidth, :-blockwidth])
+
+def PC_single(spectra_prev, spectra_curr, max_shift, min_response = 0.5, chunksize = 1024):
+    """
+        gets MVs of all blocks by normalized correlation (zero mean, see cv2.TM_CCOEFF_NORMED) of the blocks of the first image
+        with their search regions in the second image (see PC_frame_spectra), correlation by FFT
+        peak of correlation is searched within +- max_shift (at most blockwidth/2)
+        blocks with peak correlation below min_response (e.g. background, no structure) -> no motion, as ambiguous minimum in BM_getMV
+        blocks are processed in chunks of chunksize
+    """
+    blockwidth = spectra_prev["blockwidth"]
+    size, pad = 2*blockwidth, blockwidth//2
+    max_shift = min(max_shift, pad)
+    nshifts = 2*max_shift + 1
+    shifts = np.arange(pad - max_shift, pad + max_shift + 1) # index of each shift in correlation + windows of search region
+    best_shift = np.full(len(spectra_prev["rows"]), max_shift*nshifts + max_shift)
+    
+    for start in range(0, len(best_shift), chunksize):
+        chunk = slice(start, start + chunksize)
+        # irfft2, second transform only for rows of shifts within max_shift
+        correlation = np.fft.ifft(spectra_curr["region_spectra"][chunk] * spectra_prev["block_spectra"][chunk], axis = 1)
+        correlation = np.fft.irfft(correlation[:, shifts], n = size, axis = 2)[:, :, shifts]
+        ys = (spectra_prev["rows"][chunk, None]*blockwidth + shifts)[:, :, None]
+        xs = (spectra_prev["cols"][chunk, None]*blockwidth + shifts)[:, None, :]
+        window_sums = spectra_curr["window_sums"][ys, xs]
+        window_variance = np.maximum(spectra_curr["window_sqsums"][ys, xs] - window_sums*window_sums/blockwidth**2, 0)
+        response = (correlation / (spectra_prev["block_norms"][chunk, None, None] * np.sqrt(window_variance) + 1e-9)).reshape(len(ys), -1)
+        chunk_shift = response.argmax(axis=1)
+        matched = response[np.arange(len(ys)), chunk_shift] >= min_response
+        best_shift[chunk][matched] = chunk_shift[matched]
+    
+    yMotion, xMotion = np.divmod(best_shift, nshifts)
+    MotionVectorsX, MotionVectorsY = np.zeros(spectra_prev["grid"]), np.zeros(spectra_prev["grid"])
+    MotionVectorsX[spectra_prev["rows"], spectra_prev["cols"]] = xMotion - max_shift
+    MotionVectorsY[spectra_prev["rows"], spectra_prev["cols"]] = yMotion - max_shift
+    
+    return MotionVectorsX, MotionVectorsY
+
+def PC_stack(imageStack, blockwidth, delay, max_shift, canny = True, progressSignal = None, blockmask = None, min_response = 0.5, 
+    *args, **kwargs):
+    """
+        gets optical flow of a complete imagestack, based on normalized FFT correlation of blocks (see PC_single)
+        spectra of each frame are calculated once and reused for both pairs the frame is part of
+        cost does not depend on max_shift, motion up to blockwidth/2 is found (larger max_shift -> increase blockwidth)
+        returns MVs in the same shape and unit (px/ delay) as BM_stack
+    """
+    print("Calculating Optical Flow of imagestack by means of FFT correlation of blocks")
+    starttime = time.time()
+    if max_shift > blockwidth//2:
+        print("max_shift is limited to blockwidth/2 =", blockwidth//2)
+    
+    total_frames = imageStack.shape[0] - delay
+    size_ver, size_hor = imageStack.shape[1:3]
+    MotionVectorsAll = np.zeros((total_frames, 2, math.floor(size_ver/blockwidth), math.floor(size_hor/blockwidth)))
+    
+    searchblocks = get_searchblocks(imageStack[0], blockwidth, canny, blockmask)
+    if type(searchblocks) != np.ndarray:
+        searchblocks = np.ones(MotionVectorsAll.shape[2:], dtype = bool)
+    
+    spectra = {} # cache of frame spectra, holds at most delay + 1 frames
+    def get_spectra(frame):
+        if frame not in spectra:
+            spectra[frame] = PC_frame_spectra(imageStack[frame], blockwidth, searchblocks)
+        return spectra[frame]
+    
+    for frame in range(total_frames):
+        MotionVectorsAll[frame,0], MotionVectorsAll[frame,1] = PC_single(get_spectra(frame), get_spectra(frame+delay), 
+            max_shift, min_response = min_response)
+        del spectra[frame] # frame was already used as second frame in pair frame - delay
+        
+        if progressSignal != None:
+            progressSignal.emit((frame+1)/total_frames)
+    
+    print('Execution time in seconds:', (time.time() - starttime))
+    return MotionVectorsAll
+
+def MM_stack(imageStack, blockwidth, reference_frame = 0, canny = True, progressSignal = None, blockmask = None, *args, **kwargs):
+    """
+        gets intensity based motion of a complete imagestack (MuscleMotion)
+        absolute intensity difference of each frame to reference_frame, averaged over blocks of blockwidth
+        returns absolute motions (frames, MVs_ver, MVs_hor) in intensity units, no motion vectors
+    """
+    print("Calculating motion of imagestack by means of MuscleMotion")
+    starttime = time.time()
+    
+    total_frames, size_ver, size_hor = imageStack.shape[:3]
+    MVs_ver = math.floor(size_ver/blockwidth)
+    MVs_hor = math.floor(size_hor/blockwidth)
+    absMotions = np.zeros((total_frames, MVs_ver, MVs_hor))
+    
+    searchblocks = get_searchblocks(imageStack[0], blockwidth, canny, blockmask)
+    if searchblocks is None:
+        searchblocks = np.ones((MVs_ver, MVs_hor), dtype=bool)
+    
+    reference = imageStack[reference_frame][:MVs_ver*blockwidth, :MVs_hor*blockwidth]
+    
+    for frame in range(total_frames):
+        diff = cv2.absdiff(imageStack[frame][:MVs_ver*blockwidth, :MVs_hor*blockwidth], reference)
+        absMotions[frame] = diff.reshape(MVs_ver, blockwidth, MVs_hor, blockwidth).mean(axis=(1,3), dtype=np.float64)
+        
+        if progressSignal != None:
+            progressSignal.emit((frame+1)/total_frames)
+    
+    absMotions[:, ~searchblocks] = 0
+    
+    print('Execution time in seconds:', (time.time() - starttime))
+    return absMotions
+
+# registry of motion backends for whole stacks, selected by method in OHW.calculate_motion, extend by register_motion_backend
+# stack: function(imageStack, progressSignal = ..., **parameters)
+# output: 'MVs' (motion vectors of blocks in px/ delay), 'absMotions' (intensity based motion of blocks, no MVs) or 
+# 'displacements' (displacement of blocks relative to reference frame in px, MVs see get_displacement_MVs)
+# exact: MVs of exhaustive search of all shifts (BM with exact engine), otherwise approximate
+# dtypes: dtypes of imagestack processed without conversion
+# parallel: available parallelism (see parameters processes + threads of BM_stack)
+# streaming: MVs of each pair are available during calculation -> stats, accumulator, checkpoint + stop are supported (see BM_stack)
+# stride: grid of blocks with stride != blockwidth is supported (parameter stride, see get_block_grid)
+# unit: unit of absolute motion (absMotions, kinetics) after OHW.init_motion
+motion_backends = {}
+
+def register_motion_backend(method, stack, output = 'MVs', exact = False, dtypes = [], parallel = [], streaming = False, stride = False, 
+    drift = False, unit = u'\xb5m/s'):
+    motion_backends[method] = {"stack": stack, "output": output, "exact": exact, "dtypes": dtypes, 
+        "parallel": parallel, "streaming": streaming, "stride": stride, "drift": drift, "unit": unit}
+
+register_motion_backend('BM', BM_stack, exact = True, dtypes = ['uint8', 'uint16', 'float32'], 
+    parallel = ['processes', 'threads'], streaming = True, stride = True, drift = True)
+register_motion_backend('GF', GF_stack, dtypes = ['uint8'])
+register_motion_backend('LK', LK_stack, dtypes = ['uint8'])
+register_motion_backend('PC', PC_stack, dtypes = ['float64'])
+register_motion_backend('BMR', BM_reference_stack, output = 'displacements', exact = True, dtypes = ['float64'], 
+    parallel = ['processes', 'threads'], stride = True, drift = True)
+register_motion_backend('MM', MM_stack, output = 'absMotions', dtypes = ['uint8', 'uint16', 'float32'], unit = 'intensity units')
+
+def get_uint8_converter(imageStack):
+    """
+        returns function which scales single images of imageStack to uint8 (as needed by cv2 optical flow)
+        the intensity range of the whole stack is used such that all frames are scaled equally
+    """
+    stack_min, stack_max = float(imageStack.min()), float(imageStack.max())
+    scale = 255.0/(stack_max - stack_min) if stack_max > stack_min else 1.0
+    return lambda image: cv2.convertScaleAbs(image, alpha = scale, beta = -stack_min*scale)
+
+def get_searchblocks(firstimage, blockwidth, canny = True, blockmask = None, stride = None):
+    """
+        selects blocks in which motion is calculated, blocks on grid with stride (see get_block_grid)
+        canny: blocks with tissue found by find_searchblocks in first image
+        blockmask: bool array of selected blocks (e.g. union of ROIs), combined with canny selection
+        returns None if no selection is made (= all blocks)
+    """
+    searchblocks = None
+    if canny:
+        print("performing Canny edge detection on first frame to select region")
+        searchblocks = find_searchblocks(firstimage, blockwidth, stride)
+    if blockmask is not None:
+        searchblocks = blockmask if searchblocks is None else (searchblocks & blockmask)
+    return searchblocks
+
+def find_searchblocks(inputimage, blockwidth, stride = None):
     ''' 
         perform canny edge detection and binary operations 
         to define searchblocks, i.e. blocks in which to perform blockmatching
     '''
 
-    size_ver, size_hor = inputimage.shape[:2]   # is calculated twice... optimize
-    MVs_ver = math.floor(size_ver/blockwidth)   # number of MVs in horizontal direction
-    MVs_hor = math.floor(size_hor/blockwidth)
-
-    blur = cv2.GaussianBlur(inputimage, (7,7), 2)
+    blur = cv2.GaussianBlur(get_match_image(inputimage), (7,7), 2)
     I = np.max(blur) - blur
     edges = feature.canny(I,sigma = 3, use_quantiles = True, low_threshold  = 0.2,high_threshold = 0.7)
     #https://www.mathworks.com/matlabcentral/answers/458235-why-is-the-canny-edge-detection-in-matlab-different-to-opencv
@@ -192,5 +1680,7 @@ def find_searchblocks(inputimage, blockwidth):
     
     # if one component of edge(=cleaned) in searchRegion -> dont't find MV
     #edges = np.ones((MVs_ver, MVs_hor), dtype=bool)
-    searchblocks = block_reduce(cleaned, block_size=(blockwidth,blockwidth), func=np.any) #downsample detected edge -> if any value in block = True -> calculate optical flow
-    return searchblocks[:MVs_ver,:MVs_hor] #cut off overlapping values
\ No newline at end of file
+    #downsample detected edge -> if any value in block = True -> calculate optical flow
+    grid = get_block_grid(inputimage.shape[:2], blockwidth, stride)
+    searchblocks = get_block_sums(cleaned.astype(np.uint8), blockwidth, stride or blockwidth, grid) > 0
+    return searchblocks
\ No newline at end of file
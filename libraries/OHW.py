@@ -5,11 +5,40 @@ import tifffile, cv2, datetime, pickle
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
-from libraries import OFlowCalc, Filters, plotfunctions, helpfunctions, PeakDetection, videoreader
+from libraries import OFlowCalc, Filters, plotfunctions, helpfunctions, PeakDetection, videoreader, MotionCache, MotionAccumulator, MotionCheckpoint
 
 import moviepy.editor as mpy
 from moviepy.video.io.bindings import mplfig_to_npimage
 
+# motion methods which can be selected in calculate_motion
+motion_methods = [("BM", "Blockmatching"), ("BMR", "Blockmatching to reference frame (displacement)"), ("GF", "Gunnar-Farnebäck"), 
+    ("LK", "Lucas-Kanade"), ("PC", "FFT correlation of blocks"), ("MM", "MuscleMotion")]
+# search patterns for BM, see OFlowCalc.BM_fastsearch and OFlowCalc.BM_predictive
+# fast search patterns are approximate (numpy only, see README), exhaustive search with a compiled engine is usually faster
+search_patterns = [("exhaustive", "Exhaustive search (exact)"), ("threestep", "Three-step search (approximate)"), 
+    ("diamond", "Diamond search (approximate)"), ("arps", "Adaptive rood pattern search (approximate)"), 
+    ("predictive", "Predictive search (MVs of previous frame pair)")]
+# grids of blocks for BM + BMR, stride = blockwidth / density, see OFlowCalc.get_block_grid
+grid_densities = [(1, "Non-overlapping blocks (stride = blockwidth)"), (2, "Overlapping blocks (stride = blockwidth/2)"), 
+    (4, "Overlapping blocks (stride = blockwidth/4)")]
+# methods for which blockwidth + max_shift can be proposed by tune_BM_parameters
+tuning_methods = ["BM", "BMR"]
+
+def get_BM_searches(strided = False):
+    '''
+        search patterns (of search_patterns) for which a blockmatching engine is available, strided: for grids with stride != blockwidth
+    '''
+    return [search for search, search_name in search_patterns 
+        if any(OFlowCalc.check_BM_engine(engine, search, strided) is None for engine in OFlowCalc.BM_engines)]
+
+def get_grid_stride(method, blockwidth, density):
+    '''
+        stride of grid with density for method, None = default grid of non-overlapping blocks
+    '''
+    if not OFlowCalc.motion_backends[method]["stride"] or density == 1:
+        return None
+    return max(1, blockwidth // density)
+
 class OHW():
     """
         main class of OpenHeartWare
@@ -22,6 +51,7 @@ class OHW():
         #self.ROIImageStack = None      # array for ROIs
         self.rawMVs = None              # array for raw motion vectors (MVs)
         self.unitMVs = None             # MVs in correct unit (microns)
+        self.rawDisplacements = None    # displacement of blocks relative to reference frame (method BMR)
 
         #self.MV_parameters = None       # dict for MV parameters
         
@@ -33,6 +63,10 @@ class OHW():
         self.avg_MotionY = None         # time averaged y-motion
         self.max_avgMotion = None       # maximum of time averaged motions
         self.timeindex = None           # time index for 1D-representation
+        self.mean_displacements = None  # displacement trace, see get_mean_displacement
+        self.displacement_timeindex = None
+        self.motion_accumulator = None  # running summary of MVs, filled during calculation
+        self.roi_analyses = []          # kinetics + PeakDetection of each ROI, see init_roi_motion
 
         self.PeakDetection = PeakDetection.PeakDetection()    # class which detects + saves peaks
         self.video_loaded = False       # tells state if video is connected to ohw-objecet
@@ -40,6 +74,8 @@ class OHW():
         #self.exceptions = None
         #self.isROI_OHW = False
         self.config = helpfunctions.read_config() # load current config
+        self.motion_cache = MotionCache.MotionCache.from_config(self.config) # previously calculated motion
+        self.stop_requested = False     # set by stop_motion, stops running motion calculation
         
         self.raw_videometa = {"inputpath":""} # raw info after importing  # dict of video metadata: microns_per_px, fps, blackval, whiteval,
         self.set_default_videometa(self.raw_videometa)
@@ -48,11 +84,18 @@ class OHW():
             "motion_calculated":False, "has_MVs": False, "results_folder":""}
         self.init_kinplot_options()
     
-    def import_video(self, inputpath, *args, **kwargs):        
-        self.rawImageStack, self.raw_videometa = videoreader.import_video(inputpath)
+    def import_video(self, inputpath, out_of_core = None, *args, **kwargs):
+        '''
+            out_of_core: read frames on demand instead of loading whole video into memory (see videoreader.FrameStack)
+            if None, setting of config is used
+        '''
+        if out_of_core is None:
+            out_of_core = self.config.getboolean('DEFAULT VALUES', 'out_of_core', fallback = False)
+        self.rawImageStack, self.raw_videometa = videoreader.import_video(inputpath, out_of_core = out_of_core)
         self.set_default_videometa(self.raw_videometa)
         self.videometa = self.raw_videometa.copy()
         self.set_auto_results_folder()
+        self.set_rois(videoreader.get_rois_file(inputpath))
         self.video_loaded = True
         
     def import_video_thread(self, inputpath):
@@ -61,7 +104,8 @@ class OHW():
         
     def reload_video(self, *args, **kwargs):
         inputpath = self.videometa["inputpath"]
-        self.rawImageStack, self.raw_videometa = videoreader.import_video(inputpath)
+        out_of_core = self.config.getboolean('DEFAULT VALUES', 'out_of_core', fallback = False)
+        self.rawImageStack, self.raw_videometa = videoreader.import_video(inputpath, out_of_core = out_of_core)
         self.video_loaded = True
 
     def reload_video_thread(self):
@@ -103,9 +147,11 @@ class OHW():
             px_longest: resolution of longest side
             if px_longest = None: original resolution is used
             roi: specify region of interest, coordinates of rectangular that was selected as ROI in unmodified coordinates
+            interpolation of scaling, threads + lazy scaling (frames scaled when read) are set in config (DEFAULT VALUES)
         '''
         
-        self.analysis_meta.update({'px_longest': px_longest, 'roi': roi, "scalingfactor":1})
+        interpolation = self.config.get('DEFAULT VALUES', 'scaling_interpolation', fallback = 'area')
+        self.analysis_meta.update({'px_longest': px_longest, 'roi': roi, "scalingfactor":1, "interpolation": interpolation})
         
         self.analysisImageStack = self.rawImageStack
         # select roi
@@ -116,20 +162,63 @@ class OHW():
         # rescale input
         # take original resoltuion if no other specified
         if px_longest != None:
-            self.analysisImageStack, self.analysis_meta["scalingfactor"] = helpfunctions.scale_ImageStack(self.analysisImageStack, px_longest=px_longest)
+            self.analysisImageStack, self.analysis_meta["scalingfactor"] = helpfunctions.scale_ImageStack(self.analysisImageStack, 
+                px_longest=px_longest, interpolation = helpfunctions.interpolations[interpolation], 
+                threads = self.config.getint('DEFAULT VALUES', 'threads', fallback = 1), 
+                lazy = self.config.getboolean('DEFAULT VALUES', 'lazy_scaling', fallback = False))
         
         self.analysis_meta.update({'shape': self.analysisImageStack.shape})
 
+    def set_rois(self, rois):
+        """
+            sets regions of interest (e.g. single tissues) which are analyzed separately
+            rois: list of (name, region), region is rectangle (x, y, width, height) or bool mask
+            in coordinates of the raw image (as roi in set_analysisImageStack)
+            motion is calculated once for the union of all ROIs, see init_roi_motion
+        """
+        self.analysis_meta["rois"] = list(rois)
+        if len(rois) > 0:
+            print("ROIs set:", [name for name, region in rois])
+
+    def get_roi_blockmasks(self, blockwidth, stride = None):
+        """
+            returns bool array of blocks in grid of motion (see OFlowCalc.get_block_grid) for each ROI
+            a block belongs to a ROI if its center lies inside the ROI
+        """
+        shape = self.analysis_meta["shape"]
+        grid = OFlowCalc.get_block_grid(shape[1:3], blockwidth, stride)
+        scalingfactor = self.analysis_meta["scalingfactor"]
+        offset = self.analysis_meta["roi"][:2] if self.analysis_meta["roi"] != None else (0, 0)
+        
+        # block centers in coordinates of raw image
+        centers_y, centers_x = OFlowCalc.get_block_centers(grid, blockwidth, stride)
+        centers_y = centers_y / scalingfactor + offset[1]
+        centers_x = centers_x / scalingfactor + offset[0]
+        
+        blockmasks = []
+        for name, region in self.analysis_meta.get("rois", []):
+            if isinstance(region, np.ndarray):
+                rows = np.clip(centers_y.astype(int), 0, region.shape[0] - 1)
+                cols = np.clip(centers_x.astype(int), 0, region.shape[1] - 1)
+                blockmask = region[np.ix_(rows, cols)].astype(bool)
+            else:
+                x, y, width, height = region
+                blockmask = np.outer((centers_y >= y) & (centers_y < y + height), (centers_x >= x) & (centers_x < x + width))
+            blockmasks.append(blockmask)
+        return blockmasks
+
     def save_ohw(self):
         '''
             saves ohw analysis object with all necessary info
             especially useful after batchrun
             -> no need to recalculate MVs when filters/ plotting parameters are changed
         '''
-        if self.analysis_meta["results_folder"] == "": # don't save when no file loaded
+        if self.analysis_meta["results_folder"] == "" or not self.analysis_meta["motion_calculated"]: # don't save when no file loaded or no motion available
             return
         filename = str(self.analysis_meta["results_folder"]/'ohw_analysis.pickle')
-        savedata = [self.analysis_meta, self.videometa, self.rawMVs, self.PeakDetection.Peaks] 
+        self.analysis_meta["roi_peaks"] = {roi_analysis["name"]: roi_analysis["PeakDetection"].Peaks for roi_analysis in self.roi_analyses}
+        rawMotion = self.rawMVs if self.analysis_meta["has_MVs"] else self.absMotions # intensity based methods have no MVs
+        savedata = [self.analysis_meta, self.videometa, rawMotion, self.PeakDetection.Peaks, self.rawDisplacements] 
         # keep saving minimal, everything should be reconstructed from these parameters...
 
         self.analysis_meta["results_folder"].mkdir(parents = True, exist_ok = True)
@@ -146,39 +235,240 @@ class OHW():
         
         with open(filename, 'rb') as loadfile:
             data = pickle.load(loadfile)
-        self.analysis_meta, self.videometa, self.rawMVs, Peaks = data
+        self.analysis_meta, self.videometa, rawMotion, Peaks = data[:4]
+        self.rawDisplacements = data[4] if len(data) > 4 else None # analyses saved before displacements were stored
+        if self.analysis_meta["has_MVs"]:
+            self.rawMVs = rawMotion
+            self.analysis_meta.setdefault("MV_dtype", str(rawMotion.dtype)) # analyses saved before int8 storage: float64
+        else:
+            self.rawMVs, self.absMotions = None, rawMotion
         self.video_loaded = False
+        self.motion_accumulator = None
         self.init_motion()
         self.set_peaks(Peaks) #call after init_motion as this resets peaks
 
-    def calculate_motion(self, method = 'BM', progressSignal = None, **parameters):
+    def calculate_motion(self, method = 'BM', progressSignal = None, state = None, **parameters):
         """
             calculates motion (either motionvectors MVs or absolute motion) of imagestack based 
             on specified method and parameters
 
-            allowed methods:
+            allowed methods (registered in OFlowCalc.motion_backends):
             -BM: blockmatch
             -GF: gunnar farnbäck
             -LK: lucas-kanade
+            -PC: normalized FFT correlation of blocks (motion up to blockwidth/2)
             -MM: musclemotion
+            -BMR: blockmatch relative to reference frame (parameter reference_frame, 'auto' = frame in relaxed state), 
+                  gives displacement of each frame (rawDisplacements), MVs are differences of displacements
+            
+            for BM, a grid of overlapping blocks can be selected by parameter stride (< blockwidth, see OFlowCalc.get_block_grid)
+            
+            for BM + BMR, parameter drift_compensation = True estimates the global translation of each frame pair (BMR: of each frame 
+            relative to reference frame) first (see OFlowCalc.get_global_drift), blocks are only searched within max_shift around it
+            -> MVs contain only the residual motion, the drift is stored in analysis_meta["global_drift"] (see get_global_drift_MVs)
+            
+            for BM, the blockmatching engine can be selected by parameter engine ('template', 'pyramid', 'numba', 'boxfilter')
+            see OFlowCalc.BM_engines, the search pattern by parameter search (see search_patterns)
+            without engine, the engine of config is used (auto if it can't be used for search/stride), engine auto is selected 
+            by select_BM_engine only if the motion is not in motion_cache (cache key contains 'auto', not the selected engine), 
+            the used engine is stored in MV_parameters 
+            and exported (see get_export_parameters), all exact engines give the same MVs (see OFlowCalc.select_MV_shifts)
+            
+            motion of same imagestack content + parameters is loaded from motion_cache if available
+            
+            blockmatching writes a checkpoint into the results folder (see MotionCheckpoint), an interrupted
+            calculation of the same imagestack + parameters continues from the last finished frame pair
+            stop_motion stops the calculation, motion_calculated remains False then
+            state: optional function called with the current step ('bench': benchmark of engines, 'mcalc': calculation of motion)
         """
 
+        self.stop_requested = False # before engine selection etc., stop_motion is kept from here on
+        backend = OFlowCalc.motion_backends[method]
+        if parameters.get("stride") in [None, parameters["blockwidth"]]:
+            parameters.pop("stride", None)  # default grid of non-overlapping blocks
+        elif not backend["stride"]:
+            raise ValueError("stride != blockwidth is not available for method " + str(method))
+        if parameters.get("drift_compensation", False) and not backend["drift"]:
+            raise ValueError("drift compensation is not available for method " + str(method))
+        
+        if len(self.analysis_meta.get("rois", [])) > 0:
+            # calculate motion only once for union of all ROIs
+            parameters["blockmask"] = np.any(self.get_roi_blockmasks(parameters["blockwidth"], parameters.get("stride")), axis = 0)
+        self.analysis_meta.pop("roi_peaks", None)
+        
+        self.analysis_meta.pop("engine_benchmark", None)
+        if method == 'BM' and parameters.get("engine") is None:
+            parameters["engine"] = self.config.get('DEFAULT VALUES', 'engine', fallback = 'auto')
+            reason = OFlowCalc.check_BM_engine(parameters["engine"], parameters.get("search", 'exhaustive'), 
+                "stride" in parameters) if parameters["engine"] != 'auto' else None
+            if reason != None:
+                # e.g. engine of config without fast search patterns
+                print(reason, "-> engine of config is replaced by automatic selection")
+                parameters["engine"] = 'auto'
+        if method == 'BMR' and parameters.get("reference_frame", 'auto') in [None, 'auto']:
+            # automatically selected reference is stored in MV_parameters
+            parameters["reference_frame"] = OFlowCalc.get_reference_frame(self.analysisImageStack)
+            print("selected reference frame:", parameters["reference_frame"])
+        
         #store parameters which wwill be used for the calculation of MVs
         self.analysis_meta.update({'Motion_method': method, 'MV_parameters': parameters})
+        if isinstance(self.analysisImageStack, videoreader.FrameStack):
+            # frames read on demand: keep all frames of one pair decoded
+            self.analysisImageStack.set_buffersize(parameters.get("delay", 1) + 1)
+        
+        self.analysis_meta["motion_calculated"] = False
+        self.analysis_meta.pop("global_drift", None)
+        checkpoint_enabled = backend["streaming"] and self.config.getboolean('MOTION CHECKPOINT', 'enabled', fallback = True)
+        motion_key = self.motion_cache.get_key(self.analysisImageStack, method, parameters, self.analysis_meta) if (
+            self.motion_cache.enabled or checkpoint_enabled) else None
+        cache_key = motion_key if self.motion_cache.enabled else None
+        cached = self.motion_cache.load(cache_key) if cache_key != None else None
+        self.motion_accumulator = None
+        if cached != None:
+            print("motion loaded from cache:", cache_key)
+            self.rawMVs, self.absMotions, cached_meta = cached[:3]
+            self.rawDisplacements = cached[3] if len(cached) > 3 else None
+            if "engine" in cached_meta:
+                parameters["engine"] = cached_meta.pop("engine")    # engine selected for cached motion
+            self.analysis_meta.update(cached_meta)
+            self.analysis_meta["motion_calculated"], self.analysis_meta["motion_from_cache"] = True, True
+            self.set_MV_dtype()
+            if progressSignal != None:
+                progressSignal.emit(1.0)
+            return
+        
+        self.analysis_meta.pop("motion_stats", None)
+        self.analysis_meta["motion_from_cache"] = False
+        if method == 'BM' and parameters["engine"] == 'auto':
+            if state != None and parameters.get("search", 'exhaustive') == 'exhaustive':
+                state('bench')
+            self.select_BM_engine(parameters)
+        if state != None:
+            state('mcalc')
+        options, checkpoint = {}, None
+        if backend["streaming"]:
+            motion_stats = {}   # e.g. number of evaluated candidate shifts
+            self.motion_accumulator = MotionAccumulator.MotionAccumulator() # kinetics + averages are ready when last frame is done
+            checkpoint = MotionCheckpoint.MotionCheckpoint.from_config(self.config, 
+                self.analysis_meta["results_folder"], motion_key) if checkpoint_enabled else None
+            options = {"stats": motion_stats, "accumulator": self.motion_accumulator, "checkpoint": checkpoint, 
+                "stop": lambda: self.stop_requested}
+        if parameters.get("drift_compensation", False):
+            self.analysis_meta["global_drift"] = OFlowCalc.get_global_drift(self.analysisImageStack, parameters.get("delay", 1), 
+                parameters.get("reference_frame"))
+            options["drift"] = self.analysis_meta["global_drift"]
+            print("mean absolute global drift (X, Y) in px:", np.abs(options["drift"]).mean(axis = 0))
+        options.update(parameters)
         
-        if method == 'BM':   
-            self.rawMVs = OFlowCalc.BM_stack(self.analysisImageStack, 
-                progressSignal = progressSignal, **parameters)
-            self.analysis_meta["has_MVs"], self.analysis_meta["motion_calculated"] = True, True
+        if self.stop_requested:
+            # stopped during preparation (e.g. engine benchmark, drift)
+            print("motion calculation stopped before start")
+            self.motion_accumulator = None
+            return
+        motion = backend["stack"](self.analysisImageStack, progressSignal = progressSignal, **options)
+        if motion is None:
+            # stopped, finished frame pairs are kept in checkpoint
+            self.motion_accumulator = None
+            return
+        if checkpoint != None:
+            checkpoint.remove()
+        if backend["streaming"]:
+            self.analysis_meta["motion_stats"] = motion_stats
+        
+        self.rawDisplacements = None
+        if backend["output"] == 'MVs':
+            self.rawMVs = motion
+        elif backend["output"] == 'displacements':
+            # relative to reference frame, MVs of frame pairs are differences of displacements
+            self.rawDisplacements = motion
+            self.rawMVs = OFlowCalc.get_displacement_MVs(motion, parameters["delay"], parameters["max_shift"])
+        else:
+            # intensity based, absMotions are set directly without MVs
+            self.rawMVs, self.absMotions = None, motion
+        self.analysis_meta["has_MVs"], self.analysis_meta["motion_calculated"] = backend["output"] != 'absMotions', True
+        
+        self.set_MV_dtype()
+        
+        if cache_key != None:
+            cached_meta = {key: self.analysis_meta[key] for key in ["has_MVs", "motion_stats", "global_drift"] if key in self.analysis_meta}
+            if "engine" in parameters:
+                cached_meta["engine"] = parameters["engine"]
+            absMotions = None if self.analysis_meta["has_MVs"] else self.absMotions
+            self.motion_cache.save(cache_key, [self.rawMVs, absMotions, cached_meta, self.rawDisplacements])
 
-        elif method == 'GF':
-            pass
-        elif method == 'LK':
-            pass
-        elif method == 'MM':
-            # self.absMotions = ...
-            pass
+    def select_BM_engine(self, parameters):
+        '''
+            replaces engine auto in parameters by the fastest exact engine for current imagestack + parameters
+            (see OFlowCalc.benchmark_BM_engines), engines are timed on the blocks selected by canny + ROIs
+            timings of benchmark are stored in analysis_meta["engine_benchmark"] (shown in tab_motion, see get_engine_info)
+        '''
+        search = parameters.get("search", 'exhaustive')
+        if search == 'exhaustive':
+            searchblocks = OFlowCalc.get_searchblocks(self.analysisImageStack[0], parameters["blockwidth"], 
+                parameters.get("canny", True), parameters.get("blockmask"), parameters.get("stride"))
+            parameters["engine"], self.analysis_meta["engine_benchmark"] = OFlowCalc.benchmark_BM_engines(self.analysisImageStack, 
+                parameters["blockwidth"], parameters["delay"], parameters["max_shift"], threads = parameters.get("threads", 1), 
+                stride = parameters.get("stride"), searchblocks = searchblocks)
+        else:
+            # fast search patterns: only engine 'template'
+            parameters["engine"] = OFlowCalc.get_BM_engine(None, search, strided = "stride" in parameters)
 
+    def get_engine_info(self):
+        '''
+            description of the blockmatching engine used for the current motion (+ timings if selected by benchmark), 
+            None for other methods
+        '''
+        engine = self.analysis_meta.get("MV_parameters", {}).get("engine")
+        if self.analysis_meta.get("Motion_method") != 'BM' or engine is None:
+            return None
+        info = "blockmatching engine: " + str(engine)
+        timings = self.analysis_meta.get("engine_benchmark")
+        if timings:
+            info += " (benchmark, s per frame pair: " + ", ".join(name + " " + "{:.3f}".format(timings[name]) for name in sorted(timings)) + ")"
+        return info
+
+    def stop_motion(self):
+        """
+            stops running motion calculation after the current frame pair (only blockmatching)
+            finished frame pairs stay in the checkpoint and are reused by the next calculation
+        """
+        self.stop_requested = True
+
+    def set_MV_dtype(self):
+        """
+            tags dtype of stored MVs in analysis_meta, e.g. int8 for blockmatching
+        """
+        self.analysis_meta["MV_dtype"] = str(self.rawMVs.dtype) if self.analysis_meta["has_MVs"] else None
+
+    def tune_BM_parameters(self, method = 'BM', blockwidth = 16, delay = 2, canny = True, reference_frame = 'auto', 
+        threads = 1, progressSignal = None, **options):
+        '''
+            proposes max_shift + blockwidth for blockmatching of analysisImageStack (methods in tuning_methods)
+            from a few frame pairs around the motion maximum, see OFlowCalc.tune_BM_parameters for options
+            BMR: pairs of reference frame ('auto' = frame in relaxed state) + frames of largest displacement
+            result is stored in analysis_meta["BM_tuning"] and returned, e.g.
+            tuning = ohw.tune_BM_parameters(delay = 2); ohw.calculate_motion('BM', blockwidth = tuning["blockwidth"], 
+            max_shift = tuning["max_shift"], delay = 2)
+        '''
+        if method not in tuning_methods:
+            raise ValueError("tuning of blockwidth + max_shift is not available for method " + str(method))
+        if method == 'BMR':
+            if reference_frame in [None, 'auto']:
+                reference_frame = OFlowCalc.get_reference_frame(self.analysisImageStack)
+        else:
+            reference_frame = None
+        
+        tuning = OFlowCalc.tune_BM_parameters(self.analysisImageStack, blockwidth, delay, reference_frame = reference_frame, 
+            canny = canny, threads = threads, progressSignal = progressSignal, **options)
+        tuning.update({"method": method, "reference_frame": reference_frame})
+        self.analysis_meta["BM_tuning"] = tuning
+        return tuning
+    
+    def tune_BM_parameters_thread(self, **parameters):
+        self.thread_tune_BM_parameters = helpfunctions.turn_function_into_thread(
+            self.tune_BM_parameters, emit_progSignal=True, **parameters)
+        return self.thread_tune_BM_parameters
+    
     def calculate_motion_thread(self, **parameters):
         self.thread_calculate_motion = helpfunctions.turn_function_into_thread(
             self.calculate_motion, emit_progSignal=True, **parameters)
@@ -189,24 +479,72 @@ class OHW():
             calculate 2D & 1D data representations after motion determination
         '''
         
-        #distinguish between MVs and motion here
+        if not self.analysis_meta["has_MVs"]:
+            # intensity based motion: absMotions already set by calculate_motion, no quivers possible
+            self.unitMVs = None
+            self.get_mean_absMotion()
+            self.get_mean_displacement()
+            self.calc_TimeAveragedMotion()
+            self.PeakDetection.set_data(self.timeindex, self.mean_absMotions)
+            self.init_roi_motion()
+            return
         
         scalingfactor, delay = self.analysis_meta["scalingfactor"], self.analysis_meta["MV_parameters"]["delay"]
         filter = self.analysis_meta["filter_status"]
         
+        # rawMVs might be stored as integers (see analysis_meta["MV_dtype"]), conversion to float with units first
+        unitfactor = self.videometa["microns_per_px"] * self.videometa["fps"] / (delay * scalingfactor)
+        self.unitMVs = (self.rawMVs / scalingfactor) * self.videometa["microns_per_px"] * (self.videometa["fps"] / delay)
+        
         if filter:
             print("filtering single movements")
-            rawMVs_filt = Filters.filter_singlemov(self.rawMVs) #don't change rawMVs! repeated loading would vary it each time
-        else:
-            rawMVs_filt = self.rawMVs
+            self.unitMVs = Filters.filter_singlemov(self.unitMVs, copy = False) #don't change rawMVs! repeated loading would vary it each time
         
-        self.unitMVs = (rawMVs_filt / scalingfactor) * self.videometa["microns_per_px"] * (self.videometa["fps"] / delay)
         self.absMotions = np.sqrt(self.unitMVs[:,0]*self.unitMVs[:,0] + self.unitMVs[:,1]*self.unitMVs[:,1])# get absolute motions per frame        
 
-        self.get_mean_absMotion()
+        if self.motion_accumulator != None:
+            # summary was accumulated during calculation
+            (self.mean_absMotions, self.avg_absMotion, self.avg_MotionX, self.avg_MotionY, 
+                self.max_avgMotion) = self.motion_accumulator.get_results(filter = filter, unitfactor = unitfactor)
+            self.set_timeindex()
+        else:
+            self.get_mean_absMotion()
+            self.calc_TimeAveragedMotion()
         self.prepare_quiver_components()
-        self.calc_TimeAveragedMotion()
+        self.get_mean_displacement()
         self.PeakDetection.set_data(self.timeindex, self.mean_absMotions) #or pass self directly?
+        self.init_roi_motion()
+    
+    def init_roi_motion(self):
+        """
+            splits motion of all blocks into ROIs (from set_rois), no further motion calculation needed
+            for each ROI: kinetics (mean over moving blocks as in get_mean_absMotion), 
+            time averaged motion and own PeakDetection (peaks are restored from analysis_meta["roi_peaks"])
+        """
+        self.roi_analyses = []
+        rois = self.analysis_meta.get("rois", [])
+        if len(rois) == 0:
+            return
+        
+        roi_peaks = self.analysis_meta.get("roi_peaks", {})
+        blockmasks = self.get_roi_blockmasks(self.analysis_meta["MV_parameters"]["blockwidth"], self.get_stride())
+        for (name, region), blockmask in zip(rois, blockmasks):
+            absMotions = self.absMotions[:, blockmask]  # frames x blocks of ROI
+            moving = np.sum(absMotions, axis = 0) != 0
+            if np.any(moving):
+                mean_absMotions = np.mean(absMotions[:, moving], axis = 1)
+                avg_absMotion = np.mean(absMotions[:, moving])
+            else:   # no motion in ROI
+                mean_absMotions, avg_absMotion = np.zeros(absMotions.shape[0]), 0.0
+            
+            peakdetection = PeakDetection.PeakDetection()
+            peakdetection.set_data(self.timeindex, mean_absMotions)
+            if name in roi_peaks:
+                peakdetection.set_peaks(roi_peaks[name])
+                peakdetection.order_peaks()
+            
+            self.roi_analyses.append({"name": name, "blockmask": blockmask, "mean_absMotions": mean_absMotions, 
+                "avg_absMotion": avg_absMotion, "PeakDetection": peakdetection})
     
     def get_mean_absMotion(self):
         """
@@ -220,7 +558,44 @@ class OHW():
         filtered_absMotions = np.copy(self.absMotions) #copy needed, don't influence absMotions
         filtered_absMotions[:,movement_mask] = np.nan
         self.mean_absMotions = np.nanmean(filtered_absMotions, axis=(1,2))
+        self.set_timeindex()
         
+    def get_mean_displacement(self):
+        '''
+            displacement trace: mean absolute displacement [µm] of each frame relative to reference frame (method BMR),
+            mean over blocks which are displaced at any time as in get_mean_absMotion, None without displacements
+        '''
+        if self.rawDisplacements is None:
+            self.mean_displacements, self.displacement_timeindex = None, None
+            return
+        
+        displacements = self.rawDisplacements / self.analysis_meta["scalingfactor"] * self.videometa["microns_per_px"]
+        absDisplacements = np.sqrt(displacements[:,0]*displacements[:,0] + displacements[:,1]*displacements[:,1])
+        moving = np.any(absDisplacements != 0, axis = 0)
+        if np.any(moving):
+            self.mean_displacements = np.mean(absDisplacements[:, moving], axis = 1)
+        else:
+            self.mean_displacements = np.zeros(absDisplacements.shape[0])
+        self.displacement_timeindex = (np.arange(absDisplacements.shape[0]) / self.videometa["fps"]).round(2)
+    
+    def get_global_drift_MVs(self):
+        '''
+            global drift of each frame pair in px (X, Y), shape (frame pairs, 2), zeros without drift compensation
+            -> rawMVs + drift[:, :, None, None] = total motion including drift
+        '''
+        drift = self.analysis_meta.get("global_drift")
+        if drift is None:
+            return np.zeros((self.rawMVs.shape[0], 2), dtype = np.int32)
+        if self.rawDisplacements is not None:
+            # drift of each frame relative to reference frame -> difference of frame pair
+            delay = self.analysis_meta["MV_parameters"]["delay"]
+            return drift[delay:] - drift[:-delay]
+        return drift
+    
+    def set_timeindex(self):
+        """
+            sets time index of kinetics in mean_absMotions
+        """
         self.analysis_meta["results_folder"].mkdir(parents = True, exist_ok = True) #create folder for results if it doesn't exist
         self.timeindex = (np.arange(self.mean_absMotions.shape[0]) / self.videometa["fps"]).round(2)
         #np.save(str(self.analysis_meta["results_folder"] / 'beating_kinetics.npy'), np.array([self.timeindex,self.mean_absMotions]))
@@ -240,12 +615,26 @@ class OHW():
         self.QuiverMotionX = MV_cutoff[:,0,:,:] # changed name to QuiverMotionX as values are manipulated here
         self.QuiverMotionY = MV_cutoff[:,1,:,:]
         
-        bw = self.analysis_meta["MV_parameters"]["blockwidth"]
-        Nx, Ny = MV_cutoff[0,0].shape
-        
-        self.MotionCoordinatesX, self.MotionCoordinatesY = np.meshgrid(
-            np.arange(Ny)*bw+bw/2,
-            np.arange(Nx)*bw+bw/2) #Nx, Ny exchanged (np vs. image indexing); possible issues with odd bws?
+        centers_y, centers_x = OFlowCalc.get_block_centers(MV_cutoff[0,0].shape, 
+            self.analysis_meta["MV_parameters"]["blockwidth"], self.get_stride())
+        self.MotionCoordinatesX, self.MotionCoordinatesY = np.meshgrid(centers_x, centers_y)
+    
+    def get_stride(self):
+        '''
+            distance of blocks in grid of motion in pixels, blockwidth if no stride was set
+        '''
+        MV_parameters = self.analysis_meta["MV_parameters"]
+        return MV_parameters.get("stride") or MV_parameters["blockwidth"]
+    
+    def get_heatmap_extent(self):
+        '''
+            extent (left, right, bottom, top) of grid of motion in pixels of analysisImageStack, e.g. for imshow of absMotions
+            each block is drawn as square of size stride around its center
+        '''
+        stride = self.get_stride()
+        centers_y, centers_x = OFlowCalc.get_block_centers(self.absMotions.shape[1:], 
+            self.analysis_meta["MV_parameters"]["blockwidth"], stride)
+        return (centers_x[0] - stride/2, centers_x[-1] + stride/2, centers_y[-1] + stride/2, centers_y[0] - stride/2)
             
     def save_MVs(self):
         """
@@ -258,7 +647,11 @@ class OHW():
         save_file = str(results_folder / 'rawMVs.npy')
         np.save(save_file, self.rawMVs)
         save_file_units = str(results_folder / 'unitMVs.npy')
-        np.save(save_file_units, self.unitMVs)            
+        np.save(save_file_units, self.unitMVs)
+        if self.rawDisplacements is not None:
+            np.save(str(results_folder / 'rawDisplacements.npy'), self.rawDisplacements)            
+        if self.analysis_meta.get("global_drift") is not None:
+            np.save(str(results_folder / 'globalDrift.npy'), self.get_global_drift_MVs())
 
     #def plot_scalebar(self):
     # moved to module: helpfunctions.insert_scalebar(imageStack, videometa, analysis_meta)
@@ -308,6 +701,9 @@ class OHW():
 
         self.PeakDetection.detect_peaks(ratio, number_of_neighbours)
         self.order_peaks()
+        for roi_analysis in self.roi_analyses: # same settings for each ROI
+            roi_analysis["PeakDetection"].detect_peaks(ratio, number_of_neighbours)
+            roi_analysis["PeakDetection"].order_peaks()
     
     def order_peaks(self):
         self.PeakDetection.order_peaks()
@@ -319,14 +715,73 @@ class OHW():
         self.PeakDetection.calc_peakstatistics()
         return self.PeakDetection.get_peakstatistics()
     
+    def get_roi_peakstatistics(self):
+        """
+            returns peakstatistics of each ROI as dict {name: peakstatistics}
+        """
+        roi_peakstatistics = {}
+        for roi_analysis in self.roi_analyses:
+            roi_analysis["PeakDetection"].calc_peakstatistics()
+            roi_peakstatistics[roi_analysis["name"]] = roi_analysis["PeakDetection"].get_peakstatistics()
+        return roi_peakstatistics
+    
     def export_analysis(self):
-        self.PeakDetection.export_analysis(self.analysis_meta["results_folder"])
+        displacement = (self.displacement_timeindex, self.mean_displacements) if self.mean_displacements is not None else None
+        self.PeakDetection.export_analysis(self.analysis_meta["results_folder"], displacement = displacement, 
+            parameters = self.get_export_parameters())
+        self.export_roi_analysis()
+        if displacement != None:
+            self.plot_displacement()
+    
+    def get_export_parameters(self):
+        """
+            (name, value) of method + single valued MV_parameters (e.g. engine of blockmatching) for export
+        """
+        parameters = [("method", self.analysis_meta.get("Motion_method"))]
+        for name, value in sorted(self.analysis_meta.get("MV_parameters", {}).items()):
+            if value is None or isinstance(value, (str, bool, int, float)):
+                parameters.append((name, value))
+            elif isinstance(value, np.generic):
+                parameters.append((name, value.item()))
+        return parameters
+    
+    def export_roi_analysis(self):
+        """
+            saves kinetics, peaks + peakstatistics and kinetics plot for each ROI
+        """
+        self.get_roi_peakstatistics()
+        results_folder = self.analysis_meta["results_folder"]
+        for roi_analysis in self.roi_analyses:
+            peakdetection = roi_analysis["PeakDetection"]
+            peakdetection.export_analysis(results_folder, filename = 'Motionanalysis_' + roi_analysis["name"] + '.xlsx', 
+                parameters = self.get_export_parameters())
+            plotfunctions.plot_Kinetics(self.timeindex, roi_analysis["mean_absMotions"], self.kinplot_options, 
+                peakdetection.hipeaks, peakdetection.lopeaks, results_folder / ('beating_kinetics_' + roi_analysis["name"] + '.png'), 
+                ylabel = self.get_kinetics_label())
     
     def plot_beatingKinetics(self, filename=None):
         if filename == None:
             filename=self.analysis_meta["results_folder"]/ 'beating_kinetics.png'
         plotfunctions.plot_Kinetics(self.timeindex, self.mean_absMotions, self.kinplot_options, 
-                self.PeakDetection.hipeaks, self.PeakDetection.lopeaks, filename)
+                self.PeakDetection.hipeaks, self.PeakDetection.lopeaks, filename, ylabel = self.get_kinetics_label())
+
+    def get_kinetics_label(self):
+        '''
+            label of beating kinetics with unit of motion method (see OFlowCalc.motion_backends), 
+            e.g. intensity units for MM instead of µm/s
+        '''
+        backend = OFlowCalc.motion_backends.get(self.analysis_meta.get("Motion_method"), {})
+        return u'Mean Absolute Motion [' + backend.get("unit", u'\xb5m/s') + ']'
+
+    def plot_displacement(self, filename=None):
+        '''
+            plots displacement trace (see get_mean_displacement)
+        '''
+        if filename == None:
+            filename=self.analysis_meta["results_folder"]/ 'displacement_kinetics.png'
+        plotoptions = dict(self.kinplot_options, vmax = None, mark_peaks = False) # peaks + vmax refer to velocity
+        plotfunctions.plot_Kinetics(self.displacement_timeindex, self.mean_displacements, plotoptions, [], [], filename, 
+            ylabel = u'Mean Absolute Displacement [\xb5m]')
 
     def init_kinplot_options(self):
         self.kinplot_options = dict(self.config._sections['KINPLOT OPTIONS'])
@@ -348,6 +803,11 @@ class OHW():
         ''' calculates time averaged motion for abs. motion, x- and y-motion '''
         
         self.avg_absMotion = np.nanmean(self.absMotions, axis = 0)
+        if self.unitMVs is None: # no x-/ y-motion for intensity based motion
+            self.avg_MotionX, self.avg_MotionY = None, None
+            self.max_avgMotion = np.max(self.avg_absMotion)
+            return
+        
         MotionX = self.unitMVs[:,0,:,:]
         MotionY = self.unitMVs[:,1,:,:]    #squeeze not necessary anymore, dimension reduced
         
@@ -65,7 +65,7 @@ class PeakDetection():
         
         #remove peaks that are smaller than a certain threshold, e.g. ratio = 1/15
         peakheights = self.motion[peaks_]
-        threshold = ratio * np.max(peakheights)
+        threshold = ratio * np.max(peakheights) if len(peakheights) > 0 else 0 # no maxima e.g. in region without motion
         peaks_th = peaks_[peakheights > threshold]  #th=thresholded?
         
         foundPeaks = peaks_th.shape[0] #set number of found peaks
@@ -139,8 +139,10 @@ class PeakDetection():
     def get_peakstatistics(self):
         return self.peakstatistics
     
-    def export_analysis(self, results_folder):
+    def export_analysis(self, results_folder, filename = 'Motionanalysis.xlsx', displacement = None, parameters = None):
         #save peaks and peakanalysis to excel file:
+        #displacement: optional (timeindex, displacement trace) of motion relative to reference frame
+        #parameters: optional list of (name, value) of motion calculation, e.g. method + engine
         
         workbook_peaks = Workbook()
         sheet_peaks = workbook_peaks.active
@@ -177,8 +179,21 @@ class PeakDetection():
 
         for time, motion in zip(self.timeindex,self.motion):
             sheet_kinetics.append([time, motion])
+        
+        if displacement != None:
+            sheet_displacement = workbook_peaks.create_sheet("Displacement", 1)
+            sheet_displacement.append(['t [s]', 'displacement [µm]'])
+            for time, mean_displacement in zip(*displacement):
+                sheet_displacement.append([time, mean_displacement])
+        
+        if parameters != None:
+            sheet_parameters = workbook_peaks.create_sheet("Parameters")
+            sheet_parameters.append(['parameter', 'value'])
+            for name, value in parameters:
+                sheet_parameters.append([name, value])
+            sheet_parameters.column_dimensions['A'].width = 20
                 
-        save_file = str(results_folder / 'Motionanalysis.xlsx')
+        save_file = str(results_folder / filename)
         workbook_peaks.save(save_file)
 
     """
@@ -193,6 +208,7 @@ class PeakDetection():
         results_folder = analysis_meta["results_folder"]
         scalingfactor = analysis_meta["scalingfactor"]
         blockwidth = analysis_meta["MV_parameters"]["blockwidth"]
+        stride = analysis_meta["MV_parameters"].get("stride") or blockwidth
         delay = analysis_meta["MV_parameters"]["delay"]
         max_shift = analysis_meta["MV_parameters"]["max_shift"]
         
@@ -201,6 +217,7 @@ class PeakDetection():
         sheet_peaks.append(['Used parameters:', '', 'unit'])
         sheet_peaks.append(['scaling factor for calculation: ', scalingfactor, 'rel. to input'])
         sheet_peaks.append(['width of macroblocks ', blockwidth, 'pixels'])
+        sheet_peaks.append(['distance of macroblocks (stride) ', stride, 'pixels'])
         sheet_peaks.append(['delay between images', delay, 'frames'])
         #sheet_peaks.append(['framerate', fps, 'frames/sec']) #really needed?
         sheet_peaks.append(['maximum allowed movement ', max_shift, 'pixels'])
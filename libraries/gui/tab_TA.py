@@ -129,13 +129,14 @@ class TabTA(QWidget):
 
     def init_TAmotion(self): 
         max_motion = self.parent.current_ohw.max_avgMotion
+        extent = self.parent.current_ohw.get_heatmap_extent()
         
         self.imshow_motion_total = self.ax_TA_tot.imshow(self.parent.current_ohw.avg_absMotion, 
-            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear")
+            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear", extent = extent)
         self.imshow_motion_x = self.ax_TA_x.imshow(self.parent.current_ohw.avg_MotionX, 
-            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear")
+            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear", extent = extent)
         self.imshow_motion_y = self.ax_TA_y.imshow(self.parent.current_ohw.avg_MotionY, 
-            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear")
+            vmin = 0, vmax = max_motion, cmap="jet", interpolation="bilinear", extent = extent)
         
         self.canvas_TA_tot.draw()
         self.canvas_TA_x.draw()
@@ -56,12 +56,27 @@ class TabBatch(QWidget):
         #batch param
         self.label_parameters = QLabel('Settings during calculation of motion vectors:')
         self.label_parameters.setFont(QFont("Times",weight=QFont.Bold))
+        self.label_method = QLabel('Method')
+        self.label_search = QLabel('Search pattern (Blockmatching)')
+        self.label_grid = QLabel('Grid of blocks (Blockmatching)')
         self.label_blockwidth = QLabel('Blockwidth (in pixels)')
         self.label_delay = QLabel('Delay (in frames)')
         self.label_maxShift = QLabel('Maximum shift p (in pixels)')
         
         #use own grid for spinboxes...
         
+        self.combo_method = QComboBox()
+        for method, method_name in OHW.motion_methods:
+            self.combo_method.addItem(method_name, method)
+        self.combo_search = QComboBox()
+        for search, search_name in OHW.search_patterns:
+            self.combo_search.addItem(search_name, search)
+        self.combo_grid = QComboBox()
+        for density, grid_name in OHW.grid_densities:
+            self.combo_grid.addItem(grid_name, density)
+        self.combo_method.currentIndexChanged[int].connect(self.update_grid_options)
+        self.combo_search.currentIndexChanged[int].connect(self.update_grid_options)
+        
         #spinboxes incl settings
         self.spinbox_blockwidth  = QSpinBox()
         self.spinbox_delay = QSpinBox()
@@ -96,6 +111,7 @@ class TabBatch(QWidget):
         self.checkScaling = QCheckBox("Scale longest side to 1024 px during calculation")
         self.check_batchresultsFolder = QCheckBox("Use standard results folder, individual for each video")
         self.check_autoPeak = QCheckBox("Detect Peaks and export graph")
+        self.check_autotune = QCheckBox("Propose blockwidth + maximum shift for each video (Blockmatching)")
         
         # create a variable for the checkbox status
         # actually not needed anymore...
@@ -110,6 +126,7 @@ class TabBatch(QWidget):
         self.checkFilter.setChecked(True)
         self.checkCanny.setChecked(True)
         self.check_autoPeak.setChecked(True)
+        self.check_autotune.setChecked(False)
         #self.checkFilter.setEnabled(False)  # to be implemented...
         self.checkSaveMotionVectors.setChecked(self.saveMotionVectors_status)
         self.checkHeatmaps.setChecked(self.heatmap_status)
@@ -151,12 +168,18 @@ class TabBatch(QWidget):
         self.grid_param = QGridLayout()
         
         self.grid_param.addWidget(self.label_parameters,        0,0,1,2)
-        self.grid_param.addWidget(self.label_blockwidth,        1,0)
-        self.grid_param.addWidget(self.spinbox_blockwidth,      1,1)
-        self.grid_param.addWidget(self.label_delay,             2,0)
-        self.grid_param.addWidget(self.spinbox_delay,           2,1)
-        self.grid_param.addWidget(self.label_maxShift,          3,0)
-        self.grid_param.addWidget(self.spinbox_maxShift,        3,1)
+        self.grid_param.addWidget(self.label_method,            1,0)
+        self.grid_param.addWidget(self.combo_method,            1,1)
+        self.grid_param.addWidget(self.label_search,            2,0)
+        self.grid_param.addWidget(self.combo_search,            2,1)
+        self.grid_param.addWidget(self.label_blockwidth,        3,0)
+        self.grid_param.addWidget(self.spinbox_blockwidth,      3,1)
+        self.grid_param.addWidget(self.label_delay,             4,0)
+        self.grid_param.addWidget(self.spinbox_delay,           4,1)
+        self.grid_param.addWidget(self.label_maxShift,          5,0)
+        self.grid_param.addWidget(self.spinbox_maxShift,        5,1)
+        self.grid_param.addWidget(self.label_grid,              6,0)
+        self.grid_param.addWidget(self.combo_grid,              6,1)
 
         self.grid_param.setSpacing(15)
         self.grid_param.setAlignment(Qt.AlignTop|Qt.AlignLeft)
@@ -175,17 +198,18 @@ class TabBatch(QWidget):
         self.grid_overall.addWidget(self.check_batchresultsFolder,   8,0)
         self.grid_overall.addWidget(self.checkScaling,          9,0)
         self.grid_overall.addWidget(self.checkCanny,            10,0)
-        self.grid_overall.addWidget(self.checkFilter,           11,0)
-        self.grid_overall.addWidget(self.check_autoPeak,        12,0)
-        self.grid_overall.addWidget(self.checkHeatmaps,         13,0)
-        self.grid_overall.addWidget(self.checkQuivers,          14,0)
-        self.grid_overall.addWidget(self.label_results,         15,0)
-        self.grid_overall.addWidget(self.label_results_folder,  15,1,1,2)
-        self.grid_overall.addWidget(self.btn_resultsfolder,     16,0)
-        self.grid_overall.addWidget(self.btn_startBatch,        16,1)
-        self.grid_overall.addWidget(self.btn_stopBatch,         16,2)
-        self.grid_overall.addWidget(self.progressbar,           17,0,1,3)
-        self.grid_overall.addWidget(self.label_state,           18,0,1,3)
+        self.grid_overall.addWidget(self.check_autotune,        11,0)
+        self.grid_overall.addWidget(self.checkFilter,           12,0)
+        self.grid_overall.addWidget(self.check_autoPeak,        13,0)
+        self.grid_overall.addWidget(self.checkHeatmaps,         14,0)
+        self.grid_overall.addWidget(self.checkQuivers,          15,0)
+        self.grid_overall.addWidget(self.label_results,         16,0)
+        self.grid_overall.addWidget(self.label_results_folder,  16,1,1,2)
+        self.grid_overall.addWidget(self.btn_resultsfolder,     17,0)
+        self.grid_overall.addWidget(self.btn_startBatch,        17,1)
+        self.grid_overall.addWidget(self.btn_stopBatch,         17,2)
+        self.grid_overall.addWidget(self.progressbar,           18,0,1,3)
+        self.grid_overall.addWidget(self.label_state,           19,0,1,3)
        
         self.grid_overall.setSpacing(15)        
         self.grid_overall.setAlignment(Qt.AlignTop|Qt.AlignLeft)
@@ -205,6 +229,16 @@ class TabBatch(QWidget):
         #for btn in self.findChildren(QPushButton):
         #   btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         
+    def update_grid_options(self, index = None):
+        '''
+            grids with stride != blockwidth only for search patterns with strided blockmatching engine (see OHW.get_BM_searches)
+        '''
+        grid_available = (self.combo_method.currentData() != 'BM' 
+            or self.combo_search.currentData() in OHW.get_BM_searches(strided = True))
+        if not grid_available:
+            self.combo_grid.setCurrentIndex(self.combo_grid.findData(1))
+        self.combo_grid.setEnabled(grid_available)
+
     def on_addBatchVideo(self):
     
         new_files = UserDialogs.chooseFilesByUser("Select video to add for batch analysis", input_folder=self.parent.config['LAST SESSION']['input_folder'])
@@ -247,6 +281,7 @@ class TabBatch(QWidget):
             self.videofiles = videofiles
             self.param = param
             self.stop_flag = False
+            self.curr_analysis = None
 
         def set_state(self, filenr, state):
             statedict = {"filenr":filenr,"state":state}
@@ -260,6 +295,7 @@ class TabBatch(QWidget):
                 
                 filepath = pathlib.Path(file)
                 curr_analysis = OHW.OHW()
+                self.curr_analysis = curr_analysis
                 curr_analysis.import_video(filepath)
                 if self.stop_flag: break    #break controlled if stop flag is triggered
                 
@@ -282,8 +318,20 @@ class TabBatch(QWidget):
                     #    self.analysis_meta["results_folder"] = inputpath.parent / ("results_" + str(inputpath.stem) )
                 
                 if self.stop_flag: break
+                param = dict(self.param)
+                autotune, grid_density = param.pop("autotune"), param.pop("grid_density")
+                if autotune and param["method"] in OHW.tuning_methods:
+                    # blockwidth + max_shift proposed for this video, grid keeps selected density
+                    self.set_state(filenr,'tune')
+                    tuning = curr_analysis.tune_BM_parameters(method = param["method"], blockwidth = param["blockwidth"], 
+                        delay = param["delay"], canny = param["canny"], threads = param["threads"])
+                    param["blockwidth"], param["max_shift"] = tuning["blockwidth"], tuning["max_shift"]
+                    param["stride"] = OHW.get_grid_stride(param["method"], param["blockwidth"], grid_density)
+                if self.stop_flag: break
+                
                 self.set_state(filenr,'mcalc')
-                curr_analysis.calculate_motion(**self.param)
+                curr_analysis.calculate_motion(state = lambda state: self.set_state(filenr, state), **param)
+                if self.stop_flag: break    # finished frame pairs are kept in checkpoint of results folder
                 curr_analysis.init_motion()
                 #curr_analysis.save_MVs()
                 #curr_analysis.plot_TimeAveragedMotions('.png') # make available via settings...
@@ -300,7 +348,7 @@ class TabBatch(QWidget):
                     self.set_state(filenr,'heatmapvideo')
                     curr_analysis.save_heatmap(singleframe = False)
                 if self.stop_flag: break
-                if self.param["quivers"]:
+                if self.param["quivers"] and curr_analysis.analysis_meta["has_MVs"]:
                     self.set_state(filenr,'quivervideo')
                     curr_analysis.save_quiver3(singleframe = False, skipquivers = 4) #allow to choose between quiver and quiver3 in future
                 
@@ -314,6 +362,8 @@ class TabBatch(QWidget):
       
         def stopThread(self):
             self.stop_flag = True
+            if self.curr_analysis != None:
+                self.curr_analysis.stop_motion()
     
     def on_startBatch(self):
         self.parent.current_ohw.save_ohw() # saves again as marked peaks might have changed
@@ -327,20 +377,28 @@ class TabBatch(QWidget):
         
         self.Nfiles = len(self.videofiles)
         
+        method = self.combo_method.currentData()
+        search = self.combo_search.currentData()
         blockwidth = self.spinbox_blockwidth.value()
         delay = self.spinbox_delay.value()
         max_shift = self.spinbox_maxShift.value()
+        grid_density = self.combo_grid.currentData()
+        stride = OHW.get_grid_stride(method, blockwidth, grid_density)
+        autotune = self.check_autotune.isChecked()
         scaling = self.checkScaling.isChecked()
         heatmaps = self.checkHeatmaps.isChecked()
         quivers = self.checkQuivers.isChecked()
         filter = self.checkFilter.isChecked()
         canny = self.checkCanny.isChecked()
         autoPeak = self.check_autoPeak.isChecked()
+        processes = self.parent.config.getint('DEFAULT VALUES', 'processes', fallback = 1) # number of processes for motion calculation
+        threads = self.parent.config.getint('DEFAULT VALUES', 'threads', fallback = 1)
         
         global_resultsfolder = self.global_resultsfolder if self.check_batchresultsFolder.isChecked() == False else None #if check == True, then standard results folder is used
         
-        param = {"blockwidth":blockwidth, "delay":delay, "max_shift":max_shift, "scaling":scaling,
-                    "heatmaps":heatmaps, "quivers":quivers, "canny":canny,"filter":filter, "autoPeak":autoPeak, "global_resultsfolder":global_resultsfolder}
+        param = {"method":method, "search":search, "blockwidth":blockwidth, "delay":delay, "max_shift":max_shift, "stride":stride, "scaling":scaling,
+                    "heatmaps":heatmaps, "quivers":quivers, "canny":canny,"filter":filter, "autoPeak":autoPeak, "global_resultsfolder":global_resultsfolder,
+                    "processes":processes, "threads":threads, "autotune":autotune, "grid_density":grid_density}
 
         #create a thread for batch analysis:
         self.thread_batch = self.BatchThread(self.videofiles, param)
@@ -356,7 +414,8 @@ class TabBatch(QWidget):
         self.thread_batch.stopThread()
         
     def updateState(self, statedict):
-        statemsg = {"load":"loading video","scale":"scaling video", "mcalc":"calculating motion",
+        statemsg = {"load":"loading video","scale":"scaling video", "tune":"proposing blockwidth + maximum shift", "mcalc":"calculating motion",
+                        "bench":"benchmarking blockmatching engines",
                         "heatmapvideo":"creating heatmap video", "quivervideo":"creating quivervideo"}
         state = statedict["state"]
         self.filenr = statedict["filenr"] + 1
@@ -179,7 +179,7 @@ class TabKinetics(QWidget):
         self.kinplot_options = self.current_ohw.kinplot_options
         
         self.clear_fig()
-        if self.current_ohw.analysis_meta["has_MVs"]:    # change here to appropriate variable
+        if self.current_ohw.analysis_meta["motion_calculated"]:    # kinetics available for MVs and intensity based motion
             self.init_kinetics()
             self.button_detectPeaks.setEnabled(True)
             self.button_saveKinPlot.setEnabled(True)
@@ -206,7 +206,7 @@ class TabKinetics(QWidget):
         self.ax_kinetics.clear()
         self.plotted_peaks = False        
         self.ax_kinetics.set_xlabel('t [s]', fontsize = 14)
-        self.ax_kinetics.set_ylabel(u'Mean Absolute Motion [\xb5m/s]', fontsize = 14)
+        self.ax_kinetics.set_ylabel(self.current_ohw.get_kinetics_label(), fontsize = 14)
         self.ax_kinetics.tick_params(labelsize = 14)
         self.fig_kinetics.subplots_adjust(bottom=0.20, top=0.98, left=0.05, right=0.98)
     
@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import (QWidget, QGridLayout,QPushButton, QApplication)
@@ -6,10 +7,10 @@ from PyQt5 import QtCore
 
 from PyQt5.QtWidgets import (QLabel, QLineEdit, QGridLayout, 
     QTextEdit,QSizePolicy, QPushButton, QProgressBar,QSlider, 
-    QWidget, QSpinBox, QCheckBox, QFileDialog)
+    QWidget, QSpinBox, QCheckBox, QFileDialog, QComboBox)
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
-from libraries import OHW, helpfunctions
+from libraries import OHW, OFlowCalc, helpfunctions, videoreader
 
 class TabMotion(QWidget):
     
@@ -33,6 +34,26 @@ class TabMotion(QWidget):
         
         #user settings
         #... adjust these according to selected algorithm and available options
+        self.label_method =      QLabel('Method:')
+        self.combo_method = QComboBox()
+        for method, method_name in OHW.motion_methods:
+            self.combo_method.addItem(method_name, method)
+        self.label_search =      QLabel('Search pattern (Blockmatching):')
+        self.combo_search = QComboBox()
+        for search, search_name in OHW.search_patterns:
+            self.combo_search.addItem(search_name, search)
+        self.label_grid =      QLabel('Grid of blocks (Blockmatching):')
+        self.combo_grid = QComboBox()
+        for density, grid_name in OHW.grid_densities:
+            self.combo_grid.addItem(grid_name, density)
+        self.combo_method.currentIndexChanged[int].connect(self.update_grid_options)
+        self.combo_search.currentIndexChanged[int].connect(self.update_grid_options)
+        self.label_reference = QLabel('Reference frame (to reference frame):')
+        self.spinbox_reference = QSpinBox()
+        self.spinbox_reference.setRange(-1,0)
+        self.spinbox_reference.setSpecialValueText('automatic (relaxed state)') # shown for -1
+        self.spinbox_reference.setValue(-1)
+        
         self.label_blockwidth =  QLabel('Blockwidth (in pixels):')
         self.label_delay =       QLabel('Delay (in frames): ')
         self.label_maxShift =    QLabel('Maximum shift p (in pixels): ')
@@ -63,11 +84,28 @@ class TabMotion(QWidget):
         self.check_canny = QCheckBox("Select region for calculation based on Canny filtering")
         self.check_canny.setChecked(True)#connect with config
         
+        #global drift
+        self.check_drift = QCheckBox("Compensate global drift before searching blocks (Blockmatching)")
+        self.check_drift.setChecked(False)
+        
+        #regions of interest, format see videoreader.parse_rois
+        self.label_rois = QLabel('Regions of interest {name: (x, y, width, height)}:')
+        self.line_rois = QLineEdit()
+        self.line_rois.setFixedWidth(400)
+        self.line_rois.setEnabled(False)
+        self.btn_rois = QPushButton('Apply ROIs')
+        self.btn_rois.clicked.connect(self.on_apply_rois)
+        self.btn_rois.setEnabled(False)
+        
         self.btn_getMVs = QPushButton('Calculate motion vectors')
         self.btn_getMVs.clicked.connect(self.on_getMVs)
         self.btn_getMVs.setEnabled(False)
         self.btn_getMVs.setFixedWidth(150)
         
+        self.btn_tune = QPushButton('Propose blockwidth + maximum shift')
+        self.btn_tune.clicked.connect(self.on_tune)
+        self.btn_tune.setEnabled(False)
+        
         self.btn_save_MVs = QPushButton('Save motion vectors')
         self.btn_save_MVs.clicked.connect(self.on_saveMVs)
         self.btn_save_MVs.setEnabled(False)
@@ -110,11 +148,13 @@ class TabMotion(QWidget):
         self.grid_btns.addWidget(self.btn_getMVs, 0,0, Qt.AlignTop|Qt.AlignLeft)
         self.grid_btns.addWidget(self.btn_save_MVs, 0,1, Qt.AlignTop|Qt.AlignLeft)
         self.grid_btns.addWidget(self.btn_load_ohw, 0,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_btns.addWidget(self.btn_tune, 1,0, Qt.AlignTop|Qt.AlignLeft)
 
         btnwidth = 250 
         self.btn_getMVs.setFixedWidth(btnwidth)
         self.btn_load_ohw.setFixedWidth(btnwidth)
         self.btn_save_MVs.setFixedWidth(btnwidth)
+        self.btn_tune.setFixedWidth(btnwidth)
 
         self.grid_overall = QGridLayout()#self._main)
         self.setLayout(self.grid_overall) 
@@ -124,19 +164,31 @@ class TabMotion(QWidget):
         
         self.grid_overall.addWidget(self.info, 0,0,1,4, Qt.AlignTop|Qt.AlignLeft)
         self.grid_overall.addWidget(self.label_settings, 1,0, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.label_blockwidth,2,0, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.spinbox_blockwidth,2,1, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.label_delay,3,0, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.spinbox_delay, 3,1, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.label_maxShift,4,0, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.spinbox_maxShift,4,1, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.label_addOptions, 5,0, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.check_scaling, 6,0,1,2, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.check_canny, 7,0,1,2, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.check_filter, 8,0,1,2, Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addLayout(self.grid_btns, 9,0,1,4,Qt.AlignTop|Qt.AlignLeft)
-        self.grid_overall.addWidget(self.progressbar_MVs, 10,0,1,4)
-        self.grid_overall.addWidget(self.btn_succeed_MVs, 11,0,1,4)
+        self.grid_overall.addWidget(self.label_method,2,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.combo_method,2,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_search,3,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.combo_search,3,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_blockwidth,4,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.spinbox_blockwidth,4,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_delay,5,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.spinbox_delay, 5,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_maxShift,6,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.spinbox_maxShift,6,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_grid,7,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.combo_grid,7,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_reference,8,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.spinbox_reference,8,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_addOptions, 9,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.check_scaling, 10,0,1,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.check_canny, 11,0,1,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.check_drift, 12,0,1,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.check_filter, 13,0,1,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.label_rois, 14,0, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.line_rois, 14,1, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.btn_rois, 14,2, Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addLayout(self.grid_btns, 15,0,1,4,Qt.AlignTop|Qt.AlignLeft)
+        self.grid_overall.addWidget(self.progressbar_MVs, 16,0,1,4)
+        self.grid_overall.addWidget(self.btn_succeed_MVs, 17,0,1,4)
         
     def init_ohw(self):
         ''' set values from current_ohw '''
@@ -144,18 +196,33 @@ class TabMotion(QWidget):
         
         if self.current_ohw.video_loaded:
             self.btn_getMVs.setEnabled(True)
+            self.btn_tune.setEnabled(True)
+            self.spinbox_reference.setMaximum(self.current_ohw.rawImageStack.shape[0] - 1)
         else:
             self.btn_getMVs.setEnabled(False)    
+            self.btn_tune.setEnabled(False)
+        self.init_rois()
         
-        if self.current_ohw.analysis_meta["has_MVs"]:    # change here to appropriate variable
+        if self.current_ohw.analysis_meta["motion_calculated"]:
             self.btn_succeed_MVs.setStyleSheet("background-color: YellowGreen")
-            self.btn_succeed_MVs.setText("Motion available")
-            self.btn_save_MVs.setEnabled(True)
+            engine_info = self.current_ohw.get_engine_info()
+            self.btn_succeed_MVs.setText("Motion available" if engine_info is None else "Motion available, " + engine_info)
+            self.btn_save_MVs.setEnabled(self.current_ohw.analysis_meta["has_MVs"]) # no MVs for intensity based motion
         else:
             self.btn_succeed_MVs.setStyleSheet("background-color: IndianRed")
             self.btn_succeed_MVs.setText("No motion available yet. Calculate new one or load old")
             self.btn_save_MVs.setEnabled(False)
         
+    def update_grid_options(self, index = None):
+        '''
+            grids with stride != blockwidth only for search patterns with strided blockmatching engine (see OHW.get_BM_searches)
+        '''
+        grid_available = (self.combo_method.currentData() != 'BM' 
+            or self.combo_search.currentData() in OHW.get_BM_searches(strided = True))
+        if not grid_available:
+            self.combo_grid.setCurrentIndex(self.combo_grid.findData(1))
+        self.combo_grid.setEnabled(grid_available)
+
     def on_getMVs(self):
         #disable button to not cause interference between different calculations
         self.btn_getMVs.setEnabled(False)
@@ -164,9 +231,17 @@ class TabMotion(QWidget):
         self.current_ohw.videometa['fps'] = float(self.parent.tab_input.edit_fps.text())
         self.current_ohw.videometa['microns_per_px'] = float(self.parent.tab_input.edit_mpp.text())
         
+        method = self.combo_method.currentData()
+        search = self.combo_search.currentData()
         blockwidth = self.spinbox_blockwidth.value()
         maxShift = self.spinbox_maxShift.value()
         delay = self.spinbox_delay.value()
+        stride = OHW.get_grid_stride(method, blockwidth, self.combo_grid.currentData())
+        method_options = {}
+        if method == 'BMR':
+            method_options["reference_frame"] = self.spinbox_reference.value() if self.spinbox_reference.value() >= 0 else 'auto'
+        if self.check_drift.isChecked() and OFlowCalc.motion_backends[method]["drift"]:
+            method_options["drift_compensation"] = True
         
         px_longest = None
         scaling_status = self.check_scaling.isChecked()
@@ -199,14 +274,77 @@ class TabMotion(QWidget):
         self.current_ohw.analysis_meta["scaling_status"] = scaling_status
         self.current_ohw.analysis_meta["filter_status"] = filter_status
         
-        calculate_motion_thread = self.current_ohw.calculate_motion_thread(
-            blockwidth = blockwidth, delay = delay, max_shift = maxShift, canny = canny_status)
+        threads = self.parent.config.getint('DEFAULT VALUES', 'threads', fallback = 1) # threads for blockmatching of each frame pair
+        calculate_motion_thread = self.current_ohw.calculate_motion_thread(method = method,
+            blockwidth = blockwidth, delay = delay, max_shift = maxShift, canny = canny_status, threads = threads, search = search, 
+            stride = stride, **method_options)
         calculate_motion_thread.start()
         calculate_motion_thread.progressSignal.connect(self.updateMVProgressBar)
         calculate_motion_thread.finished.connect(self.finish_motion)
 
+    def init_rois(self):
+        '''
+            shows ROIs of current_ohw, only rectangles can be edited (ROIs set as masks are shown by name)
+        '''
+        rois = self.current_ohw.analysis_meta.get("rois", [])
+        rectangles = all(not isinstance(region, np.ndarray) for name, region in rois)
+        self.line_rois.setText(str(dict(rois)) if rectangles else str([name for name, region in rois]))
+        self.line_rois.setEnabled(self.current_ohw.video_loaded and rectangles)
+        self.btn_rois.setEnabled(self.current_ohw.video_loaded and rectangles)
+    
+    def on_apply_rois(self):
+        '''
+            sets edited ROIs for the next motion calculation and saves them into the ROI file of the video
+            (rois.txt or <videoname>_rois.txt, see videoreader.get_rois_path)
+        '''
+        try:
+            rois = videoreader.parse_rois(self.line_rois.text())
+        except ValueError as error:
+            helpfunctions.msgbox(self, str(error), msg_title = 'Invalid ROIs')
+            return
+        self.current_ohw.set_rois(rois)
+        videoreader.save_rois_file(self.current_ohw.videometa["inputpath"], rois)
+        self.line_rois.setText(str(dict(rois)))
+        if self.current_ohw.analysis_meta["motion_calculated"]:
+            helpfunctions.msgbox(self, 'ROIs are used from the next motion calculation on', msg_title = 'ROIs set')
+    
+    def on_tune(self):
+        '''
+            proposes blockwidth + maximum shift from a few frame pairs around the motion maximum (see OHW.tune_BM_parameters)
+        '''
+        method = self.combo_method.currentData()
+        if method not in OHW.tuning_methods:
+            helpfunctions.msgbox(self, 'Blockwidth + maximum shift can only be proposed for blockmatching', msg_title = 'Not available')
+            return
+        self.btn_tune.setEnabled(False)
+        self.btn_getMVs.setEnabled(False)
+        
+        px_longest = 1024 if self.check_scaling.isChecked() else None
+        self.current_ohw.set_analysisImageStack(px_longest = px_longest)
+        self.current_ohw.analysis_meta.pop("BM_tuning", None)
+        reference_frame = self.spinbox_reference.value() if self.spinbox_reference.value() >= 0 else 'auto'
+        
+        threads = self.parent.config.getint('DEFAULT VALUES', 'threads', fallback = 1)
+        tune_thread = self.current_ohw.tune_BM_parameters_thread(method = method, blockwidth = self.spinbox_blockwidth.value(),
+            delay = self.spinbox_delay.value(), canny = self.check_canny.isChecked(), reference_frame = reference_frame, threads = threads)
+        tune_thread.start()
+        tune_thread.progressSignal.connect(self.updateMVProgressBar)
+        tune_thread.finished.connect(self.finish_tuning)
+    
+    def finish_tuning(self):
+        self.btn_tune.setEnabled(True)
+        self.btn_getMVs.setEnabled(True)
+        tuning = self.current_ohw.analysis_meta.get("BM_tuning")
+        if tuning is None:
+            return
+        self.spinbox_blockwidth.setValue(tuning["blockwidth"])
+        self.spinbox_maxShift.setValue(tuning["max_shift"])
+        
     def finish_motion(self):
         # saves ohw_object when calculation is done and other general results
+        if not self.current_ohw.analysis_meta["motion_calculated"]: # calculation stopped
+            self.btn_getMVs.setEnabled(True)
+            return
         self.current_ohw.init_motion()
         self.parent.init_ohw()
         
@@ -244,11 +382,21 @@ class TabMotion(QWidget):
         
     def set_motion_param(self):
         ''' sets values in gui from loaded ohw-file '''
+        method_idx = self.combo_method.findData(self.current_ohw.analysis_meta.get("Motion_method", "BM"))
+        self.combo_method.setCurrentIndex(max(method_idx, 0))
+        search_idx = self.combo_search.findData(self.current_ohw.analysis_meta["MV_parameters"].get("search", "exhaustive"))
+        self.combo_search.setCurrentIndex(max(search_idx, 0))
         self.spinbox_blockwidth.setValue(self.current_ohw.analysis_meta["MV_parameters"]["blockwidth"])
+        grid_idx = self.combo_grid.findData(self.current_ohw.analysis_meta["MV_parameters"]["blockwidth"] // self.current_ohw.get_stride())
+        self.combo_grid.setCurrentIndex(max(grid_idx, 0))
         self.spinbox_delay.setValue(self.current_ohw.analysis_meta["MV_parameters"]["delay"])
         self.spinbox_maxShift.setValue(self.current_ohw.analysis_meta["MV_parameters"]["max_shift"])
+        reference_frame = self.current_ohw.analysis_meta["MV_parameters"].get("reference_frame", -1)
+        self.spinbox_reference.setMaximum(max(self.spinbox_reference.maximum(), reference_frame))
+        self.spinbox_reference.setValue(reference_frame)
         
         self.check_canny.setChecked(self.current_ohw.analysis_meta["MV_parameters"]["canny"])
+        self.check_drift.setChecked(self.current_ohw.analysis_meta["MV_parameters"].get("drift_compensation", False))
         self.check_filter.setChecked(self.current_ohw.analysis_meta["filter_status"])
         self.check_scaling.setChecked(self.current_ohw.analysis_meta["scaling_status"])
         
@@ -207,7 +207,7 @@ class TabQuiver(QWidget):
             
         scale_max = helpfunctions.get_scale_maxMotion2(self.current_ohw.absMotions) #decide on which scale to use
         self.imshow_heatmaps = self.ax_heatmaps.imshow(self.current_ohw.absMotions[0], 
-            vmin = 0, vmax = scale_max, cmap = 'jet', interpolation = 'bilinear')
+            vmin = 0, vmax = scale_max, cmap = 'jet', interpolation = 'bilinear', extent = self.current_ohw.get_heatmap_extent())
 
         self.canvas_heatmaps.draw()
         """
@@ -231,13 +231,13 @@ class TabQuiver(QWidget):
     
     def init_quivers(self):
 
-        blockwidth = self.current_ohw.analysis_meta["MV_parameters"]["blockwidth"]
+        stride = self.current_ohw.get_stride() # distance of blocks in grid of motion
         microns_per_px = self.current_ohw.videometa["microns_per_px"]
         scalingfactor = self.current_ohw.analysis_meta["scalingfactor"]
         scale_max = helpfunctions.get_scale_maxMotion2(self.current_ohw.absMotions)
         
         skipquivers =  int(self.parent.config["DEFAULT QUIVER SETTINGS"]['quiver_density']) # store in ohw object!
-        distance_between_arrows = blockwidth * skipquivers
+        distance_between_arrows = stride * skipquivers
         arrowscale = 1 / (distance_between_arrows / scale_max)
         
         #self.MotionCoordinatesX, self.MotionCoordinatesY = np.meshgrid(np.arange(blockwidth/2, self.current_ohw.scaledImageStack.shape[2]-blockwidth/2, blockwidth)+1, np.arange(blockwidth/2, self.current_ohw.scaledImageStack.shape[1]-blockwidth/2+1, blockwidth))  #changed arange range, double check!
@@ -8,6 +8,8 @@ from PyQt5.QtWidgets import QMessageBox
 from PIL import ImageDraw, ImageFont, Image
 import requests
 import configparser
+from concurrent.futures import ThreadPoolExecutor
+from libraries import videoreader
 
 def get_figure_size(img, initial_val):
     ratio = img.shape[0]/img.shape[1]
@@ -102,10 +104,18 @@ def msgbox(self, message, msg_title = 'Successful'):
     if msg == QMessageBox.Ok:
         pass  
         
-def scale_ImageStack(imageStack, px_longest = 1024):
+# interpolations selectable for scaling of analysisImageStack (config: DEFAULT VALUES, scaling_interpolation)
+interpolations = {"nearest": cv2.INTER_NEAREST, "linear": cv2.INTER_LINEAR, "cubic": cv2.INTER_CUBIC, 
+                  "area": cv2.INTER_AREA, "lanczos": cv2.INTER_LANCZOS4}
+
+def scale_ImageStack(imageStack, px_longest = 1024, interpolation = cv2.INTER_AREA, threads = 1, lazy = False, chunksize = 16):
     """
         rescales imageStack such that longest side equals px_longest
         upscaling of smaller stack is prevented
+        interpolation: cv2 interpolation, INTER_AREA (default) averages pixels and avoids aliasing when downscaling
+        frames are scaled into a preallocated stack (no list of scaled frames + copy),
+        chunks of chunksize frames are distributed to threads (cv2.resize releases the GIL)
+        lazy: returns videoreader.ScaledStack which scales each frame when read instead
     """
     w, h = imageStack.shape[1], imageStack.shape[2]
     longest_side = max(w,h)
@@ -114,11 +124,29 @@ def scale_ImageStack(imageStack, px_longest = 1024):
     if scalingfactor >= 1: #prevent upscaling
         return imageStack, 1
     
-    scaledImages = []
-    for image in imageStack:
-        scaledImages.append(cv2.resize(image, None, fx = scalingfactor, fy = scalingfactor))
-
-    scaledImageStack = np.array(scaledImages)
+    if hasattr(imageStack, "get_view"): # videoreader.FrameStack: frames are scaled when read
+        print("scalingfactor: ", scalingfactor)
+        return imageStack.get_view(scalingfactor, interpolation), scalingfactor
+    
+    if lazy:
+        print("scalingfactor: ", scalingfactor)
+        return videoreader.ScaledStack(imageStack, scalingfactor, interpolation), scalingfactor
+    
+    firstimage = videoreader.scale_frame(imageStack[0], scalingfactor, interpolation)
+    scaledImageStack = np.empty((len(imageStack),) + firstimage.shape, dtype = firstimage.dtype)
+    
+    def scale_chunk(start):
+        for frame in range(start, min(start + chunksize, len(imageStack))):
+            videoreader.scale_frame(imageStack[frame], scalingfactor, interpolation, dst = scaledImageStack[frame])
+    
+    starts = range(0, len(imageStack), chunksize)
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers = threads) as executor:
+            list(executor.map(scale_chunk, starts))
+    else:
+        for start in starts:
+            scale_chunk(start)
+    
     print("shape of scaled down image stack: ", scaledImageStack.shape)
     print("scalingfactor: ", scalingfactor)
     
@@ -10,9 +10,10 @@ from moviepy.video.io.bindings import mplfig_to_npimage
 from libraries import helpfunctions, Filters
 
 
-def plot_Kinetics(timeindex, motion, plotoptions, hipeaks, lopeaks, file_name=None):
+def plot_Kinetics(timeindex, motion, plotoptions, hipeaks, lopeaks, file_name=None, ylabel=u'Mean Absolute Motion [\xb5m/s]'):
     """
         plots graph for beating kinetics "EKG"
+        ylabel: label of y-axis, e.g. for displacement trace
     """
     fig_kinetics, ax_kinetics = plt.subplots(1,1,figsize=(11,7))
     ax_kinetics.plot(timeindex, motion, '-', linewidth = 2) #self.fig_kinetics
@@ -26,7 +27,7 @@ def plot_Kinetics(timeindex, motion, plotoptions, hipeaks, lopeaks, file_name=No
     
     #self.ax.set_title('Beating kinetics', fontsize = 26)
     ax_kinetics.set_xlabel('t [s]', fontsize = 22)
-    ax_kinetics.set_ylabel(u'Mean Absolute Motion [\xb5m/s]', fontsize = 22)
+    ax_kinetics.set_ylabel(ylabel, fontsize = 22)
     ax_kinetics.tick_params(labelsize = 20)
     
     for side in ['top','right','bottom','left']:
@@ -39,19 +40,21 @@ def plot_Kinetics(timeindex, motion, plotoptions, hipeaks, lopeaks, file_name=No
     
     if file_name != None:
         fig_kinetics.savefig(str(file_name), dpi = 300, bbox_inches = 'tight') #, bbox_inches = 'tight', pad_inches = 0.4)
+        plt.close(fig_kinetics)
 
 def plot_TimeAveragedMotions(ohw_dataset, file_ext='.png'):
     avg_absMotion = ohw_dataset.avg_absMotion
     avg_MotionX, avg_MotionY = ohw_dataset.avg_MotionX, ohw_dataset.avg_MotionY
     max_avgMotion = ohw_dataset.max_avgMotion
     savefolder = ohw_dataset.analysis_meta["results_folder"]
+    extent = ohw_dataset.get_heatmap_extent()
     
     cmap_all = "jet"    #"inferno"
     
     ###### abs-motion
     fig_avgAmp, ax_avg_Amp = plt.subplots(1,1, figsize = (16,12))
     imshow_Amp_avg = ax_avg_Amp.imshow(avg_absMotion, 
-        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear")
+        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear", extent = extent)
     cbar = fig_avgAmp.colorbar(imshow_Amp_avg)
     cbar.ax.tick_params(labelsize=16)     
 
@@ -63,11 +66,15 @@ def plot_TimeAveragedMotions(ohw_dataset, file_ext='.png'):
 
     outputpath = str(savefolder / ('TimeAveraged_totalMotion' + file_ext))
     fig_avgAmp.savefig(outputpath, dpi = 100, bbox_inches = 'tight', pad_inches = 0.4)
+    
+    if not ohw_dataset.analysis_meta["has_MVs"]:
+        # intensity based motion (e.g. MuscleMotion): no x-/ y-motion available
+        return
 
     ##### x-motion
     fig_avgMotionX, ax_avgMotionX = plt.subplots(1,1, figsize = (16,12))
     imshow_Amp_avg = ax_avgMotionX.imshow(avg_MotionX, 
-        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear")
+        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear", extent = extent)
     cbar = fig_avgMotionX.colorbar(imshow_Amp_avg)
     cbar.ax.tick_params(labelsize=16)     
 
@@ -84,7 +91,7 @@ def plot_TimeAveragedMotions(ohw_dataset, file_ext='.png'):
     ##### y-motion
     fig_avgMotionY, ax_avgMotionY = plt.subplots(1,1, figsize = (16,12))
     imshow_Amp_avg = ax_avgMotionY.imshow(avg_MotionY, 
-        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear")
+        vmin = 0, vmax = max_avgMotion, cmap=cmap_all, interpolation="bilinear", extent = extent)
     cbar = fig_avgMotionY.colorbar(imshow_Amp_avg)
     cbar.ax.tick_params(labelsize=16)     
 
@@ -108,7 +115,8 @@ def save_heatmap(ohw_dataset, savepath, singleframe = False, *args, **kwargs):
     saveax_heatmaps.axis('off')
     
     scale_max = helpfunctions.get_scale_maxMotion2(absMotions)
-    imshow_heatmaps = saveax_heatmaps.imshow(absMotions[0], vmin = 0, vmax = scale_max, cmap = "jet", interpolation="bilinear")#  cmap="inferno"
+    imshow_heatmaps = saveax_heatmaps.imshow(absMotions[0], vmin = 0, vmax = scale_max, cmap = "jet", interpolation="bilinear", 
+        extent = ohw_dataset.get_heatmap_extent())#  cmap="inferno"
     
     cbar_heatmaps = savefig_heatmaps.colorbar(imshow_heatmaps)
     cbar_heatmaps.ax.tick_params(labelsize=20)
@@ -170,17 +178,15 @@ def save_quiver(ohw_dataset, savepath, singleframe = False, skipquivers = 1, t_c
     MotionX = MV_cutoff[:,0,:,:]
     MotionY = MV_cutoff[:,1,:,:]
 
-    blockwidth = ohw_dataset.analysis_meta["MV_parameters"]["blockwidth"]
-    MotionCoordinatesX, MotionCoordinatesY = np.meshgrid(
-            np.arange(blockwidth/2, analysisImageStack.shape[2], blockwidth), 
-            np.arange(blockwidth/2, analysisImageStack.shape[1], blockwidth))        
+    stride = ohw_dataset.get_stride()
+    MotionCoordinatesX, MotionCoordinatesY = ohw_dataset.MotionCoordinatesX, ohw_dataset.MotionCoordinatesY
        
     #prepare figure
     fig_quivers, ax_quivers = plt.subplots(1,1, figsize=(14,10), dpi = 150)
     ax_quivers.axis('off')   
     
     qslice=(slice(None,None,skipquivers),slice(None,None,skipquivers))
-    distance_between_arrows = blockwidth * skipquivers
+    distance_between_arrows = stride * skipquivers
     arrowscale = 1 / (distance_between_arrows / scale_max)
 
     imshow_quivers = ax_quivers.imshow(
@@ -243,10 +249,8 @@ def save_quiver3(ohw_dataset, savepath, singleframe = False, skipquivers = 1, t_
     MotionX = MV_cutoff[:,0,:,:]
     MotionY = MV_cutoff[:,1,:,:]
 
-    blockwidth = ohw_dataset.analysis_meta["MV_parameters"]["blockwidth"]
-    MotionCoordinatesX, MotionCoordinatesY = np.meshgrid(
-            np.arange(blockwidth/2, analysisImageStack.shape[2], blockwidth), 
-            np.arange(blockwidth/2, analysisImageStack.shape[1], blockwidth))        
+    stride = ohw_dataset.get_stride()
+    MotionCoordinatesX, MotionCoordinatesY = ohw_dataset.MotionCoordinatesX, ohw_dataset.MotionCoordinatesY
        
     #prepare figure
     outputfigure = plt.figure(figsize=(14,10), dpi = 150)#figsize=(6.5,12)
@@ -279,7 +283,7 @@ def save_quiver3(ohw_dataset, savepath, singleframe = False, skipquivers = 1, t_
             analysisImageStack[0], vmin = videometa["Blackval"], vmax = videometa["Whiteval"], cmap = "gray")
     
     qslice=(slice(None,None,skipquivers),slice(None,None,skipquivers))
-    distance_between_arrows = blockwidth * skipquivers
+    distance_between_arrows = stride * skipquivers
     arrowscale = 1 / (distance_between_arrows / scale_max)
            
     imshow_quivers = saveax_quivers.imshow(analysisImageStack[0], vmin = videometa["Blackval"], vmax = videometa["Whiteval"], cmap = "gray")
@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import pathlib # change to pathlib from Python 3.4 instead of os
+import collections
+import ast
 import tifffile
 import numpy as np
 import cv2
 
-def import_video(inputpath):
+def scale_frame(image, scalingfactor, interpolation = cv2.INTER_AREA, dst = None):
+    """
+        resizes single frame by scalingfactor, written into dst if given (array of scaled shape)
+        INTER_AREA averages all pixels covered by a scaled pixel -> no aliasing when downscaling
+    """
+    return cv2.resize(image, None, dst = dst, fx = scalingfactor, fy = scalingfactor, interpolation = interpolation)
+
+def import_video(inputpath, out_of_core = False):
     """
         imports video from path
         possible inputs:
             - videofile (.avi/.mov/.mp4)
             - folder with .tif-files (select one tif-file in folder)
+        out_of_core: frames are not loaded into memory but read on demand, see FrameStack
     """
     extension = inputpath.suffix
     if extension not in ['.tif','.avi','.mov','.mp4']:
@@ -19,7 +29,9 @@ def import_video(inputpath):
     
     print('importing video from path:', inputpath, "\nwith the file extension:", extension)
     
-    if extension == '.tif':
+    if out_of_core:
+        rawImageStack, videometa = open_framestack(inputpath)
+    elif extension == '.tif':
         rawImageStack, videometa = read_imagestack(inputpath)
     else:
         rawImageStack, videometa = read_videofile(inputpath)
@@ -33,10 +45,9 @@ def read_imagestack(inputpath, *args, **kwargs):
         reads folder with sequence of tif-files
     """
 
-    inputtifs = list(inputpath.parent.glob('*.tif'))  # or use sorted instead of list    
+    inputtifs = sorted(inputpath.parent.glob('*.tif'))  # glob order is arbitrary, frames are ordered by filename
 
-    rawImageStack = tifffile.imread(inputtifs, pattern = '')
-    rawImageStack = rawImageStack.astype(np.float32)    #convert as cv2 needs float32 for templateMatching
+    rawImageStack = tifffile.imread(inputtifs, pattern = '') # dtype of tifs is kept (e.g. uint16), algorithms convert single frames if needed
 
     videometa = get_videoinfos_file(inputpath)
     videometa['frameCount']=len(inputtifs)
@@ -44,7 +55,7 @@ def read_imagestack(inputpath, *args, **kwargs):
     videometa['frameHeight']=rawImageStack.shape[2]
     videometa['input_type'] = 'tifstack'
     
-    if ('Blackval' or 'Whiteval') not in videometa.keys():
+    if 'Blackval' not in videometa or 'Whiteval' not in videometa:
         videometa["Blackval"], videometa["Whiteval"] = np.percentile(rawImageStack[0], (0.1, 99.9))  #set default values if no infos defined in videoinfos file
 
     return rawImageStack, videometa
@@ -67,6 +78,62 @@ def get_videoinfos_file(inputpath):
             videometa[key] = value
     return videometa
     
+def get_rois_path(inputpath):
+    """
+        path of ROI file: rois.txt in inputfolder (tif series) or <videoname>_rois.txt (videofile)
+    """
+    if inputpath.suffix == '.tif':
+        return inputpath.parent / "rois.txt"
+    return inputpath.parent / (inputpath.stem + "_rois.txt")
+
+def get_rois_file(inputpath):
+    """
+        reads ROIs from ROI file (see get_rois_path, format see parse_rois)
+        returns list of (name, rectangle) sorted by name, empty list if no file exists
+    """
+    path_rois = get_rois_path(inputpath)
+    if not path_rois.is_file():
+        return []
+    
+    print("reading ROIs from", path_rois)
+    filereader = path_rois.open("r")
+    rois = parse_rois(filereader.read())
+    filereader.close()
+    return rois
+
+def parse_rois(text):
+    """
+        parses ROIs from text containing a python dict {name: (x, y, width, height)} 
+        with rectangles in coordinates of raw image, e.g. {'left': (0, 0, 512, 1024), 'right': (512, 0, 512, 1024)}
+        only literals are evaluated (ast.literal_eval), raises ValueError for other content
+        returns list of (name, rectangle) sorted by name
+    """
+    try:
+        rois = ast.literal_eval(text.strip() or "{}")
+    except SyntaxError:
+        raise ValueError("ROIs are no valid dict: " + text)
+    if not isinstance(rois, dict):
+        raise ValueError("ROIs are no dict {name: (x, y, width, height)}: " + text)
+    for name, region in rois.items():
+        if (not isinstance(region, (tuple, list)) or len(region) != 4 
+            or not all(isinstance(value, (int, float)) for value in region)):
+            raise ValueError("ROI " + str(name) + " is no rectangle (x, y, width, height): " + str(region))
+    return sorted((str(name), tuple(region)) for name, region in rois.items())
+
+def save_rois_file(inputpath, rois):
+    """
+        writes rectangle ROIs (list of (name, rectangle)) into ROI file (see get_rois_path), 
+        file is removed if no ROIs are given
+    """
+    path_rois = get_rois_path(inputpath)
+    if len(rois) == 0:
+        if path_rois.is_file():
+            path_rois.unlink()
+        return
+    filewriter = path_rois.open("w")
+    filewriter.write(str(dict(rois)))
+    filewriter.close()
+    
 def read_videofile(inputpath):
     """
         reads single .mp4/.avi/.mov file
@@ -93,4 +160,222 @@ def read_videofile(inputpath):
     videometa["input_type"] = 'videofile'
 
     cap.release()
-    return rawImageStack, videometa
\ No newline at end of file
+    return rawImageStack, videometa
+
+def open_framestack(inputpath):
+    """
+        opens videofile or folder with tif-files as FrameStack, no frames are read into memory
+        returns same videometa as read_imagestack/ read_videofile
+    """
+    if inputpath.suffix == '.tif':
+        inputtifs = sorted(inputpath.parent.glob('*.tif'))   # same frame order as read_imagestack
+        rawImageStack = FrameStack(inputtifs, 'tifstack')
+        videometa = get_videoinfos_file(inputpath)
+        videometa['frameCount'] = rawImageStack.shape[0]
+        videometa['frameWidth'] = rawImageStack.shape[1]
+        videometa['frameHeight'] = rawImageStack.shape[2]
+    else:
+        rawImageStack = FrameStack([inputpath], 'videofile')
+        cap = cv2.VideoCapture(str(inputpath))
+        videometa = {'frameCount':rawImageStack.shape[0], 'frameWidth':rawImageStack.shape[2], 
+            'frameHeight':rawImageStack.shape[1], 'fps':cap.get(cv2.CAP_PROP_FPS)}
+        cap.release()
+    videometa['input_type'] = rawImageStack.input_type
+    
+    if 'Blackval' not in videometa or 'Whiteval' not in videometa:
+        videometa["Blackval"], videometa["Whiteval"] = np.percentile(rawImageStack[0], (0.1, 99.9))
+    
+    print("frames are read on demand (out of core), shape:", rawImageStack.shape)
+    return rawImageStack, videometa
+
+class FrameStack():
+    """
+        read-only imagestack of a videofile or tif series for videos larger than memory
+        behaves like the array of read_imagestack/ read_videofile for the access used by the analysis:
+        shape, dtype, len, iteration and indexing of single frames (stack[frame])
+        frames are decoded when requested and kept in a ring buffer of the last buffersize frames
+        -> e.g. buffersize = delay + 1 for blockmatching, each frame of a videofile is decoded once
+        stack[:, y0:y1, x0:x1] and get_view(scalingfactor) return FrameStacks which crop/ scale each frame when read
+    """
+    def __init__(self, files, input_type, roi = None, scalingfactor = 1, buffersize = 3, interpolation = cv2.INTER_AREA):
+        self.files = files
+        self.input_type = input_type
+        self.roi = roi                      # (x, y, width, height) in raw coordinates
+        self.scalingfactor = scalingfactor
+        self.interpolation = interpolation  # cv2 interpolation used for scaling
+        self.buffersize = buffersize
+        
+        self.buffer = collections.OrderedDict() # frame: image, oldest frame is dropped first
+        self.capture = None                 # cv2.VideoCapture of videofile, opened on first read
+        self.next_frame = 0                 # frame which is decoded by next read of capture
+        self.range = None                   # (min, max) of intensity, see get_range
+        
+        if input_type == 'videofile':
+            cap = cv2.VideoCapture(str(files[0]))
+            frameCount = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+        else:
+            frameCount = len(files)
+        firstimage = self.get_frame(0)
+        self.shape = (frameCount,) + firstimage.shape
+        self.dtype = firstimage.dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for frame in range(self.shape[0]):
+            yield self[frame]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 3 and key[0] == slice(None):
+            # crop as analysisImageStack[:, y0:y1, x0:x1]
+            rows, cols = key[1], key[2]
+            y, x = rows.start or 0, cols.start or 0
+            height = (rows.stop if rows.stop != None else self.shape[1]) - y
+            width = (cols.stop if cols.stop != None else self.shape[2]) - x
+            if self.roi != None or self.scalingfactor != 1:
+                raise IndexError("crop FrameStack before scaling")
+            return FrameStack(self.files, self.input_type, roi = (x, y, width, height), buffersize = self.buffersize)
+        
+        frame = int(key)
+        if frame < 0:
+            frame += self.shape[0]
+        if not 0 <= frame < self.shape[0]:
+            raise IndexError("frame " + str(key) + " out of range")
+        return self.get_frame(frame)
+
+    def get_view(self, scalingfactor, interpolation = cv2.INTER_AREA):
+        """
+            returns FrameStack of same frames, scaled by scalingfactor when read (as helpfunctions.scale_ImageStack)
+        """
+        return FrameStack(self.files, self.input_type, roi = self.roi, scalingfactor = scalingfactor, 
+            buffersize = self.buffersize, interpolation = interpolation)
+
+    def set_buffersize(self, buffersize):
+        self.buffersize = max(self.buffersize, buffersize)
+
+    def get_frame(self, frame):
+        if frame in self.buffer:
+            return self.buffer[frame]
+        
+        if self.input_type == 'tifstack':
+            self.add_to_buffer(frame, tifffile.imread(str(self.files[frame])))
+            return self.buffer[frame]
+        
+        if self.capture is None or frame < self.next_frame:
+            # (re)start decoding at frame, e.g. when going back in video
+            if self.capture is None:
+                self.capture = cv2.VideoCapture(str(self.files[0]))
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            self.next_frame = frame
+        while self.next_frame <= frame:
+            # decode frames in order, frames between are buffered if they fit into buffer
+            if self.next_frame > frame - self.buffersize:
+                ret, image = self.capture.read()
+                if ret:
+                    self.add_to_buffer(self.next_frame, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+            else:
+                ret = self.capture.grab()
+            if not ret:
+                raise IndexError("frame " + str(self.next_frame) + " could not be read from " + str(self.files[0]))
+            self.next_frame += 1
+        return self.buffer[frame]
+
+    def add_to_buffer(self, frame, image):
+        if self.roi != None:
+            x, y, width, height = [int(value) for value in self.roi]
+            image = image[y:y+height, x:x+width]
+        if self.scalingfactor != 1:
+            image = scale_frame(image, self.scalingfactor, self.interpolation)
+        self.buffer[frame] = image
+        while len(self.buffer) > self.buffersize:
+            self.buffer.popitem(last = False)
+
+    def get_range(self):
+        """
+            (min, max) of all frames, determined once by reading all frames
+        """
+        if self.range is None:
+            minima, maxima = zip(*[(image.min(), image.max()) for image in self])
+            self.range = (min(minima), max(maxima))
+        return self.range
+
+    def min(self):
+        return self.get_range()[0]
+
+    def max(self):
+        return self.get_range()[1]
+
+    def fingerprint(self):
+        """
+            identifies content without reading all frames: files with size + modification time, crop and scaling
+        """
+        files = [(str(file), file.stat().st_size, file.stat().st_mtime) for file in map(pathlib.Path, self.files)]
+        return repr((files, self.shape, self.dtype.str, self.roi, self.scalingfactor, self.interpolation))
+
+    def __getstate__(self):
+        """
+            pickled without decoded frames + capture (e.g. for worker processes), each copy reads its frames itself
+        """
+        state = dict(self.__dict__)
+        state.update({"buffer": collections.OrderedDict(), "capture": None, "next_frame": 0})
+        return state
+
+    def get_copy(self):
+        """
+            FrameStack of same frames with own buffer + capture, e.g. in a forked worker process
+            (a capture must not be shared between processes)
+        """
+        stack = FrameStack.__new__(FrameStack)
+        stack.__dict__.update(self.__getstate__())
+        return stack
+
+    def release(self):
+        if self.capture != None:
+            self.capture.release()
+            self.capture = None
+        self.buffer.clear()
+
+class ScaledStack():
+    """
+        imagestack in memory, each frame is scaled when read (lazy version of helpfunctions.scale_ImageStack)
+        no scaled copy of the whole stack is kept, same access as FrameStack:
+        shape, dtype, len, iteration and indexing of single frames (stack[frame]), min/ max
+    """
+    def __init__(self, imageStack, scalingfactor, interpolation = cv2.INTER_AREA):
+        self.imageStack = imageStack
+        self.scalingfactor = scalingfactor
+        self.interpolation = interpolation
+        self.range = None                   # (min, max) of intensity, see get_range
+        
+        firstimage = self[0]
+        self.shape = (len(imageStack),) + firstimage.shape
+        self.dtype = firstimage.dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for frame in range(self.shape[0]):
+            yield self[frame]
+
+    def __getitem__(self, key):
+        return scale_frame(self.imageStack[int(key)], self.scalingfactor, self.interpolation)
+
+    def get_range(self):
+        """
+            (min, max) of all scaled frames, determined once by scaling all frames
+        """
+        if self.range is None:
+            minima, maxima = zip(*[(image.min(), image.max()) for image in self])
+            self.range = (min(minima), max(maxima))
+        return self.range
+
+    def min(self):
+        return self.get_range()[0]
+
+    def max(self):
+        return self.get_range()[1]